@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# /// script
+# requires-python = ">=3.9"
+# dependencies = ["tiktoken"]
+# ///
+"""
+Benchmark harness for scan-project.py.
+Generates a deterministic synthetic repository, times the scanner's phases
+(walk + ignore matching, scan, detectors, format_summary) in-process and the
+whole CLI end to end (with peak RSS), and compares against a stored baseline.
+
+Run with: uv run bench-scan.py --preset medium --baseline bench-baseline.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import importlib
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SCANNER = Path(__file__).with_name("scan-project.py")
+GENERATOR_VERSION = 1
+# Phases faster than this differ mostly by timer noise; smaller slowdowns never fail
+MIN_REGRESSION_SECONDS = 0.005
+
+PRESETS = {
+    "small": {"files": 1_000, "depth": 3, "fanout": 4},
+    "medium": {"files": 10_000, "depth": 4, "fanout": 6},
+    "large": {"files": 100_000, "depth": 5, "fanout": 8},
+    "huge": {"files": 1_000_000, "depth": 6, "fanout": 10},
+}
+
+DEFAULT_LANGUAGES = "python=30,typescript=25,go=10,rust=5,markdown=15,json=10,yaml=5"
+
+# Extension and a line template per language; {i} and {w} vary the content
+LANGUAGES = {
+    "python": (".py", "def {w}_{i}(value, count={i}):\n    return [value * n for n in range(count)]  # {w}\n"),
+    "typescript": (".ts", "export function {w}{i}(input: string): number {{\n  return input.length + {i}; // {w}\n}}\n"),
+    "javascript": (".js", "export const {w}{i} = (items) => items.filter((x) => x > {i}); // {w}\n"),
+    "go": (".go", "func {w}{i}(ctx context.Context, n int) (int, error) {{\n\treturn n + {i}, nil // {w}\n}}\n"),
+    "rust": (".rs", "pub fn {w}_{i}(input: &str) -> usize {{\n    input.len() + {i} // {w}\n}}\n"),
+    "java": (".java", "    public int {w}{i}(int value) {{ return value + {i}; }} // {w}\n"),
+    "markdown": (".md", "## {w} {i}\n\nThe {w} section describes step {i} of the pipeline in plain prose.\n\n"),
+    "json": (".json", "  \"{w}_{i}\": {{\"enabled\": true, \"weight\": {i}, \"label\": \"{w}\"}},\n"),
+    "yaml": (".yaml", "{w}_{i}:\n  enabled: true\n  weight: {i}\n"),
+}
+
+WORDS = [
+    "alpha", "bravo", "cache", "delta", "event", "fetch", "graph", "index", "join",
+    "kernel", "layout", "merge", "node", "parse", "query", "route", "store", "token",
+    "update", "value", "worker", "yield", "zone", "buffer", "config", "render",
+]
+
+
+def load_scanner():
+    """Import scan_project.py, the module behind the scan-project.py entry point."""
+    sys.path.insert(0, str(SCANNER.parent))
+    return importlib.import_module("scan_project")
+
+
+def parse_languages(spec: str) -> dict[str, float]:
+    """Parse "python=30,go=10" into normalized weights."""
+    weights = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in LANGUAGES:
+            raise ValueError(f"unknown language '{name}' (choose from {', '.join(sorted(LANGUAGES))})")
+        weights[name] = float(weight or 1)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError("language weights must be positive")
+    return {name: w / total for name, w in weights.items()}
+
+
+def repo_key(params: dict) -> str:
+    """Stable id of a generator configuration."""
+    data = json.dumps({"version": GENERATOR_VERSION, **params}, sort_keys=True)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:12]
+
+
+def file_content(rng: random.Random, language: str, index: int, size: int) -> bytes:
+    """Text of roughly `size` bytes in the style of the language."""
+    template = LANGUAGES[language][1]
+    parts = []
+    length = 0
+    i = index * 1000
+    while length < size:
+        line = template.format(i=i, w=rng.choice(WORDS))
+        parts.append(line)
+        length += len(line)
+        i += 1
+    return "".join(parts).encode("utf-8")[:max(size, 1)]
+
+
+def generate_repo(dest: Path, params: dict) -> dict:
+    """Write a synthetic repository to dest, deterministically from params.
+
+    Files are spread over a directory tree of the given depth and fan-out
+    (under packages/pkg-N/ when workspaces > 0, each with a package.json).
+    Sizes are log-normal around size_median; binary_ratio of the files are
+    random bytes; the root .gitignore holds ignore_rules rules, some of which
+    match generated build output that the scanner must prune.
+    Returns the generated file count and bytes (ignored files excluded).
+    """
+    rng = random.Random(params["seed"])
+    languages = parse_languages(params["languages"])
+    names, weights = list(languages), list(languages.values())
+
+    if dest.exists():
+        shutil.rmtree(dest)
+    dest.mkdir(parents=True)
+
+    # Directory tree: every node up to `depth` levels, `fanout` children each
+    roots = [f"packages/pkg-{n}" for n in range(params["workspaces"])] or [""]
+    dirs = []
+    for base in roots:
+        level = [base]
+        dirs.append(base)
+        for depth in range(params["depth"]):
+            level = [
+                f"{parent}/{rng.choice(WORDS)}-{depth}{k}".lstrip("/")
+                for parent in level for k in range(params["fanout"])
+            ]
+            # Cap the tree so deep/wide settings stay proportional to the file count
+            level = level[:max(1, params["files"] // 4)]
+            dirs.extend(level)
+    for d in dirs:
+        (dest / d).mkdir(parents=True, exist_ok=True)
+
+    # Ignore rules: a few that match generated output, the rest never match
+    rules = ["*.log", "build/", "dist/", "**/tmp-*.txt", "!keep-0.log"]
+    rules.extend(
+        f"generated-{n}/" if n % 2 else f"*.cache{n}" for n in range(max(0, params["ignore_rules"] - len(rules)))
+    )
+    if params["ignore_rules"]:
+        (dest / ".gitignore").write_text("\n".join(rules[:params["ignore_rules"]]) + "\n")
+
+    if params["workspaces"]:
+        (dest / "package.json").write_text(json.dumps({
+            "name": "bench-monorepo", "private": True, "workspaces": ["packages/*"],
+        }, indent=2) + "\n")
+        for n, base in enumerate(roots):
+            (dest / base / "package.json").write_text(json.dumps({
+                "name": f"@bench/pkg-{n}", "version": "1.0.0", "dependencies": {"react": "^18.0.0"},
+            }, indent=2) + "\n")
+
+    median = params["size_median"]
+    files = 0
+    total_bytes = 0
+    for index in range(params["files"]):
+        parent = rng.choice(dirs)
+        size = min(int(rng.lognormvariate(math.log(median), params["size_sigma"])), 4 * 1024 * 1024)
+        roll = rng.random()
+        if roll < params["binary_ratio"]:
+            name = f"asset-{index}.bin"
+            data = rng.randbytes(min(size, 4096)) + b"\0"
+        elif roll < params["binary_ratio"] + params["ignored_ratio"]:
+            # Ignored output: pruned as a directory or matched by name
+            if index % 2:
+                parent = f"{parent}/build".lstrip("/")
+                (dest / parent).mkdir(exist_ok=True)
+                name = f"out-{index}.js"
+            else:
+                name = f"run-{index}.log"
+            (dest / parent / name).write_bytes(b"x" * min(size, 1024))
+            continue
+        else:
+            language = rng.choices(names, weights)[0]
+            name = f"{rng.choice(WORDS)}-{index}{LANGUAGES[language][0]}"
+            data = file_content(rng, language, index, size)
+        (dest / parent / name).write_bytes(data)
+        files += 1
+        total_bytes += len(data)
+
+    info = {"key": repo_key(params), "params": params, "files": files, "bytes": total_bytes}
+    (dest / ".bench-repo.json").write_text(json.dumps(info, indent=2) + "\n")
+    return info
+
+
+def ensure_repo(workdir: Path, params: dict, regenerate: bool = False) -> tuple[Path, dict]:
+    """Reuse the generated repository for params under workdir, or generate it."""
+    dest = workdir / repo_key(params)
+    marker = dest / ".bench-repo.json"
+    if not regenerate:
+        try:
+            info = json.loads(marker.read_text())
+            if info.get("params") == params:
+                return dest, info
+        except (OSError, ValueError):
+            pass
+    print(f"Generating {params['files']:,} files in {dest} ...", file=sys.stderr)
+    return dest, generate_repo(dest, params)
+
+
+def best_of(repeat: int, fn) -> tuple[float, object]:
+    """Run fn `repeat` times; return the fastest wall time and the last result."""
+    best = math.inf
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def run_end_to_end(
+    root: Path, encoding: str, encoding_file: Path | None, jobs: int, processes: bool = False
+) -> tuple[float, float]:
+    """Run the scanner CLI once; return (wall seconds, peak RSS in MB).
+
+    With processes, the peak RSS is the scanner's own, not its workers'.
+    """
+    cmd = [sys.executable, str(SCANNER), str(root), "--no-cache", "--encoding", encoding, "-j", str(jobs)]
+    if encoding_file:
+        cmd += ["--encoding-file", str(encoding_file)]
+    if processes:
+        cmd.append("--processes")
+    with tempfile.TemporaryFile() as err:
+        started = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=err)
+        # wait4 reports the rusage of this child alone
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - started
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode != 0:
+            err.seek(0)
+            message = err.read().decode("utf-8", errors="replace").strip()
+            raise RuntimeError(f"scanner exited with {proc.returncode}: {message}")
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return wall, rss
+
+
+def run_benchmark(
+    root: Path,
+    info: dict,
+    encoding_name: str,
+    encoding_file: Path | None,
+    jobs: int,
+    repeat: int,
+    processes: bool = False,
+) -> dict:
+    """Time each phase (best of `repeat`) and return {phase: metrics}.
+
+    With processes, the scan phases read and tokenize in worker processes
+    (scan-project.py --processes); workers load the encoding themselves.
+    """
+    sp = load_scanner()
+    encoding = sp.load_encoding(encoding_name, encoding_file)
+    if processes:
+        encoding = sp.LazyEncoding(encoding_name, encoding_file)  # workers load their own copy
+    results: dict[str, dict] = {}
+
+    def walk() -> int:
+        return sum(1 for event in sp.iter_walk(root, sp.IgnoreEngine(root)) if event[0] == "file")
+
+    seconds, walked = best_of(repeat, walk)
+    results["walk"] = {"seconds": seconds, "files": walked, "files_per_s": walked / seconds}
+
+    seconds, scan = best_of(
+        repeat, lambda: sp.collect_scan(sp.iter_scan(root, encoding, jobs=jobs, processes=processes))
+    )
+    scanned_bytes = sum(f["size_bytes"] for f in scan["files"])
+    results["scan"] = {
+        "seconds": seconds,
+        "files": len(scan["files"]),
+        "files_per_s": len(scan["files"]) / seconds,
+        "mb_per_s": scanned_bytes / 1e6 / seconds,
+        "tokens": scan["total_tokens"],
+    }
+
+    seconds, profile = best_of(repeat, lambda: sp.detect_project_profile(root))
+    results["detectors"] = {"seconds": seconds}
+
+    full = {**scan, **profile}
+    seconds, _ = best_of(repeat, lambda: sp.format_summary(full))
+    results["format_summary"] = {"seconds": seconds, "files_per_s": len(scan["files"]) / seconds}
+
+    runs = [run_end_to_end(root, encoding_name, encoding_file, jobs, processes) for _ in range(repeat)]
+    seconds = min(wall for wall, _ in runs)
+    results["end_to_end"] = {
+        "seconds": seconds,
+        "files_per_s": info["files"] / seconds,
+        "mb_per_s": info["bytes"] / 1e6 / seconds,
+        "peak_rss_mb": max(rss for _, rss in runs),
+    }
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Regressions of results against baseline: slower (or larger peak RSS) by more than threshold."""
+    regressions = []
+    for phase, metrics in results.items():
+        base = baseline.get(phase)
+        if not base:
+            continue
+        for key in ("seconds", "peak_rss_mb"):
+            if key in metrics and base.get(key):
+                change = metrics[key] / base[key] - 1
+                if key == "seconds" and metrics[key] - base[key] < MIN_REGRESSION_SECONDS:
+                    continue
+                if change > threshold:
+                    regressions.append(
+                        f"{phase} {key}: {metrics[key]:.3f} vs baseline {base[key]:.3f} "
+                        f"(+{change:.1%} > {threshold:.0%})"
+                    )
+    return regressions
+
+
+def format_results(results: dict, baseline: dict | None = None) -> str:
+    """Format phase metrics (and the change against a baseline) as a table."""
+    lines = [f"{'phase':<16} {'seconds':>9} {'files/s':>12} {'MB/s':>9} {'RSS MB':>8} {'vs base':>9}"]
+    for phase, m in results.items():
+        base = (baseline or {}).get(phase, {})
+        change = f"{m['seconds'] / base['seconds'] - 1:+.1%}" if base.get("seconds") else ""
+        files_per_s = f"{m['files_per_s']:,.0f}" if "files_per_s" in m else ""
+        mb_per_s = f"{m['mb_per_s']:.1f}" if "mb_per_s" in m else ""
+        rss = f"{m['peak_rss_mb']:.1f}" if "peak_rss_mb" in m else ""
+        lines.append(f"{phase:<16} {m['seconds']:>9.3f} {files_per_s:>12} {mb_per_s:>9} {rss:>8} {change:>9}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark scan-project.py on a deterministic synthetic repository",
+    )
+    parser.add_argument(
+        "--preset", choices=sorted(PRESETS), default="small",
+        help="File count / depth / fan-out preset: small 1k, medium 10k, large 100k, huge 1M (default: small)",
+    )
+    parser.add_argument("--files", type=int, default=None, help="Number of files (overrides the preset)")
+    parser.add_argument("--depth", type=int, default=None, help="Directory depth (overrides the preset)")
+    parser.add_argument("--fanout", type=int, default=None, help="Subdirectories per directory (overrides the preset)")
+    parser.add_argument(
+        "--languages", default=DEFAULT_LANGUAGES,
+        help=f"Language mix as name=weight pairs (default: {DEFAULT_LANGUAGES})",
+    )
+    parser.add_argument("--size-median", type=int, default=2048, help="Median file size in bytes (default: 2048)")
+    parser.add_argument("--size-sigma", type=float, default=1.2, help="Log-normal size spread (default: 1.2)")
+    parser.add_argument("--ignore-rules", type=int, default=20, help="Rules in the root .gitignore (default: 20)")
+    parser.add_argument("--ignored-ratio", type=float, default=0.05, help="Share of files that are ignored (default: 0.05)")
+    parser.add_argument("--binary-ratio", type=float, default=0.05, help="Share of binary files (default: 0.05)")
+    parser.add_argument("--workspaces", type=int, default=0, help="Monorepo packages under packages/ (default: 0)")
+    parser.add_argument("--seed", type=int, default=0, help="Generator seed (default: 0)")
+    parser.add_argument(
+        "--workdir", type=Path, default=None,
+        help="Where generated repositories are kept (default: <scan cache dir>/bench)",
+    )
+    parser.add_argument("--regenerate", action="store_true", help="Regenerate the repository even if it exists")
+    parser.add_argument("--encoding", default="cl100k_base", help="Tiktoken encoding to use (default: cl100k_base)")
+    parser.add_argument("--encoding-file", type=Path, default=None, help="Local .tiktoken BPE file (offline)")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="Scanner worker threads (default: available CPUs)")
+    parser.add_argument(
+        "--processes", action="store_true", help="Scan in --jobs worker processes (scan-project.py --processes)"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per phase; the fastest counts (default: 3)")
+    parser.add_argument("--baseline", type=Path, default=None, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", type=Path, default=None, help="Write this run's results as a baseline")
+    parser.add_argument(
+        "--threshold", type=float, default=0.10,
+        help="Fail when a phase is slower than the baseline by more than this fraction (default: 0.10)",
+    )
+    args = parser.parse_args()
+
+    preset = PRESETS[args.preset]
+    params = {
+        "files": args.files if args.files is not None else preset["files"],
+        "depth": args.depth if args.depth is not None else preset["depth"],
+        "fanout": args.fanout if args.fanout is not None else preset["fanout"],
+        "languages": args.languages,
+        "size_median": args.size_median,
+        "size_sigma": args.size_sigma,
+        "ignore_rules": args.ignore_rules,
+        "ignored_ratio": args.ignored_ratio,
+        "binary_ratio": args.binary_ratio,
+        "workspaces": args.workspaces,
+        "seed": args.seed,
+    }
+    if params["files"] < 1 or params["depth"] < 0 or params["fanout"] < 1 or args.repeat < 1:
+        print("ERROR: --files, --fanout and --repeat must be positive, --depth non-negative", file=sys.stderr)
+        sys.exit(1)
+    try:
+        parse_languages(params["languages"])
+    except ValueError as e:
+        print(f"ERROR: --languages: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    baseline = None
+    if args.baseline:
+        try:
+            baseline = json.loads(args.baseline.read_text())
+        except (OSError, ValueError) as e:
+            print(f"ERROR: Failed to read baseline {args.baseline}: {e}", file=sys.stderr)
+            sys.exit(1)
+        if baseline.get("params") != params:
+            print("WARNING: Baseline was recorded with different generator parameters", file=sys.stderr)
+
+    sp = load_scanner()
+    workdir = args.workdir or sp.default_cache_dir() / "bench"
+    jobs = args.jobs or sp.available_cpu_count()
+    root, info = ensure_repo(workdir, params, args.regenerate)
+    print(
+        f"Repository {root}: {info['files']:,} files, {info['bytes'] / 1e6:,.1f} MB "
+        f"(encoding {args.encoding}, {jobs} {'worker processes' if args.processes else 'jobs'}, "
+        f"best of {args.repeat})",
+        file=sys.stderr,
+    )
+
+    results = run_benchmark(root, info, args.encoding, args.encoding_file, jobs, args.repeat, args.processes)
+    print(format_results(results, baseline["results"] if baseline else None))
+
+    if args.save_baseline:
+        data = {
+            "params": params, "encoding": args.encoding, "jobs": jobs, "processes": args.processes, "results": results,
+        }
+        args.save_baseline.write_text(json.dumps(data, indent=2) + "\n")
+        print(f"Baseline written to {args.save_baseline}", file=sys.stderr)
+
+    if baseline:
+        regressions = compare(results, baseline["results"], args.threshold)
+        for line in regressions:
+            print(f"REGRESSION: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5889 @@
+"""
+Project Scanner for project-profiler skill.
+Scans a directory tree, respects .gitignore, and outputs file paths with token counts,
+tech stack detection, package metadata, and entry point identification.
+
+Forked from Cartographer's scan-codebase.py with additional profiling capabilities.
+
+Run with: uv run scan-project.py [path] --format json
+(scan-project.py is a thin entry point; the implementation lives here so
+that Python caches its bytecode between runs.)
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import fnmatch
+import hashlib
+import json
+import mmap
+import os
+import re
+import stat
+import subprocess
+import sys
+import time
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Imported lazily (see load_encoding): runs that never tokenize skip it
+    import tiktoken
+
+# Default patterns to always ignore
+DEFAULT_IGNORE = {
+    # Directories
+    ".git", ".svn", ".hg", "node_modules", "__pycache__", ".pytest_cache",
+    ".mypy_cache", ".ruff_cache", "venv", ".venv", "env", ".env",
+    "dist", "build", ".next", ".nuxt", ".output", "coverage", ".coverage",
+    ".nyc_output", "target", "vendor", ".bundle", ".cargo",
+    # Files
+    ".DS_Store", "Thumbs.db",
+    "*.pyc", "*.pyo", "*.so", "*.dylib", "*.dll", "*.exe", "*.o", "*.a",
+    "*.lib", "*.class", "*.jar", "*.war", "*.egg", "*.whl",
+    "*.lock", "package-lock.json", "yarn.lock", "pnpm-lock.yaml",
+    "bun.lockb", "Cargo.lock", "poetry.lock", "Gemfile.lock", "composer.lock",
+    # Binary/media
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.ico", "*.svg", "*.webp",
+    "*.mp3", "*.mp4", "*.wav", "*.avi", "*.mov",
+    "*.pdf", "*.zip", "*.tar", "*.gz", "*.rar", "*.7z",
+    "*.woff", "*.woff2", "*.ttf", "*.eot", "*.otf",
+    # Large generated files
+    "*.min.js", "*.min.css", "*.map", "*.chunk.js", "*.bundle.js",
+}
+
+# Extension to language mapping
+EXT_TO_LANG = {
+    ".py": "python", ".pyi": "python", ".pyx": "python",
+    ".js": "javascript", ".jsx": "javascript", ".mjs": "javascript", ".cjs": "javascript",
+    ".ts": "typescript", ".tsx": "typescript", ".mts": "typescript", ".cts": "typescript",
+    ".go": "go",
+    ".rs": "rust",
+    ".rb": "ruby", ".rake": "ruby", ".gemspec": "ruby",
+    ".java": "java", ".kt": "kotlin", ".kts": "kotlin", ".scala": "scala",
+    ".cs": "csharp", ".fs": "fsharp", ".fsx": "fsharp",
+    ".swift": "swift", ".m": "objective-c", ".mm": "objective-c",
+    ".c": "c", ".h": "c", ".cpp": "cpp", ".cc": "cpp", ".cxx": "cpp", ".hpp": "cpp",
+    ".php": "php",
+    ".lua": "lua",
+    ".r": "r", ".R": "r",
+    ".jl": "julia",
+    ".ex": "elixir", ".exs": "elixir",
+    ".erl": "erlang", ".hrl": "erlang",
+    ".hs": "haskell", ".lhs": "haskell",
+    ".ml": "ocaml", ".mli": "ocaml",
+    ".clj": "clojure", ".cljs": "clojure", ".cljc": "clojure",
+    ".dart": "dart",
+    ".zig": "zig",
+    ".nim": "nim",
+    ".v": "v",
+    ".vue": "vue",
+    ".svelte": "svelte",
+    ".html": "html", ".htm": "html",
+    ".css": "css", ".scss": "scss", ".sass": "sass", ".less": "less",
+    ".sql": "sql",
+    ".sh": "shell", ".bash": "shell", ".zsh": "shell", ".fish": "shell",
+    ".yml": "yaml", ".yaml": "yaml",
+    ".json": "json", ".jsonc": "json",
+    ".toml": "toml",
+    ".xml": "xml",
+    ".md": "markdown", ".mdx": "markdown",
+    ".tf": "terraform", ".hcl": "hcl",
+    ".nix": "nix",
+    ".proto": "protobuf",
+    ".graphql": "graphql", ".gql": "graphql",
+}
+
+
+def read_ignore_patterns(path: Path) -> list[str]:
+    """Read raw pattern lines from a gitignore-format file (missing file → [])."""
+    try:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            return [line.rstrip("\r\n") for line in f]
+    except OSError:
+        return []
+
+
+def translate_ignore_glob(pattern: str) -> str:
+    """Translate a gitignore glob (no leading '!' or trailing '/') into a regex body."""
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**", i) and (i == 0 or pattern[i - 1] == "/"):
+                j = i + 2
+                if j == n:
+                    out.append(".*")  # "dir/**" → everything inside
+                    i = j
+                    continue
+                if pattern[j] == "/":
+                    out.append("(?:.*/)?")  # "**/" → zero or more directories
+                    i = j + 1
+                    continue
+            while i + 1 < n and pattern[i + 1] == "*":
+                i += 1
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = i + 1
+            if j < n and pattern[j] in "!^":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j >= n:
+                out.append("\\[")
+            else:
+                body = pattern[i + 1:j]
+                if body[:1] in ("!", "^"):
+                    body = "^" + body[1:]
+                out.append("[" + body.replace("[", "\\[") + "]")
+                i = j
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+def compile_ignore_rule(line: str) -> tuple[str, bool, bool] | None:
+    """Compile one gitignore line into (regex body, negate, dir_only), or None if blank/comment."""
+    if not line or line.startswith("#"):
+        return None
+    while line.endswith(" ") and not line.endswith("\\ "):
+        line = line[:-1]
+    negate = line.startswith("!")
+    if negate:
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+    # A slash anywhere but the end anchors the pattern to the .gitignore's directory;
+    # otherwise it matches the name at any depth below it.
+    anchored = "/" in line
+    body = translate_ignore_glob(line.lstrip("/"))
+    if not anchored:
+        body = "(?:.*/)?" + body
+    return body, negate, dir_only
+
+
+class IgnoreRules:
+    """Rules from one gitignore-format file, relative to the directory that holds it.
+
+    All patterns are compiled into a single alternation (one for files, one for
+    directories, since "dir/" rules never match files) in reverse order, so the
+    first alternative that matches is the last matching line, as in git.
+    """
+
+    def __init__(self, base: str, lines: list[str]):
+        self.prefix_len = len(base) + 1 if base else 0
+        rules = [r for r in map(compile_ignore_rule, lines) if r]
+        self._file = self._combine([r for r in rules if not r[2]])
+        self._dir = self._combine(rules)
+
+    @staticmethod
+    def _combine(rules: list[tuple[str, bool, bool]]):
+        if not rules:
+            return None
+        rules = rules[::-1]
+        regex = re.compile("(?:" + "|".join(f"({body})" for body, _, _ in rules) + r")\Z", re.DOTALL)
+        return regex, [negate for _, negate, _ in rules]
+
+    def match(self, rel_path: str, is_dir: bool) -> bool | None:
+        """Return True (ignored), False (re-included by '!') or None (no rule matched)."""
+        compiled = self._dir if is_dir else self._file
+        if compiled is None:
+            return None
+        m = compiled[0].match(rel_path, self.prefix_len)
+        if m is None:
+            return None
+        return not compiled[1][m.lastindex - 1]
+
+
+class IgnoreEngine:
+    """DEFAULT_IGNORE plus .git/info/exclude and every nested .gitignore.
+
+    Walkers carry a tuple of the IgnoreRules in effect for the current directory
+    (root-most first) and check each entry before descending, so ignored
+    directories are pruned as a whole. DEFAULT_IGNORE always wins and cannot be
+    re-included by a negation.
+    """
+
+    def __init__(self, root: Path):
+        self.default_names = {p for p in DEFAULT_IGNORE if "*" not in p}
+        self.default_glob = re.compile(
+            "|".join(fnmatch.translate(p) for p in sorted(DEFAULT_IGNORE) if "*" in p)
+        )
+        exclude = read_ignore_patterns(root / ".git" / "info" / "exclude")
+        self.base_rules: tuple[IgnoreRules, ...] = (IgnoreRules("", exclude),) if exclude else ()
+        self.root = root
+        self._dir_rules: dict[str, tuple | None] = {}
+
+    def is_default_ignored(self, name: str) -> bool:
+        return name in self.default_names or self.default_glob.match(name) is not None
+
+    def rules_for_dir(self, rel_dir: str, abs_dir: Path, parent_rules: tuple) -> tuple:
+        """Extend parent_rules with the .gitignore in abs_dir, if any."""
+        patterns = read_ignore_patterns(abs_dir / ".gitignore")
+        if not patterns:
+            return parent_rules
+        return parent_rules + (IgnoreRules(rel_dir, patterns),)
+
+    def is_ignored(self, rel_path: str, name: str, is_dir: bool, rules: tuple) -> bool:
+        if self.is_default_ignored(name):
+            return True
+        # Deeper .gitignore files take precedence over shallower ones.
+        for ruleset in reversed(rules):
+            verdict = ruleset.match(rel_path, is_dir)
+            if verdict is not None:
+                return verdict
+        return False
+
+    def rules_for_path(self, rel_dir: str) -> tuple | None:
+        """Rules in effect inside rel_dir as a walk would reach it (None if it is pruned)."""
+        if rel_dir not in self._dir_rules:
+            if not rel_dir:
+                rules = self.rules_for_dir("", self.root, self.base_rules)
+            else:
+                parent, _, name = rel_dir.rpartition("/")
+                rules = self.rules_for_path(parent)
+                if rules is not None:
+                    if self.is_ignored(rel_dir, name, True, rules):
+                        rules = None
+                    else:
+                        rules = self.rules_for_dir(rel_dir, self.root / rel_dir, rules)
+            self._dir_rules[rel_dir] = rules
+        return self._dir_rules[rel_dir]
+
+    def is_path_ignored(self, rel_path: str) -> bool:
+        """Check one file path without a walk, including every ancestor directory."""
+        parent, _, name = rel_path.rpartition("/")
+        rules = self.rules_for_path(parent)
+        return rules is None or self.is_ignored(rel_path, name, False, rules)
+
+
+def count_tokens(
+    text: str,
+    encoding: tiktoken.Encoding,
+    store: "TokenStore | None" = None,
+    digest: str | None = None,
+    lines: int | None = None,
+) -> int:
+    """Count tokens in text using tiktoken.
+
+    When a TokenStore and the content digest are given, the store is consulted
+    first and the text is only encoded if that content was never counted
+    (lines is recorded alongside the new count).
+    """
+    if store is not None and digest:
+        return store.get_or_count(digest, encoding.name, lambda: count_tokens(text, encoding), lines)
+    try:
+        # Special-token markers in source files are plain text here; encode()
+        # would rescan the text for them and raise.
+        return len(encoding.encode_ordinary(text))
+    except Exception:
+        return len(text) // 4
+
+
+def stored_info(
+    store: "TokenStore",
+    digest: str,
+    encoding: tiktoken.Encoding,
+    extra_encodings: tuple = (),
+) -> dict | None:
+    """Info dict (see scan_file) for content whose counts in every encoding, and
+    its line count, are already in the store; None if any is missing."""
+    counts = {}
+    lines = None
+    for enc in (encoding, *extra_encodings):
+        hit = store.lookup(digest, enc.name)
+        if hit is None or hit[1] is None:
+            return None
+        counts[enc.name] = hit[0]
+        lines = hit[1]
+    info = {"verdict": "text", "tokens": counts[encoding.name], "lines": lines}
+    if extra_encodings:
+        info["tokens_by_encoding"] = counts
+    return info
+
+
+def git_blob_sha1(data: bytes) -> str:
+    """Return the git blob object id of data (the same id `git hash-object` prints)."""
+    h = hashlib.sha1(b"blob %d\0" % len(data))
+    h.update(data)
+    return h.hexdigest()
+
+
+TEXT_EXTENSIONS = {
+    ".py", ".js", ".ts", ".jsx", ".tsx", ".vue", ".svelte",
+    ".html", ".htm", ".css", ".scss", ".sass", ".less",
+    ".json", ".yaml", ".yml", ".toml", ".xml",
+    ".md", ".mdx", ".txt", ".rst",
+    ".sh", ".bash", ".zsh", ".fish", ".ps1", ".bat", ".cmd",
+    ".sql", ".graphql", ".gql", ".proto",
+    ".go", ".rs", ".rb", ".php", ".java", ".kt", ".kts", ".scala",
+    ".clj", ".cljs", ".edn", ".ex", ".exs", ".erl", ".hrl",
+    ".hs", ".lhs", ".ml", ".mli", ".fs", ".fsx", ".fsi",
+    ".cs", ".vb", ".swift", ".m", ".mm", ".h", ".hpp",
+    ".c", ".cpp", ".cc", ".cxx", ".r", ".R", ".jl", ".lua",
+    ".vim", ".el", ".lisp", ".scm", ".rkt", ".zig", ".nim",
+    ".d", ".dart", ".v", ".sv", ".vhd", ".vhdl",
+    ".tf", ".hcl", ".dockerfile", ".containerfile",
+    ".makefile", ".cmake", ".gradle", ".groovy",
+    ".rake", ".gemspec", ".podspec", ".cabal", ".nix", ".dhall",
+    ".jsonc", ".json5", ".cson", ".ini", ".cfg", ".conf", ".config",
+    ".env", ".env.example", ".env.local",
+    ".gitignore", ".gitattributes", ".editorconfig",
+    ".prettierrc", ".eslintrc", ".stylelintrc", ".babelrc",
+    ".nvmrc", ".ruby-version", ".python-version", ".node-version",
+    ".tool-versions", ".mjs", ".cjs", ".mts", ".cts", ".pyi", ".pyx",
+    ".ipynb",
+}
+
+TEXT_NAMES = {
+    "readme", "license", "licence", "changelog", "authors", "contributors",
+    "copying", "dockerfile", "containerfile", "makefile", "rakefile",
+    "gemfile", "procfile", "brewfile", "vagrantfile", "justfile", "taskfile",
+}
+
+
+def is_text_name(path: Path) -> bool:
+    """Check if a file is text judging by its name alone."""
+    return path.suffix.lower() in TEXT_EXTENSIONS or path.name.lower() in TEXT_NAMES
+
+
+def is_text_file(path: Path) -> bool:
+    """Check if a file is likely a text file."""
+    if is_text_name(path):
+        return True
+
+    try:
+        with open(path, "rb") as f:
+            chunk = f.read(8192)
+            if b"\x00" in chunk:
+                return False
+            try:
+                chunk.decode("utf-8")
+                return True
+            except UnicodeDecodeError:
+                return False
+    except Exception:
+        return False
+
+
+CACHE_VERSION = 2
+
+
+def default_cache_dir() -> Path:
+    """Return the user-level cache directory ($XDG_CACHE_HOME/project-profiler)."""
+    base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "project-profiler"
+
+
+class ScanCache:
+    """On-disk cache of per-file scan results, keyed by relative path + stat metadata.
+
+    An entry is reused only when (mtime_ns, size, inode) are unchanged, so a warm
+    rescan costs one stat() per file instead of a read + tokenize.
+    """
+
+    def __init__(self, root: Path, encoding_name: str, cache_dir: Path | None = None):
+        self.path = self.path_for(root, encoding_name, cache_dir)
+        self.root = str(root)
+        self.encoding_name = encoding_name
+        self.entries: dict[str, list] = {}
+        self.seen: dict[str, list] = {}
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @staticmethod
+    def path_for(root: Path, encoding_name: str, cache_dir: Path | None = None) -> Path:
+        """Cache file of a root scanned with an encoding."""
+        key = hashlib.sha1(f"{root}\0{encoding_name}".encode("utf-8")).hexdigest()[:16]
+        return (cache_dir or default_cache_dir()) / f"scan-{key}.json"
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if (
+            isinstance(data, dict)
+            and data.get("version") == CACHE_VERSION
+            and data.get("root") == self.root
+            and data.get("encoding") == self.encoding_name
+        ):
+            self.entries = data.get("entries", {})
+
+    def lookup(self, rel_path: str, st: os.stat_result) -> dict | None:
+        """Return the file's stored info (see scan_file) if it is unchanged since the last scan."""
+        entry = self.entries.get(rel_path)
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size and entry[2] == st.st_ino:
+            self.hits += 1
+            self.seen[rel_path] = entry
+            return entry[3]
+        self.misses += 1
+        return None
+
+    def store(self, rel_path: str, st: os.stat_result, info: dict) -> None:
+        self.seen[rel_path] = [st.st_mtime_ns, st.st_size, st.st_ino, info]
+
+    def save(self) -> None:
+        """Write entries seen in this run (dropping deleted files), atomically."""
+        data = {
+            "version": CACHE_VERSION,
+            "root": self.root,
+            "encoding": self.encoding_name,
+            "entries": self.seen,
+        }
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"WARNING: Failed to write scan cache {self.path}: {e}", file=sys.stderr)
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "path": str(self.path),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class TokenStore:
+    """User-level content-addressed store mapping (content digest, encoding) → token count.
+
+    Backed by SQLite in WAL mode, so concurrent scanner processes (and repos that
+    vendor the same files) share one store safely. Within a run, identical content
+    is tokenized once even when several workers reach it at the same time.
+    New counts are buffered and written in batches.
+    """
+
+    FLUSH_EVERY = 1000
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path: Path | None = None):
+        import sqlite3
+        import threading
+
+        self.path = path or default_cache_dir() / "tokens.sqlite3"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+                self._conn.execute("DROP TABLE IF EXISTS tokens")
+                self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tokens ("
+                "digest TEXT NOT NULL, encoding TEXT NOT NULL, tokens INTEGER NOT NULL, lines INTEGER, "
+                "PRIMARY KEY (digest, encoding)) WITHOUT ROWID"
+            )
+        self._lock = threading.Lock()
+        self._memo: dict[tuple[str, str], tuple[int, int | None]] = {}
+        self._inflight: dict[tuple[str, str], Future] = {}
+        self._unsaved: dict[tuple[str, str], tuple[int, int | None]] = {}
+        self.store_hits = 0
+        self.run_hits = 0
+        self.tokenized = 0
+
+    def _lookup_locked(self, key: tuple[str, str]) -> tuple[int, int | None] | None:
+        hit = self._memo.get(key)
+        if hit is not None:
+            self.run_hits += 1
+            return hit
+        row = self._conn.execute(
+            "SELECT tokens, lines FROM tokens WHERE digest = ? AND encoding = ?", key
+        ).fetchone()
+        if row is None:
+            return None
+        hit = self._memo[key] = (row[0], row[1])
+        self.store_hits += 1
+        return hit
+
+    def lookup(self, digest: str, encoding_name: str) -> tuple[int, int | None] | None:
+        """Return (tokens, lines) stored for this content, or None if it was never counted."""
+        with self._lock:
+            return self._lookup_locked((digest, encoding_name))
+
+    def get_or_count(self, digest: str, encoding_name: str, count, lines: int | None = None) -> int:
+        """Return the stored count, or call count() once for this content and store it with lines."""
+        key = (digest, encoding_name)
+        with self._lock:
+            hit = self._lookup_locked(key)
+            if hit is not None:
+                return hit[0]
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+        if not owner:
+            with self._lock:
+                self.run_hits += 1
+            return fut.result()
+
+        try:
+            tokens = count()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            fut.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            self._memo[key] = self._unsaved[key] = (tokens, lines)
+            self.tokenized += 1
+            flush = len(self._unsaved) >= self.FLUSH_EVERY
+        fut.set_result(tokens)
+        if flush:
+            self.flush()
+        return tokens
+
+    def drain(self) -> dict:
+        """Take the counts made since the last drain, and the hit counters, resetting both.
+
+        A worker process scanning with its own view of the store (see
+        ProcessScanPool) drains it after every batch; the parent absorb()s them,
+        so the parent's store stays the only writer.
+        """
+        with self._lock:
+            delta = {
+                "rows": list(self._unsaved.items()),
+                "store_hits": self.store_hits,
+                "run_hits": self.run_hits,
+                "tokenized": self.tokenized,
+            }
+            self._unsaved.clear()
+            self.store_hits = self.run_hits = self.tokenized = 0
+        return delta
+
+    def absorb(self, delta: dict) -> None:
+        """Add counts and hit counters drained from another store; the counts are saved with the next flush."""
+        with self._lock:
+            for key, value in delta["rows"]:
+                self._memo[key] = self._unsaved[key] = value
+            self.store_hits += delta["store_hits"]
+            self.run_hits += delta["run_hits"]
+            self.tokenized += delta["tokenized"]
+            flush = len(self._unsaved) >= self.FLUSH_EVERY
+        if flush:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write buffered counts to the store (existing rows win)."""
+        with self._lock:
+            rows = [(d, e, t, n) for (d, e), (t, n) in self._unsaved.items()]
+            self._unsaved.clear()
+            if not rows:
+                return
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO tokens (digest, encoding, tokens, lines) VALUES (?, ?, ?, ?)", rows
+                    )
+            except Exception as e:
+                print(f"WARNING: Failed to write token store {self.path}: {e}", file=sys.stderr)
+
+    def close(self) -> None:
+        self.flush()
+        self._conn.close()
+
+    def stats(self) -> dict:
+        return {
+            "path": str(self.path),
+            "store_hits": self.store_hits,
+            "run_hits": self.run_hits,
+            "tokenized": self.tokenized,
+        }
+
+
+MMAP_THRESHOLD = 256 * 1024
+SNIFF_BYTES = 8192
+CHUNK_BYTES = 1 << 20
+
+
+def is_binary_head(head: bytes) -> bool:
+    """True if a file's first SNIFF_BYTES contain a NUL byte or invalid UTF-8
+    (a character cut off at the end of head is not invalid)."""
+    import codecs
+
+    if b"\x00" in head:
+        return True
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def decode_buffer(buf, text_by_name: bool) -> str | None:
+    """Validate and decode a whole file buffer in one pass; None means binary.
+
+    Files that are not text by name are binary if their first SNIFF_BYTES
+    contain a NUL byte or invalid UTF-8. Invalid bytes later in a text file
+    are dropped, and newlines are normalized as in text-mode reads.
+    """
+    if not text_by_name and buf.find(b"\x00", 0, SNIFF_BYTES) != -1:
+        return None
+    try:
+        content = str(buf, "utf-8")
+    except UnicodeDecodeError as e:
+        if not text_by_name and e.start < SNIFF_BYTES:
+            return None
+        content = str(buf, "utf-8", "ignore")
+    if "\r" in content:
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+    return content
+
+
+def scan_large_file(
+    f,
+    size: int,
+    encoding: tiktoken.Encoding,
+    text_by_name: bool,
+    store: TokenStore | None = None,
+    blob_sha: str | None = None,
+    extra_encodings: tuple = (),
+) -> dict:
+    """Tokenize an open file in CHUNK_BYTES pieces, keeping memory bounded.
+
+    Chunks end at the last newline in each block where possible (decoding is
+    incremental, so long lines without one are still safe). Token merges never
+    span a chunk boundary, so the count can differ from a whole-file encode by
+    a few tokens per chunk; the result is marked "chunked". Each chunk is
+    tokenized with every encoding before the next is read.
+
+    With a store, counts are kept under a "chunked:" digest, apart from the
+    exact "blob:" counts of scan_buffer. A known blob_sha is looked up before
+    reading; otherwise the blob id is hashed during the one tokenizing read.
+    """
+    import codecs
+
+    head = f.read(SNIFF_BYTES)
+    if not text_by_name and is_binary_head(head):
+        return {"verdict": "binary"}
+
+    digest = h = None
+    if store is not None and blob_sha:
+        digest = "chunked:" + blob_sha
+        info = stored_info(store, digest, encoding, extra_encodings)
+        if info is not None:
+            info["chunked"] = True
+            return info
+    elif store is not None:
+        h = hashlib.sha1(b"blob %d\0" % size)
+        h.update(head)
+
+    decoder = codecs.getincrementaldecoder("utf-8")("ignore")
+    encodings = (encoding, *extra_encodings)
+    counts = dict.fromkeys((enc.name for enc in encodings), 0)
+    newlines = 0
+    carry = head
+    last_char = ""
+    pending_cr = False
+    while True:
+        block = f.read(CHUNK_BYTES)
+        if h is not None:
+            h.update(block)
+        data = carry + block
+        if block:
+            cut = data.rfind(b"\n") + 1 or len(data)
+            data, carry = data[:cut], data[cut:]
+        if not data and not block:
+            break
+        text = decoder.decode(data, final=not block)
+        if pending_cr:
+            text = "\r" + text
+            pending_cr = False
+        if block and text.endswith("\r"):
+            # Keep a trailing CR with the next chunk so CRLF pairs normalize together
+            text, pending_cr = text[:-1], True
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        if text:
+            newlines += text.count("\n")
+            last_char = text[-1]
+            for enc in encodings:
+                counts[enc.name] += count_tokens(text, enc)
+        if not block:
+            break
+    lines = newlines + (1 if last_char and last_char != "\n" else 0)
+    if store is not None:
+        digest = digest or "chunked:" + h.hexdigest()
+        for enc in encodings:
+            store.get_or_count(digest, enc.name, lambda: counts[enc.name], lines)
+    info = {"verdict": "text", "tokens": counts[encoding.name], "lines": lines, "chunked": True}
+    if extra_encodings:
+        info["tokens_by_encoding"] = counts
+    return info
+
+
+# Top-level definitions for the regex-based symbol pass (one pattern per language;
+# the first non-empty group is the name, the group's name is the kind)
+_JS_EXPORT = r"(?:export\s+(?:default\s+)?)?(?:declare\s+)?"
+SYMBOL_PATTERNS = {
+    "javascript": re.compile(
+        rf"^{_JS_EXPORT}(?:async\s+)?function\s*\*?\s*(?P<function>[\w$]+)"
+        rf"|^{_JS_EXPORT}(?:abstract\s+)?class\s+(?P<class>[\w$]+)"
+        rf"|^{_JS_EXPORT}(?:const|let|var)\s+(?P<function_>[\w$]+)\s*(?::[^=]+)?=\s*(?:async\s+)?"
+        r"(?:function\b|\([^)]*\)\s*(?::[^=]+)?=>|[\w$]+\s*=>)"
+        rf"|^{_JS_EXPORT}(?:interface|type)\s+(?P<type>[\w$]+)"
+        rf"|^{_JS_EXPORT}(?:const\s+)?enum\s+(?P<enum>[\w$]+)",
+        re.MULTILINE,
+    ),
+    "go": re.compile(
+        r"^func\s+(?:\([^)]*\)\s*)?(?P<function>\w+)"
+        r"|^type\s+(?P<type>\w+)",
+        re.MULTILINE,
+    ),
+    "rust": re.compile(
+        r"^(?:pub(?:\([^)]*\))?\s+)?(?:const\s+)?(?:async\s+)?(?:unsafe\s+)?(?:extern\s+\"[^\"]*\"\s+)?"
+        r"fn\s+(?P<function>\w+)"
+        r"|^(?:pub(?:\([^)]*\))?\s+)?(?:struct|union)\s+(?P<class>\w+)"
+        r"|^(?:pub(?:\([^)]*\))?\s+)?enum\s+(?P<enum>\w+)"
+        r"|^(?:pub(?:\([^)]*\))?\s+)?(?:unsafe\s+)?trait\s+(?P<trait>\w+)"
+        r"|^(?:pub(?:\([^)]*\))?\s+)?type\s+(?P<type>\w+)"
+        r"|^(?:unsafe\s+)?impl\b(?:<[^{]*?>)?\s*(?P<impl>[^{;]+?)\s*(?:where\b[^{]*)?\{"
+        r"|^(?:pub(?:\([^)]*\))?\s+)?mod\s+(?P<module>\w+)\s*\{"
+        r"|^macro_rules!\s*(?P<macro>\w+)",
+        re.MULTILINE,
+    ),
+}
+SYMBOL_PATTERNS["typescript"] = SYMBOL_PATTERNS["javascript"]
+SYMBOL_LANGS = {"python", *SYMBOL_PATTERNS}
+# String literals and line comments, blanked before counting braces
+_BRACE_NOISE = re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`(?:\\.|[^`\\])*`|//[^\n]*')
+
+
+def python_symbols(content: str) -> list[tuple[str, str, int, int]]:
+    """(kind, name, first line, last line) of each top-level def and class, decorators included."""
+    import ast
+
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError):
+        return []
+    symbols = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+            kind = "class" if isinstance(node, ast.ClassDef) else "function"
+            symbols.append((kind, node.name, start, node.end_lineno or node.lineno))
+    return symbols
+
+
+def brace_symbols(content: str, pattern: re.Pattern) -> list[tuple[str, str, int, int]]:
+    """(kind, name, first line, last line) of each top-level definition matched by pattern.
+
+    A definition ends where the braces opened after it balance again, or, if
+    it opens none, at the end of its statement (a ";" or the next unindented
+    line); it never runs into the next definition. Strings and line comments
+    are ignored when counting brackets; block comments are not.
+    """
+    starts = []
+    for match in pattern.finditer(content):
+        kind = next(k for k, v in match.groupdict().items() if v)
+        starts.append((kind.rstrip("_"), " ".join(match.group(kind).split()), match.start()))
+    if not starts:
+        return []
+    lines = content.split("\n")
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line) + 1)
+
+    import bisect
+
+    symbols = []
+    for i, (kind, name, pos) in enumerate(starts):
+        first = bisect.bisect_right(offsets, pos) - 1
+        limit = bisect.bisect_right(offsets, starts[i + 1][2]) - 2 if i + 1 < len(starts) else len(lines) - 1
+        last, braces, parens, opened = first, 0, 0, False
+        for n in range(first, max(limit, first) + 1):
+            code = _BRACE_NOISE.sub("", lines[n])
+            braces += code.count("{") - code.count("}")
+            parens += code.count("(") + code.count("[") - code.count(")") - code.count("]")
+            opened = opened or "{" in code
+            last = n
+            if braces > 0 or parens > 0:
+                continue
+            if opened or code.rstrip().endswith(";"):
+                break
+            # Top-level code starts at column 0: an unindented next line starts a new statement
+            following = lines[n + 1] if n + 1 < len(lines) else ""
+            if not following[:1].isspace() and not following.startswith(("{", "where", ")", "]", ".", "|", "=")):
+                break
+        # Attributes and decorators directly above belong to the definition
+        while first > 0 and lines[first - 1].startswith(("#[", "@")):
+            first -= 1
+        symbols.append((kind, name, first + 1, last + 1))
+    return symbols
+
+
+def symbol_index(content: str, lang: str | None, encoding: tiktoken.Encoding) -> list[dict] | None:
+    """Top-level symbols of a Python, JS/TS, Go or Rust file with line ranges and token counts.
+
+    None for other languages. Each symbol's token count is its own lines
+    tokenized alone, so symbols of a file need not add up to the file's count.
+    """
+    if lang == "python":
+        found = python_symbols(content)
+    elif lang in SYMBOL_PATTERNS:
+        found = brace_symbols(content, SYMBOL_PATTERNS[lang])
+    else:
+        return None
+    lines = content.split("\n")
+    return [
+        {
+            "name": name,
+            "kind": kind,
+            "lines": [start, end],
+            "tokens": count_tokens("\n".join(lines[start - 1:end]) + "\n", encoding),
+        }
+        for kind, name, start, end in found
+    ]
+
+
+# Import statements per language for the import graph (see import_specs)
+IMPORT_PATTERNS = {
+    "python": re.compile(
+        r"^[ \t]*from[ \t]+(?P<from>\.*[\w.]*)[ \t]+import[ \t]+(?P<names>\([^)]*\)|[^\n#;]+)"
+        r"|^[ \t]*import[ \t]+(?P<import>[\w.]+(?:[ \t]*,[ \t]*[\w.]+|[ \t]+as[ \t]+\w+)*)",
+        re.MULTILINE,
+    ),
+    "javascript": re.compile(
+        r"""(?:^|[;}\s])(?:import|export)\b[^'"`;]*?\bfrom\s*['"](?P<spec>[^'"\n]+)['"]"""
+        r"""|(?:^|[;}\s])import\s*['"](?P<bare>[^'"\n]+)['"]"""
+        r"""|\b(?:require|import)\s*\(\s*['"](?P<call>[^'"\n]+)['"]\s*\)""",
+        re.MULTILINE,
+    ),
+    "go": re.compile(r'^import\s*(?:[\w.]+\s+)?"(?P<one>[^"]+)"|^import\s*\((?P<block>[^)]*)\)', re.MULTILINE),
+    "rust": re.compile(
+        r"^[ \t]*(?:pub(?:\([^)]*\))?[ \t]+)?(?:use\s+(?P<use>[^;]+);|mod[ \t]+(?P<mod>\w+)[ \t]*;)",
+        re.MULTILINE,
+    ),
+}
+IMPORT_PATTERNS["typescript"] = IMPORT_PATTERNS["javascript"]
+
+
+def expand_use(tree: str) -> list[str]:
+    """Flatten a Rust use tree: "a::{self, b, c::{d as e}}" → ["a", "a::b", "a::c::d"]."""
+    tree = "".join(re.sub(r"\s+as\s+\w+", "", tree).split())
+    brace = tree.find("{")
+    if brace < 0:
+        return [tree]
+    prefix, body = tree[:brace], tree[brace + 1:tree.rfind("}")]
+    items, depth, start = [], 0, 0
+    for i, ch in enumerate(body + ","):
+        if ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            if body[start:i]:
+                items.append(body[start:i])
+            start = i + 1
+    return [
+        prefix.rstrip(":") if path == "self" else prefix + path
+        for item in items for path in expand_use(item)
+    ]
+
+
+def import_specs(content: str, lang: str | None) -> list[str] | None:
+    """Raw import specifiers of a Python, JS/TS, Go or Rust file, in order, without duplicates.
+
+    None for other languages. Python gives "module" or "module:name" (for
+    `from module import name`, relative modules keep their dots), JS/TS its
+    relative specifiers only, Go its import paths, and Rust "mod:name" for
+    `mod name;` and the crate-, self- and super-relative paths of `use`.
+    Specifiers are resolved to files by ImportGraph once the scan is done.
+    """
+    pattern = IMPORT_PATTERNS.get(lang)
+    if pattern is None:
+        return None
+    specs: list[str] = []
+    for match in pattern.finditer(content):
+        if lang == "python":
+            if match.group("import"):
+                specs.extend(
+                    part.split()[0] for part in match.group("import").split(",") if part.strip()
+                )
+            else:
+                module = match.group("from")
+                for name in match.group("names").strip("()").split(","):
+                    name = name.split()[0] if name.split() else ""
+                    if name.isidentifier():
+                        specs.append(f"{module}:{name}")
+                    elif name == "*":
+                        specs.append(module)
+        elif lang == "go":
+            if match.group("one"):
+                specs.append(match.group("one"))
+            else:
+                specs.extend(re.findall(r'"([^"]+)"', match.group("block")))
+        elif lang == "rust":
+            if match.group("mod"):
+                specs.append("mod:" + match.group("mod"))
+            else:
+                specs.extend(
+                    p for p in expand_use(match.group("use"))
+                    if p.split("::", 1)[0] in ("crate", "self", "super")
+                )
+        else:
+            spec = match.group("spec") or match.group("bare") or match.group("call")
+            if spec.startswith("."):
+                specs.append(spec)
+    return list(dict.fromkeys(specs))
+
+
+def scan_file(
+    path: Path,
+    encoding: tiktoken.Encoding,
+    store: TokenStore | None = None,
+    blob_sha: str | None = None,
+    extra_encodings: tuple = (),
+    symbols: bool = False,
+    imports: bool = False,
+) -> dict:
+    """Classify and tokenize one file, reading it exactly once.
+
+    Returns an info dict: {"verdict": "text", "tokens": int, "lines": int},
+    or {"verdict": "binary" | "notebook_parse_error"}. With extra_encodings,
+    the same decoded buffer is tokenized with each of them too, and text
+    infos add "tokens_by_encoding": {name: tokens} for all encodings.
+
+    Binary sniffing, UTF-8 validation, line counting, hashing and tokenizing
+    all run over one buffer (memory-mapped from MMAP_THRESHOLD bytes up).
+    Files over MAX_FILE_BYTES (other than notebooks) are tokenized in chunks
+    by scan_large_file instead, and their info carries "chunked": True.
+    blob_sha is the file's git blob id when it is known to match the worktree;
+    for files that are text by name, a store hit on it skips reading entirely.
+    With symbols, infos of whole Python, JS/TS, Go and Rust files add
+    "symbols" (see symbol_index), and with imports their raw "imports" (see
+    import_specs), so the store shortcut is not taken for them.
+    """
+    is_notebook = path.suffix.lower() == ".ipynb"
+    text_by_name = is_text_name(path)
+    parsed = (symbols or imports) and EXT_TO_LANG.get(path.suffix.lower()) in SYMBOL_LANGS
+    if store is not None and blob_sha and text_by_name and not parsed:
+        info = stored_info(store, ("ipynb:" if is_notebook else "blob:") + blob_sha, encoding, extra_encodings)
+        if info is not None:
+            return info
+
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size > MAX_FILE_BYTES and not is_notebook:
+            return scan_large_file(f, size, encoding, text_by_name, store, blob_sha, extra_encodings)
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return scan_buffer(buf, path, encoding, store, blob_sha, extra_encodings, symbols, imports)
+        return scan_buffer(f.read(), path, encoding, store, blob_sha, extra_encodings, symbols, imports)
+
+
+def scan_buffer(
+    buf,
+    path: Path,
+    encoding: tiktoken.Encoding,
+    store: TokenStore | None = None,
+    blob_sha: str | None = None,
+    extra_encodings: tuple = (),
+    symbols: bool = False,
+    imports: bool = False,
+) -> dict:
+    """Classify and tokenize a whole file held in buf (see scan_file); path gives its name only."""
+    is_notebook = path.suffix.lower() == ".ipynb"
+    content = decode_buffer(buf, is_text_name(path))
+    if content is None:
+        return {"verdict": "binary"}
+    digest = None
+    if store is not None:
+        digest = ("ipynb:" if is_notebook else "blob:") + (blob_sha or git_blob_sha1(buf))
+    lines = content.count("\n") + (1 if content and not content.endswith("\n") else 0)
+
+    # Special handling for Jupyter notebooks
+    if is_notebook:
+        content = notebook_source(content)
+        if content is None:
+            return {"verdict": "notebook_parse_error"}
+    tokens = count_tokens(content, encoding, store, digest, lines)
+    info = {"verdict": "text", "tokens": tokens, "lines": lines}
+    if extra_encodings:
+        info["tokens_by_encoding"] = {encoding.name: tokens}
+        for enc in extra_encodings:
+            info["tokens_by_encoding"][enc.name] = count_tokens(content, enc, store, digest, lines)
+    lang = EXT_TO_LANG.get(path.suffix.lower())
+    if symbols:
+        found = symbol_index(content, lang, encoding)
+        if found is not None:
+            info["symbols"] = found
+    if imports:
+        specs = import_specs(content, lang)
+        if specs is not None:
+            info["imports"] = specs
+    return info
+
+
+def sniff_file(path: Path, *_) -> dict:
+    """Classify a file as text or binary without reading past SNIFF_BYTES (for --no-tokens).
+
+    Text files get {"verdict": "text", "tokens": None, "lines": None}.
+    """
+    if not is_text_name(path):
+        with open(path, "rb") as f:
+            if is_binary_head(f.read(SNIFF_BYTES)):
+                return {"verdict": "binary"}
+    return {"verdict": "text", "tokens": None, "lines": None}
+
+
+MAX_FILE_BYTES = 1_000_000
+
+
+def available_cpu_count() -> int:
+    """Return the CPUs this process may actually use (affinity mask and cgroup quota)."""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        count = os.cpu_count() or 1
+
+    quota = period = None
+    try:
+        # cgroup v2: "max 100000" or "<quota> <period>"
+        with open("/sys/fs/cgroup/cpu.max", "r") as f:
+            q, p = f.read().split()[:2]
+        if q != "max":
+            quota, period = int(q), int(p)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "r") as f:
+                q = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "r") as f:
+                p = int(f.read())
+            if q > 0 and p > 0:
+                quota, period = q, p
+        except (OSError, ValueError):
+            pass
+    if quota and period:
+        count = min(count, -(-quota // period))
+    return max(1, count)
+
+
+def list_dir(path: str) -> list[os.DirEntry]:
+    """List a directory with os.scandir, sorted directories first, then by case-insensitive name."""
+    with os.scandir(path) as it:
+        entries = list(it)
+    entries.sort(key=lambda e: (not e.is_dir(follow_symlinks=False), e.name.lower()))
+    return entries
+
+
+def iter_walk(
+    root: Path,
+    ignore: IgnoreEngine,
+    list_pool: ThreadPoolExecutor | None = None,
+    prefetch: int = 0,
+    listings: dict[str, list[os.DirEntry]] | None = None,
+) -> Iterator[tuple]:
+    """Walk root in sorted order (directories first, then case-insensitive name).
+
+    Yields ("dir", rel_path), ("skip", record) and
+    ("file", path, rel_path, stat, blob_sha); blob_sha is always None here.
+
+    Uses an explicit stack instead of recursion and reuses the d_type cached in
+    each DirEntry, so a file costs one stat() and a directory none beyond its
+    listing. Symlinked directories are not followed. With list_pool, listings of
+    the next `prefetch` directories on the stack are fetched ahead in threads,
+    which hides latency on cold caches and network disks.
+
+    A `listings` dict (absolute path -> entries) is consulted before listing a
+    directory and filled afterwards; DirEntry caches its stat(), so a walk over
+    cached listings touches the disk only where entries were invalidated.
+    """
+    # Frames: ["dir", abs_path, rel_path, rules, listing_future] or ["files", [(entry, rel_path)]]
+    stack: list[list] = [["dir", str(root), "", ignore.base_rules, None]]
+    while stack:
+        frame = stack.pop()
+        if frame[0] == "files":
+            for entry, rel_path in frame[1]:
+                try:
+                    st = entry.stat()
+                except OSError as e:
+                    yield ("skip", {"path": rel_path, "reason": f"read_error: {str(e)}"})
+                    continue
+                yield ("file", Path(entry.path), rel_path, st, None)
+            continue
+
+        _, abs_path, rel_path, rules, listing = frame
+        if rel_path:
+            yield ("dir", rel_path)
+        try:
+            entries = listings.get(abs_path) if listings is not None else None
+            if entries is None:
+                entries = listing.result() if listing else list_dir(abs_path)
+                if listings is not None:
+                    listings[abs_path] = entries
+        except PermissionError:
+            yield ("skip", {"path": rel_path or ".", "reason": "permission_denied"})
+            continue
+        except OSError as e:
+            yield ("skip", {"path": rel_path or ".", "reason": f"read_error: {str(e)}"})
+            continue
+
+        if any(entry.name == ".gitignore" for entry in entries):
+            rules = ignore.rules_for_dir(rel_path, Path(abs_path), rules)
+
+        subdirs = []
+        files = []
+        for entry in entries:
+            child = f"{rel_path}/{entry.name}" if rel_path else entry.name
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if ignore.is_ignored(child, entry.name, is_dir, rules):
+                continue
+            if is_dir:
+                subdirs.append(["dir", entry.path, child, rules, None])
+            elif entry.is_file():
+                files.append((entry, child))
+
+        # Subdirectories are walked (in order) before this directory's files.
+        if files:
+            stack.append(["files", files])
+        stack.extend(reversed(subdirs))
+
+        if list_pool:
+            budget = prefetch
+            for pending in reversed(stack):
+                if budget <= 0:
+                    break
+                if pending[0] == "dir":
+                    if pending[4] is None and (listings is None or pending[1] not in listings):
+                        pending[4] = list_pool.submit(list_dir, pending[1])
+                    budget -= 1
+
+
+GIT_STAGE_RE = re.compile(r"^(\d{6}) ([0-9a-f]{40}|[0-9a-f]{64}) \d\t(.*)$", re.DOTALL)
+
+
+def run_git(root: Path, *args: str) -> list[str]:
+    """Run a git command in root and return its NUL-separated output fields."""
+    proc = subprocess.run(["git", "-C", str(root), *args], capture_output=True, check=False)
+    if proc.returncode != 0:
+        message = proc.stderr.decode("utf-8", errors="replace").strip()
+        raise RuntimeError(message or f"git {args[0]} failed")
+    return [os.fsdecode(p) for p in proc.stdout.split(b"\0") if p]
+
+
+def git_ls_files(root: Path, untracked: bool = False, with_blobs: bool = False) -> dict[str, str | None]:
+    """List files in git's index under root, plus untracked-but-not-ignored ones if requested.
+
+    Returns {rel_path: blob_sha}. With with_blobs, blob_sha is the index's object id
+    for regular files whose worktree copy is unmodified (per `git diff-files`);
+    otherwise it is None.
+    """
+    cmd = ["ls-files", "-z", "--cached"]
+    if with_blobs:
+        cmd.append("--stage")
+    if untracked:
+        cmd += ["--others", "--exclude-standard"]
+
+    # Unmerged paths are listed once per stage; keep the first occurrence.
+    files: dict[str, str | None] = {}
+    for line in run_git(root, *cmd):
+        m = GIT_STAGE_RE.match(line) if with_blobs else None
+        if m:
+            sha = m.group(2) if m.group(1) in ("100644", "100755") else None
+            files.setdefault(m.group(3), sha)
+        else:
+            files.setdefault(line, None)
+
+    if with_blobs:
+        # --relative: like ls-files, paths relative to root (not the repository top level)
+        for rel_path in run_git(root, "diff-files", "-z", "--name-only", "--relative"):
+            if rel_path in files:
+                files[rel_path] = None
+    return files
+
+
+GIT_DIFF_STATUS = {
+    "A": "added", "C": "added", "M": "modified", "T": "modified", "U": "modified",
+    "R": "renamed", "D": "removed",
+}
+
+
+def git_diff_paths(root: Path, rev: str, untracked: bool = False) -> list[tuple[str, str, str | None]]:
+    """List files under root that changed between rev and the worktree.
+
+    Returns (status, rel_path, old_path) tuples; status is "added", "modified",
+    "renamed" or "removed", and old_path is set for renames only. With
+    untracked, untracked files that are not ignored are listed as added.
+    """
+    fields = run_git(root, "diff", "--name-status", "-z", "-M", "--relative", "--no-ext-diff", rev, "--")
+    changes: list[tuple[str, str, str | None]] = []
+    i = 0
+    while i < len(fields):
+        status = GIT_DIFF_STATUS.get(fields[i][:1])
+        if fields[i][:1] in ("R", "C"):
+            old_path, rel_path = fields[i + 1], fields[i + 2]
+            i += 3
+            changes.append((status, rel_path, old_path if status == "renamed" else None))
+            continue
+        if status:
+            changes.append((status, fields[i + 1], None))
+        i += 2
+    if untracked:
+        for rel_path in run_git(root, "ls-files", "-z", "--others", "--exclude-standard"):
+            changes.append(("added", rel_path, None))
+    return changes
+
+
+def iter_paths(
+    root: Path,
+    rel_paths: list[str] | dict[str, str | None],
+    ignore: IgnoreEngine,
+    stats: dict | None = None,
+) -> Iterator[tuple]:
+    """Yield the same events as iter_walk, in the same order, for an explicit list of files.
+
+    rel_paths may map each path to its known git blob id, which is passed along
+    as the last element of the "file" event. With `stats` (rel_path -> stat-like
+    object), files are not looked up on disk (archive members, see ArchiveSource);
+    a path whose stat is None is a directory, listed even if nothing is in it.
+
+    Used when enumeration comes from somewhere other than the filesystem (e.g. the
+    git index), which already applied its own ignore rules; only DEFAULT_IGNORE is
+    re-checked. Paths that no longer exist or are not regular files are dropped.
+    """
+    tree: dict = {}
+    for rel_path in rel_paths:
+        node = tree
+        parts = rel_path.split("/")
+        for part in parts[:-1]:
+            sub = node.get(part)
+            if not isinstance(sub, dict):
+                sub = node[part] = {}
+            node = sub
+        if stats is not None and stats[rel_path] is None:
+            if not isinstance(node.get(parts[-1]), dict):
+                node[parts[-1]] = {}
+        else:
+            node.setdefault(parts[-1], None)
+    blobs = rel_paths if isinstance(rel_paths, dict) else {}
+
+    # Frames: ("dir", rel_path, subtree) or ("files", [rel_path, ...])
+    stack: list[tuple] = [("dir", "", tree)]
+    while stack:
+        frame = stack.pop()
+        if frame[0] == "files":
+            for rel_path in frame[1]:
+                path = root / rel_path
+                if stats is not None:
+                    yield ("file", path, rel_path, stats[rel_path], None)
+                    continue
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    yield ("skip", {"path": rel_path, "reason": f"read_error: {str(e)}"})
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    yield ("file", path, rel_path, st, blobs.get(rel_path))
+            continue
+
+        _, rel_path, node = frame
+        if rel_path:
+            yield ("dir", rel_path)
+        subdirs = []
+        files = []
+        for name, sub in sorted(node.items(), key=lambda x: (not isinstance(x[1], dict), x[0].lower())):
+            if ignore.is_default_ignored(name):
+                continue
+            child = f"{rel_path}/{name}" if rel_path else name
+            if isinstance(sub, dict):
+                subdirs.append(("dir", child, sub))
+            else:
+                files.append(child)
+        if files:
+            stack.append(("files", files))
+        stack.extend(reversed(subdirs))
+
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+def is_archive(path: Path) -> bool:
+    """True for a regular file named like a tar or zip archive."""
+    return path.name.lower().endswith(ARCHIVE_SUFFIXES) and path.is_file()
+
+
+class ArchiveIgnoreEngine(IgnoreEngine):
+    """IgnoreEngine over .gitignore files collected from an archive instead of the disk."""
+
+    def __init__(self, root: Path, gitignores: dict[str, list[str]]):
+        super().__init__(root)
+        self.gitignores = gitignores
+
+    def rules_for_dir(self, rel_dir: str, abs_dir: Path, parent_rules: tuple) -> tuple:
+        patterns = self.gitignores.get(rel_dir)
+        if not patterns:
+            return parent_rules
+        return parent_rules + (IgnoreRules(rel_dir, patterns),)
+
+
+class ArchiveSource:
+    """A tar or zip archive scanned in place, without extracting anything to disk.
+
+    load() streams the members twice, in archive order. The first pass (index())
+    lists them and keeps only the bytes of .gitignore files, root-level files,
+    package.json files and entry-point candidates for ArchiveManifests; a
+    .gitignore may come after the files it covers, so the rules are applied
+    once it ends. A top-level directory shared by every member (the usual
+    release-1.0/) is stripped from all paths. The second pass classifies and
+    tokenizes only the files that are neither under a DEFAULT_IGNORE name nor
+    ignored, from their bytes by scan_buffer in a thread pool (scan_large_file
+    for big ones), and keeps only the resulting info.
+
+    iter_scan then replays the kept files in walk order through events() and
+    scan(), so totals, skips and workspaces come out as for a directory.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.name = path.name
+        for suffix in ARCHIVE_SUFFIXES:
+            if path.name.lower().endswith(suffix):
+                self.name = path.name[:-len(suffix)]
+                break
+        self.infos: dict[str, dict] = {}
+        self.sizes: dict[str, int] = {}
+        self.names: dict[str, bool] = {}  # every member and implied directory -> is_dir
+        self.data: dict[str, bytes] = {}
+        self.prefix = ""
+        self.ignore: IgnoreEngine | None = None
+
+    def members(self) -> Iterator[tuple[str, bool, int, object]]:
+        """Yield (name, is_dir, size, file object or None) per directory or regular file member.
+
+        Tar archives (any compression) are read as a stream, so each member's
+        file object is only valid until the next one is requested.
+        """
+        import tarfile
+        import zipfile
+
+        try:
+            if zipfile.is_zipfile(self.path):
+                with zipfile.ZipFile(self.path) as zf:
+                    for info in zf.infolist():
+                        if info.is_dir():
+                            yield info.filename, True, 0, None
+                        else:
+                            with zf.open(info) as f:
+                                yield info.filename, False, info.file_size, f
+                return
+            with tarfile.open(self.path, "r|*") as tf:
+                for member in tf:
+                    if member.isdir():
+                        yield member.name, True, 0, None
+                    elif member.isfile():
+                        yield member.name, False, member.size, tf.extractfile(member)
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError) as e:
+            raise OSError(f"Not a readable tar or zip archive: {e}") from e
+
+    def entries(self) -> Iterator[tuple[str, bool, int, object]]:
+        """members() with safe, normalized names (no ".", "..", or empty components)."""
+        for name, is_dir, size, f in self.members():
+            parts = [p for p in name.split("/") if p and p != "."]
+            if parts and ".." not in parts:
+                yield "/".join(parts), is_dir, size, f
+
+    def index(self) -> None:
+        """First pass: list the members and read the files ArchiveManifests and the
+        ignore rules need; then strip a shared top-level directory and load the
+        .gitignore rules (see finish())."""
+        default = IgnoreEngine(self.path)
+
+        def keep(name: str) -> bool:
+            # Root-level files and manifests, with or without a shared top-level directory
+            parts = name.split("/")
+            return (
+                len(parts) <= 2 or parts[-1] in ("package.json", ".gitignore")
+                or name in ENTRY_POINT_CANDIDATES or "/".join(parts[1:]) in ENTRY_POINT_CANDIDATES
+            )
+
+        for name, is_dir, size, f in self.entries():
+            parts = name.split("/")
+            for i in range(1, len(parts)):
+                self.names.setdefault("/".join(parts[:i]), True)
+            self.names[name] = is_dir
+            # The first component may be the shared prefix, checked in finish()
+            if is_dir or any(default.is_default_ignored(p) for p in parts[1:]):
+                continue
+            self.sizes[name] = size
+            if keep(name) and size <= MAX_FILE_BYTES:
+                try:
+                    self.data[name] = f.read()
+                except Exception as e:
+                    self.infos[name] = {"verdict": f"read_error: {str(e)}"}
+        self.finish()
+
+    def load(
+        self,
+        encoding: tiktoken.Encoding | list[tiktoken.Encoding] | None,
+        store: TokenStore | None = None,
+        jobs: int = 1,
+        symbols: bool = False,
+        imports: bool = False,
+    ) -> None:
+        """Index the archive, then measure the files that survive the ignore rules.
+
+        The second pass streams the archive again (a compressed tar is
+        decompressed twice, which costs far less than tokenizing ignored
+        trees) and reads only surviving members. encoding=None only classifies
+        them, as sniff_file; with symbols and imports, members get a symbol
+        index and import specifiers as in scan_file. The token store is used
+        as for files on disk.
+        """
+        self.index()
+        wanted = {name for name in self.sizes if name not in self.infos}
+        extra_encodings: tuple = ()
+        if isinstance(encoding, list):
+            encoding, extra_encodings = encoding[0], tuple(encoding[1:])
+        pending: dict[str, Future] = {}
+        window: deque = deque()
+        pool = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="scan") if jobs > 1 else None
+        try:
+            for name, is_dir, size, f in self.entries():
+                if self.prefix:
+                    name = name[len(self.prefix):] if name.startswith(self.prefix) else ""
+                if is_dir or name not in wanted:
+                    continue
+                wanted.discard(name)
+                path = Path(name)
+                try:
+                    data = self.data.get(name)
+                    if encoding is None:
+                        head = data[:SNIFF_BYTES] if data is not None else f.read(SNIFF_BYTES)
+                        binary = not is_text_name(path) and is_binary_head(head)
+                        self.infos[name] = (
+                            {"verdict": "binary"} if binary else {"verdict": "text", "tokens": None, "lines": None}
+                        )
+                        continue
+                    if data is None and size > MAX_FILE_BYTES and path.suffix.lower() != ".ipynb":
+                        self.infos[name] = scan_large_file(
+                            f, size, encoding, is_text_name(path), store, None, extra_encodings
+                        )
+                        continue
+                    if data is None:
+                        data = f.read()
+                except Exception as e:
+                    self.infos[name] = {"verdict": f"read_error: {str(e)}"}
+                    continue
+                if pool:
+                    pending[name] = pool.submit(
+                        scan_buffer, data, path, encoding, store, None, extra_encodings, symbols, imports
+                    )
+                else:
+                    pending[name] = _run_now(
+                        scan_buffer, data, path, encoding, store, None, extra_encodings, symbols, imports
+                    )
+                window.append(name)
+                if len(window) > jobs * 8:
+                    pending[window.popleft()].exception()
+            for name, fut in pending.items():
+                try:
+                    self.infos[name] = fut.result()
+                except Exception as e:
+                    self.infos[name] = {"verdict": f"read_error: {str(e)}"}
+        finally:
+            if pool:
+                pool.shutdown(wait=True, cancel_futures=True)
+        for name in wanted:
+            self.infos[name] = {"verdict": "read_error: member changed between passes"}
+
+    def finish(self) -> None:
+        """Strip a shared top-level directory, then apply DEFAULT_IGNORE to it and the .gitignore rules.
+
+        Ignored files are dropped from sizes (and never measured).
+        """
+        tops = {name.partition("/")[0] for name in self.names}
+        if len(tops) == 1 and self.names[next(iter(tops))]:
+            self.prefix = next(iter(tops)) + "/"
+            cut = len(self.prefix)
+            for attr in ("infos", "sizes", "names", "data"):
+                table = getattr(self, attr)
+                setattr(self, attr, {name[cut:]: value for name, value in table.items() if len(name) >= cut})
+            self.name = self.prefix[:-1]
+        gitignores = {}
+        for name, data in self.data.items():
+            parent, _, base = name.rpartition("/")
+            if base == ".gitignore":
+                gitignores[parent] = data.decode("utf-8", "ignore").splitlines()
+        self.ignore = ArchiveIgnoreEngine(self.path, gitignores)
+        for name in [n for n in self.sizes if self.ignore.is_path_ignored(n)]:
+            del self.sizes[name]
+            self.infos.pop(name, None)
+
+    def events(self) -> Iterator[tuple]:
+        """Walk events (see iter_walk) for the kept files, in walk order."""
+        from types import SimpleNamespace
+
+        stats = {name: SimpleNamespace(st_size=size) for name, size in self.sizes.items() if name in self.infos}
+        for name, is_dir in self.names.items():
+            if is_dir and self.ignore.rules_for_path(name) is not None:
+                stats[name] = None
+        return iter_paths(self.path, list(stats), self.ignore, stats)
+
+    def scan(self, path: Path, *_) -> dict:
+        """Stand-in for scan_file: the info measured by load()."""
+        return dict(self.infos[path.relative_to(self.path).as_posix()])
+
+
+class ScanProfiler:
+    """Wall/CPU time per phase, per-file timings and counters for --profile.
+
+    Phases are nested context managers entered from the main thread and timed
+    in process CPU time. Hot paths inside a scan (walk steps, ignore matching,
+    file reads, tokenizer calls) are summed per call, in thread CPU time, by
+    wrappers that iter_scan installs only when profiling, so an unprofiled scan
+    runs the plain functions. With trace=True, phases, file scans and tokenizer
+    calls are also kept as Chrome trace events (see write_trace).
+    """
+
+    def __init__(self, top: int = 10, trace: bool = False):
+        import threading
+
+        self.top = top
+        self.events: list[dict] | None = [] if trace else None
+        self.phases: dict[tuple[str, ...], list] = {}
+        self.counters: dict[str, int] = {}
+        self.slowest: list[tuple[float, str, int]] = []
+        self.files = 0
+        self.bytes = 0
+        self._stack: list[str] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._threads: dict[int, tuple[int, str]] = {}
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def _record(self, name: str, start: float, wall: float, cpu: float, cat: str | None = None) -> None:
+        """Add one timed call to the `name` row under the current phase (and trace it if cat is set)."""
+        with self._lock:
+            entry = self.phases.setdefault(tuple(self._stack) + (name,), [0.0, 0.0, 0])
+            entry[0] += wall
+            entry[1] += cpu
+            entry[2] += 1
+        if cat and self.events is not None:
+            self._trace(name, cat, start, wall)
+
+    def _trace(self, name: str, cat: str, start: float, wall: float) -> None:
+        import threading
+
+        thread = threading.current_thread()
+        with self._lock:
+            tid = self._threads.setdefault(thread.ident, (len(self._threads), thread.name))[0]
+            self.events.append({
+                "name": name, "cat": cat, "ph": "X",
+                "ts": round((start - self._start) * 1e6, 1), "dur": round(wall * 1e6, 1),
+                "pid": os.getpid(), "tid": tid,
+            })
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Time a (possibly nested) phase of the run."""
+        with self._lock:
+            self.phases.setdefault(tuple(self._stack) + (name,), [0.0, 0.0, 0])
+            self._stack.append(name)
+        start = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - cpu
+            with self._lock:
+                self._stack.pop()
+            self._record(name, start, wall, cpu, "phase")
+
+    def timed(self, fn, name: str):
+        """Wrap fn so that each call adds to the `name` row under the current phase."""
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            cpu = time.thread_time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._record(name, start, time.perf_counter() - start, time.thread_time() - cpu)
+        return wrapper
+
+    def timed_iter(self, events: Iterator[tuple], name: str = "walk") -> Iterator[tuple]:
+        """Pass walk events through, timing each step and counting the syscalls behind it."""
+        it = iter(events)
+        while True:
+            start = time.perf_counter()
+            cpu = time.thread_time()
+            event = next(it, None)
+            self._record(name, start, time.perf_counter() - start, time.thread_time() - cpu)
+            if event is None:
+                return
+            if event[0] == "dir":
+                self.count("syscalls.scandir")
+            elif event[0] == "file":
+                self.count("syscalls.stat")
+            yield event
+
+    def timed_encoding(self, encoding: tiktoken.Encoding):
+        """Stand-in for encoding whose encode_ordinary() calls are timed as "tokenize"."""
+        from types import SimpleNamespace
+
+        local = self._local
+
+        def encode_ordinary(text: str) -> list[int]:
+            start = time.perf_counter()
+            cpu = time.thread_time()
+            try:
+                return encoding.encode_ordinary(text)
+            finally:
+                wall = time.perf_counter() - start
+                cpu = time.thread_time() - cpu
+                local.tokenize = getattr(local, "tokenize", (0.0, 0.0))
+                local.tokenize = (local.tokenize[0] + wall, local.tokenize[1] + cpu)
+                self._record("tokenize", start, wall, cpu, "tokenize")
+
+        return SimpleNamespace(name=encoding.name, encode_ordinary=encode_ordinary)
+
+    def timed_scan(self, scan, root: Path):
+        """Wrap scan_file: time reading/decoding apart from tokenizing, and put the
+        file's wall time in the returned info as "elapsed" (see file())."""
+        local = self._local
+
+        def wrapper(path: Path, *args) -> dict:
+            tokenize = getattr(local, "tokenize", (0.0, 0.0))
+            start = time.perf_counter()
+            cpu = time.thread_time()
+            self.count("syscalls.open")
+            try:
+                info = scan(path, *args)
+            finally:
+                wall = time.perf_counter() - start
+                cpu = time.thread_time() - cpu
+                spent = getattr(local, "tokenize", (0.0, 0.0))
+                self._record("read", start, wall - (spent[0] - tokenize[0]), cpu - (spent[1] - tokenize[1]))
+                if self.events is not None:
+                    self._trace(path.relative_to(root).as_posix(), "file", start, wall)
+            info["elapsed"] = wall
+            return info
+
+        return wrapper
+
+    def file(self, rel_path: str, size: int, seconds: float) -> None:
+        """Count one file read and keep it if it is among the `top` slowest."""
+        import heapq
+
+        self.files += 1
+        self.bytes += size
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, (seconds, rel_path, size))
+        elif self.slowest and seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, rel_path, size))
+
+    def count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def count_records(self, records: Iterator[tuple[str, dict]]) -> Iterator[tuple[str, dict]]:
+        """Pass scan records through, counting them by kind and skips by reason."""
+        for kind, record in records:
+            if kind == "skip":
+                self.count("skipped." + record["reason"].split(":")[0])
+            elif kind != "totals":
+                self.count("directories" if kind == "directory" else "files")
+            yield kind, record
+
+    def report(self) -> str:
+        """The profile as a plain-text table."""
+        wall = time.perf_counter() - self._start
+        cpu = time.process_time() - self._cpu_start
+        lines = [
+            f"## Profile (wall {wall:.3f} s, CPU {cpu:.3f} s)",
+            f"{'phase':<32} {'wall s':>9} {'cpu s':>9} {'calls':>10}",
+        ]
+        for key, (p_wall, p_cpu, calls) in self.phases.items():
+            if key[-1] == "file":
+                continue
+            label = "  " * (len(key) - 1) + key[-1]
+            lines.append(f"{label:<32} {p_wall:>9.3f} {p_cpu:>9.3f} {calls:>10,}")
+        lines.append("(rows timed per call are summed over worker threads)")
+
+        scan_wall = next((v[0] for k, v in self.phases.items() if k == ("scan",)), wall) or wall
+        lines.append("")
+        lines.append(
+            f"Throughput: {self.files:,} files, {self.bytes / 1e6:,.1f} MB read — "
+            f"{self.files / scan_wall:,.0f} files/s, {self.bytes / 1e6 / scan_wall:,.1f} MB/s"
+        )
+        if self.slowest:
+            lines.append(f"Slowest {len(self.slowest)} files:")
+            for seconds, rel_path, size in sorted(self.slowest, reverse=True):
+                lines.append(f"  {seconds * 1000:>9.1f} ms {size:>12,} B  {rel_path}")
+        if self.counters:
+            lines.append("Counters:")
+            for key in sorted(self.counters):
+                lines.append(f"  {key:<30} {self.counters[key]:>12,}")
+        return "\n".join(lines)
+
+    def write_trace(self, path: Path) -> None:
+        """Write the trace events as Chrome trace-event JSON (chrome://tracing, Perfetto)."""
+        pid = os.getpid()
+        meta = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in self._threads.values()
+        ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": meta + (self.events or []), "displayTimeUnit": "ms"}, f)
+
+
+def profile_phase(profiler: ScanProfiler | None, name: str):
+    """profiler.phase(name), or a no-op context manager when not profiling."""
+    return profiler.phase(name) if profiler else contextlib.nullcontext()
+
+
+def _run_now(fn, *args) -> Future:
+    """Run fn synchronously and wrap the outcome in a completed Future."""
+    fut: Future = Future()
+    try:
+        fut.set_result(fn(*args))
+    except Exception as e:
+        fut.set_exception(e)
+    return fut
+
+
+SCAN_BATCH = 32
+
+# Encodings and token store of a scan worker process (set by init_scan_worker)
+_worker_scan: tuple = ()
+
+
+def init_scan_worker(encodings: list[tuple[str, Path | None]], store_path: Path | None) -> None:
+    """ProcessScanPool initializer: this worker's (lazily loaded) encodings and token store."""
+    global _worker_scan
+    lazy = [LazyEncoding(name, path) for name, path in encodings]
+    _worker_scan = (lazy[0], tuple(lazy[1:]), TokenStore(store_path) if store_path else None)
+
+
+def scan_batch(batch: list[tuple[Path, str | None]], symbols: bool, imports: bool, timed: bool) -> tuple:
+    """Run scan_file on a batch of (path, blob_sha) in a worker process.
+
+    Returns the info dicts (or the exception a file raised), in batch order,
+    and the worker store's drained counts (see TokenStore.drain).
+    """
+    encoding, extra_encodings, store = _worker_scan
+    results = []
+    for path, blob_sha in batch:
+        start = time.perf_counter()
+        try:
+            info = scan_file(path, encoding, store, blob_sha, extra_encodings, symbols, imports)
+        except Exception as e:
+            results.append(e)
+            continue
+        if timed:
+            info["elapsed"] = time.perf_counter() - start
+        results.append(info)
+    return results, store.drain() if store else None
+
+
+class ProcessScanPool:
+    """Reads and tokenizes files in worker processes, SCAN_BATCH files per task.
+
+    Threads overlap tokenizing (tiktoken releases the GIL), but decoding, line
+    counting and symbol and import extraction hold it; worker processes run
+    all of scan_file in parallel. Each worker loads its own encodings and
+    reads the token store; the counts it makes come back with each batch and
+    are absorbed by the parent's store, which stays the only writer.
+
+    submit() returns a Future per file. Files are queued until a batch is
+    full; flush() sends a partial batch (iter_scan does so before waiting on
+    a file that is still queued).
+    """
+
+    def __init__(
+        self,
+        jobs: int,
+        encodings: list,
+        store: TokenStore | None = None,
+        symbols: bool = False,
+        imports: bool = False,
+        timed: bool = False,
+    ):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        specs = [(getattr(enc, "base_name", enc.name), getattr(enc, "path", None)) for enc in encodings]
+        # spawn, not fork: the parent already runs walker and executor threads
+        self.executor = ProcessPoolExecutor(
+            max_workers=jobs, mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_scan_worker, initargs=(specs, store.path if store else None),
+        )
+        self.store = store
+        self.options = (symbols, imports, timed)
+        self.queued: list[tuple[Future, Path, str | None]] = []
+
+    def submit(self, path: Path, blob_sha: str | None) -> Future:
+        fut: Future = Future()
+        self.queued.append((fut, path, blob_sha))
+        if len(self.queued) >= SCAN_BATCH:
+            self.flush()
+        return fut
+
+    def flush(self) -> None:
+        queued = [item for item in self.queued if item[0].set_running_or_notify_cancel()]
+        self.queued = []
+        if not queued:
+            return
+        futures = [fut for fut, _, _ in queued]
+        batch = self.executor.submit(scan_batch, [(path, sha) for _, path, sha in queued], *self.options)
+        batch.add_done_callback(lambda done: self._settle(done, futures))
+
+    def _settle(self, done: Future, futures: list[Future]) -> None:
+        try:
+            results, delta = done.result()
+        except BaseException as e:  # the batch failed as a whole (also SystemExit, cancellation)
+            for fut in futures:
+                fut.set_exception(e)
+            return
+        if delta and self.store:
+            self.store.absorb(delta)
+        for fut, result in zip(futures, results):
+            if isinstance(result, BaseException):
+                fut.set_exception(result)
+            else:
+                fut.set_result(result)
+
+    def shutdown(self) -> None:
+        for fut, _, _ in self.queued:
+            fut.cancel()
+        self.queued = []
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def open_walk(
+    root: Path,
+    ignore: IgnoreEngine,
+    jobs: int,
+    source: str = "fs",
+    untracked: bool = False,
+    with_blobs: bool = False,
+    listings: dict[str, list[os.DirEntry]] | None = None,
+    paths: list[str] | None = None,
+) -> tuple[Iterator[tuple], ThreadPoolExecutor | None]:
+    """Return (walk events, listing pool to shut down afterwards) for the chosen source."""
+    if paths is not None:
+        return iter_paths(root, paths, ignore), None
+    if source == "git":
+        return iter_paths(root, git_ls_files(root, untracked, with_blobs), ignore), None
+    list_workers = min(jobs, 8)
+    list_pool = ThreadPoolExecutor(max_workers=list_workers, thread_name_prefix="list") if jobs > 1 else None
+    return iter_walk(root, ignore, list_pool, list_workers * 2, listings), list_pool
+
+
+def add_encoding_tokens(
+    totals: dict[str, int], by_lang: dict[str, dict[str, int]], lang: str | None, counts: dict[str, int]
+) -> None:
+    """Add one file's tokens_by_encoding to the running totals and its language's."""
+    for name, tokens in counts.items():
+        totals[name] = totals.get(name, 0) + tokens
+        if lang:
+            lang_counts = by_lang.setdefault(lang, {})
+            lang_counts[name] = lang_counts.get(name, 0) + tokens
+
+
+def iter_scan(
+    root: Path,
+    encoding: tiktoken.Encoding | list[tiktoken.Encoding] | None,
+    max_file_tokens: int = 50000,
+    cache: ScanCache | None = None,
+    jobs: int = 1,
+    source: str = "fs",
+    untracked: bool = False,
+    store: TokenStore | None = None,
+    workspaces: WorkspaceRollup | None = None,
+    listings: dict[str, list[os.DirEntry]] | None = None,
+    paths: list[str] | None = None,
+    profiler: ScanProfiler | None = None,
+    pool: ThreadPoolExecutor | None = None,
+    archive: ArchiveSource | None = None,
+    symbols: bool = False,
+    imports: bool = False,
+    processes: bool = False,
+) -> Iterator[tuple[str, dict]]:
+    """Scan a directory, yielding (kind, record) pairs as soon as each is known.
+
+    kind is "directory", "file" or "skip", in walk order, followed by one final
+    "totals" record (root, totals, language distribution, cache statistics).
+    Nothing but the running totals is kept in memory.
+
+    Files over MAX_FILE_BYTES or max_file_tokens are still measured: they are
+    reported as skips (not handed to agents) but count toward total_tokens,
+    oversized_tokens and the language distribution.
+
+    The walk runs in the calling thread (with directory listings prefetched in
+    threads when jobs > 1); reading and tokenizing are fanned out to a pool of
+    `jobs` threads (tiktoken releases the GIL while encoding).
+    At most `jobs * 8` files are in flight, and results are consumed in walk
+    order, so output is identical to a serial scan. With processes (and
+    jobs > 1), files are read and tokenized in `jobs` worker processes instead
+    (see ProcessScanPool), with up to two batches per worker in flight; scans
+    that only classify files, archives and a shared pool keep using threads.
+
+    With source="git", files are enumerated from the git index in one
+    `git ls-files` call instead of walking the filesystem and evaluating
+    .gitignore rules (untracked=True adds untracked, non-ignored files).
+
+    With a WorkspaceRollup, every measured file is attributed to its monorepo
+    package and the totals record carries per-package "workspaces".
+    `listings` is passed to iter_walk (see there) for long-lived callers.
+    With `paths`, only those files (relative to root) are scanned.
+    A ScanProfiler times the walk, ignore matching, reads and tokenizing.
+    A shared `pool` (see batch_main) replaces the scan's own thread pool and is
+    left running; files of an abandoned scan still queued in it are cancelled.
+    With a loaded ArchiveSource, root is the archive and its members are replayed
+    instead of walking the disk.
+
+    With encoding=None, files are only classified (see sniff_file): records
+    carry no tokens or lines and the token totals are None.
+
+    With a list of encodings, every file is tokenized with each of them in the
+    same read. The first one is primary: it gives "tokens" and every total and
+    threshold. Measured records add "tokens_by_encoding", the totals record
+    "total_tokens_by_encoding", and the language distribution "tokens_by_encoding"
+    per language.
+
+    With symbols, file records (and too_many_tokens skips) of Python, JS/TS,
+    Go and Rust files add their top-level "symbols" (see symbol_index), taken
+    from the buffer already read for tokenizing. Files tokenized in chunks
+    get none. With imports, the same records add their raw "imports" (see
+    import_specs and ImportGraph); both are kept in the scan cache.
+    """
+    root = root.resolve()
+    ignore = IgnoreEngine(root)
+    extra_encodings: tuple = ()
+    if isinstance(encoding, list):
+        encoding, extra_encodings = encoding[0], tuple(encoding[1:])
+    scan = scan_file if encoding is not None else sniff_file
+    if archive is not None:
+        scan = archive.scan
+    worker_encodings = [encoding, *extra_encodings]
+    if profiler:
+        ignore.is_ignored = profiler.timed(ignore.is_ignored, "ignore")
+        if encoding is not None:
+            encoding = profiler.timed_encoding(encoding)
+            extra_encodings = tuple(profiler.timed_encoding(enc) for enc in extra_encodings)
+        scan = profiler.timed_scan(scan, root)
+
+    total_tokens = 0
+    total_files = 0
+    oversized_tokens = 0
+    oversized_files = 0
+    lang_tokens: dict[str, int] = {}
+    lang_files: dict[str, int] = {}
+    encoding_tokens: dict[str, int] = {}
+    lang_encoding_tokens: dict[str, dict[str, int]] = {}
+
+    def consume(event: tuple, cached: dict | None, fut: Future | None) -> tuple[str, dict]:
+        nonlocal total_tokens, total_files, oversized_tokens, oversized_files
+
+        kind = event[0]
+        if kind == "dir":
+            if workspaces:
+                workspaces.directory(event[1])
+            return "directory", {"path": event[1]}
+        if kind == "skip":
+            return "skip", event[1]
+
+        _, path, rel_path, st, _ = event
+        size_bytes = st.st_size
+        if cached:
+            info = cached
+        else:
+            if process_pool and not (fut.running() or fut.done()):
+                process_pool.flush()  # fut is still queued in an unsent batch
+            try:
+                info = fut.result()
+            except Exception as e:
+                return "skip", {"path": rel_path, "reason": f"read_error: {str(e)}"}
+            if profiler:
+                profiler.file(rel_path, size_bytes, info.pop("elapsed"))
+            info["lang"] = EXT_TO_LANG.get(path.suffix.lower())
+            if cache:
+                cache.store(rel_path, st, info)
+
+        if info["verdict"] != "text":
+            return "skip", {"path": rel_path, "reason": info["verdict"]}
+
+        tokens = info["tokens"]
+        lang = info["lang"]
+        if tokens is None:
+            # Structure only: files are counted, nothing is measured
+            if lang:
+                lang_files[lang] = lang_files.get(lang, 0) + 1
+            if workspaces:
+                workspaces.add(rel_path, 0, lang, sent=size_bytes <= MAX_FILE_BYTES)
+            if size_bytes > MAX_FILE_BYTES:
+                oversized_files += 1
+                return "skip", {"path": rel_path, "reason": "too_large", "size_bytes": size_bytes}
+            total_files += 1
+            return "file", {"path": rel_path, "size_bytes": size_bytes}
+
+        total_tokens += tokens
+
+        # Track language distribution
+        if lang:
+            lang_tokens[lang] = lang_tokens.get(lang, 0) + tokens
+            lang_files[lang] = lang_files.get(lang, 0) + 1
+        by_encoding = info.get("tokens_by_encoding")
+        if extra_encodings:
+            add_encoding_tokens(encoding_tokens, lang_encoding_tokens, lang, by_encoding)
+
+        # Oversized files are measured but not handed to agents
+        oversized = size_bytes > MAX_FILE_BYTES or tokens > max_file_tokens
+        if workspaces:
+            workspaces.add(rel_path, tokens, lang, sent=not oversized)
+        if oversized:
+            oversized_tokens += tokens
+            oversized_files += 1
+            if size_bytes > MAX_FILE_BYTES:
+                record = {"path": rel_path, "reason": "too_large", "size_bytes": size_bytes, "tokens": tokens}
+            else:
+                record = {"path": rel_path, "reason": "too_many_tokens", "tokens": tokens}
+            if extra_encodings:
+                record["tokens_by_encoding"] = by_encoding
+            for key in ("symbols", "imports"):
+                if key in info:
+                    record[key] = info[key]
+            return "skip", record
+
+        total_files += 1
+
+        record = {
+            "path": rel_path,
+            "tokens": tokens,
+            "size_bytes": size_bytes,
+            "lines": info.get("lines"),
+        }
+        if extra_encodings:
+            record["tokens_by_encoding"] = by_encoding
+        for key in ("symbols", "imports"):
+            if key in info:
+                record[key] = info[key]
+        return "file", record
+
+    if archive is not None:
+        events, list_pool = archive.events(), None
+    else:
+        events, list_pool = open_walk(root, ignore, jobs, source, untracked, store is not None, listings, paths)
+    if profiler:
+        events = profiler.timed_iter(events)
+    own_pool = pool is None
+    window = jobs * 8
+    process_pool = None
+    if processes and own_pool and jobs > 1 and encoding is not None and archive is None:
+        process_pool = ProcessScanPool(jobs, worker_encodings, store, symbols, imports, timed=profiler is not None)
+        window = jobs * SCAN_BATCH * 2
+    elif own_pool:
+        pool = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="scan") if jobs > 1 else None
+    pending: deque = deque()
+    try:
+        for event in events:
+            cached = fut = None
+            if event[0] == "file":
+                cached = cache.lookup(event[2], event[3]) if cache else None
+                if cached is None:
+                    if process_pool:
+                        fut = process_pool.submit(event[1], event[4])
+                    elif pool:
+                        fut = pool.submit(scan, event[1], encoding, store, event[4], extra_encodings, symbols, imports)
+                    else:
+                        fut = _run_now(scan, event[1], encoding, store, event[4], extra_encodings, symbols, imports)
+            pending.append((event, cached, fut))
+            if len(pending) > window:
+                yield consume(*pending.popleft())
+        while pending:
+            yield consume(*pending.popleft())
+    finally:
+        if list_pool:
+            list_pool.shutdown(wait=True, cancel_futures=True)
+        if pool and own_pool:
+            pool.shutdown(wait=True, cancel_futures=True)
+        if process_pool:
+            process_pool.shutdown()
+        for _, _, fut in pending:
+            if fut:
+                fut.cancel()
+
+    totals = {
+        "root": str(root),
+        "total_tokens": total_tokens if encoding is not None else None,
+        "total_files": total_files,
+        "oversized_tokens": oversized_tokens if encoding is not None else None,
+        "oversized_files": oversized_files,
+        "language_distribution": {
+            "by_tokens": dict(sorted(lang_tokens.items(), key=lambda x: x[1], reverse=True)),
+            "by_files": dict(sorted(lang_files.items(), key=lambda x: x[1], reverse=True)),
+        },
+    }
+    if extra_encodings:
+        names = [enc.name for enc in (encoding, *extra_encodings)]
+        totals["total_tokens_by_encoding"] = {name: encoding_tokens.get(name, 0) for name in names}
+        totals["language_distribution"]["tokens_by_encoding"] = {
+            lang: lang_encoding_tokens[lang] for lang in totals["language_distribution"]["by_tokens"]
+        }
+    if workspaces:
+        totals["workspaces"] = workspaces.finish()
+        if encoding is None:
+            for ws in totals["workspaces"]:
+                ws["tokens"] = None
+    if cache:
+        cache.save()
+        totals["cache"] = cache.stats()
+    if store:
+        store.flush()
+        totals["token_store"] = store.stats()
+    yield "totals", totals
+
+
+def scan_directory(
+    root: Path,
+    encoding: tiktoken.Encoding,
+    max_file_tokens: int = 50000,
+    cache: ScanCache | None = None,
+    jobs: int = 1,
+    source: str = "fs",
+    untracked: bool = False,
+    store: TokenStore | None = None,
+    workspaces: WorkspaceRollup | None = None,
+) -> dict:
+    """Scan a directory and return file information with token counts (see iter_scan)."""
+    return collect_scan(
+        iter_scan(root, encoding, max_file_tokens, cache, jobs, source, untracked, store, workspaces)
+    )
+
+
+def collect_scan(records: Iterator[tuple[str, dict]]) -> dict:
+    """Gather iter_scan records into the scan result dict."""
+    files = []
+    directories = []
+    skipped = []
+    totals: dict = {}
+    for kind, record in records:
+        if kind == "file":
+            files.append(record)
+        elif kind == "directory":
+            directories.append(record["path"])
+        elif kind == "skip":
+            skipped.append(record)
+        else:
+            totals = record
+
+    result = {
+        "root": totals["root"],
+        "files": files,
+        "directories": directories,
+        "total_tokens": totals["total_tokens"],
+        "total_files": totals["total_files"],
+        "oversized_tokens": totals["oversized_tokens"],
+        "oversized_files": totals["oversized_files"],
+        "skipped": skipped,
+        "language_distribution": totals["language_distribution"],
+    }
+    for key in ("total_tokens_by_encoding", "workspaces", "cache", "token_store"):
+        if key in totals:
+            result[key] = totals[key]
+    return result
+
+
+def walk_key(rel_path: str, is_dir: bool = False) -> tuple:
+    """Sort key reproducing walk order (directories before files, case-insensitive names)."""
+    parts = rel_path.split("/")
+    key = [(0, part.lower()) for part in parts]
+    if not is_dir:
+        key[-1] = (1, parts[-1].lower())
+    return tuple(key)
+
+
+def merge_walk_order(items: list, new: list, key) -> list:
+    """Merge new items into items, which are already sorted by key (e.g. walk_key of a path).
+
+    Each new item is placed by bisecting, so only O(len(new) log len(items))
+    keys are computed rather than one per item, as a full re-sort would. Like a
+    stable sort of items + new, equal keys keep the existing items first.
+    """
+    import bisect
+
+    class Keys:
+        def __len__(self) -> int:
+            return len(items)
+
+        def __getitem__(self, i: int):
+            return key(items[i])
+
+    keys = Keys()
+    merged = []
+    start = 0
+    for item in sorted(new, key=key):
+        at = bisect.bisect_right(keys, key(item), start)
+        merged.extend(items[start:at])
+        merged.append(item)
+        start = at
+    merged.extend(items[start:])
+    return merged
+
+
+def delta_scan(
+    root: Path,
+    encoding: tiktoken.Encoding | list[tiktoken.Encoding],
+    snapshot: dict,
+    since: str,
+    max_file_tokens: int = 50000,
+    jobs: int = 1,
+    source: str = "fs",
+    untracked: bool = False,
+    store: TokenStore | None = None,
+    workspaces: WorkspaceRollup | None = None,
+    profiler: ScanProfiler | None = None,
+) -> dict:
+    """Bring a previous scan result up to date by rescanning only what changed since a git revision.
+
+    Files added, modified or renamed since `since` (per `git diff`, plus untracked
+    files for the fs source or with untracked=True) are rescanned and replace their
+    snapshot records; deleted files are dropped. Totals, the language distribution
+    and workspaces are recomputed from the merged records, and result["delta"]
+    lists the token change of every affected file. With several encodings (see
+    iter_scan), the snapshot must have been scanned with the same ones.
+
+    The snapshot's file, skip and directory lists are in walk order already, so
+    the rescanned records are merged into them (merge_walk_order) instead of
+    re-sorting, and only directories above a changed path are checked on disk.
+    """
+    root = root.resolve()
+    changes = git_diff_paths(root, since, untracked or source == "fs")
+    ignore = IgnoreEngine(root)
+    touched = set()
+    rescan = []
+    for status, rel_path, old_path in changes:
+        touched.add(rel_path)
+        if old_path:
+            touched.add(old_path)
+        if status != "removed" and (source != "fs" or not ignore.is_path_ignored(rel_path)):
+            rescan.append(rel_path)
+    scanned = collect_scan(iter_scan(
+        root, encoding, max_file_tokens, jobs=jobs, store=store, paths=rescan, profiler=profiler
+    ))
+
+    def measured(result: dict) -> dict[str, int]:
+        tokens = {f["path"]: f["tokens"] for f in result["files"]}
+        tokens.update((s["path"], s["tokens"]) for s in result["skipped"] if "tokens" in s)
+        return tokens
+
+    def path_key(record: dict) -> tuple:
+        return walk_key(record["path"])
+
+    def dir_key(rel_path: str) -> tuple:
+        return walk_key(rel_path, True)
+
+    before = measured(snapshot)
+    after = measured(scanned)
+    files = merge_walk_order(
+        [f for f in snapshot["files"] if f["path"] not in touched], scanned["files"], path_key
+    )
+    skipped = merge_walk_order(
+        [s for s in snapshot["skipped"] if s["path"] not in touched], scanned["skipped"], path_key
+    )
+
+    # Only directories above a changed path can have appeared or gone away
+    affected = set()
+    for rel_path in touched:
+        parts = rel_path.split("/")
+        affected.update("/".join(parts[:i]) for i in range(1, len(parts)))
+    directories = []
+    recheck = set(scanned["directories"])
+    for rel_path in snapshot["directories"]:
+        if rel_path in affected:
+            recheck.add(rel_path)
+        else:
+            directories.append(rel_path)
+    directories = merge_walk_order(directories, [d for d in recheck if (root / d).is_dir()], dir_key)
+
+    # Recompute totals in walk order, as iter_scan would have
+    total_tokens = 0
+    oversized_tokens = 0
+    oversized_files = 0
+    lang_tokens: dict[str, int] = {}
+    lang_files: dict[str, int] = {}
+    encoding_tokens: dict[str, int] = {}
+    lang_encoding_tokens: dict[str, dict[str, int]] = {}
+    if workspaces:
+        for rel_path in directories:
+            workspaces.directory(rel_path)
+    for record in merge_walk_order(files, [s for s in skipped if "tokens" in s], path_key):
+        tokens = record["tokens"]
+        lang = EXT_TO_LANG.get(Path(record["path"]).suffix.lower())
+        total_tokens += tokens
+        if lang:
+            lang_tokens[lang] = lang_tokens.get(lang, 0) + tokens
+            lang_files[lang] = lang_files.get(lang, 0) + 1
+        if "tokens_by_encoding" in record:
+            add_encoding_tokens(encoding_tokens, lang_encoding_tokens, lang, record["tokens_by_encoding"])
+        oversized = "reason" in record
+        if oversized:
+            oversized_tokens += tokens
+            oversized_files += 1
+        if workspaces:
+            workspaces.add(record["path"], tokens, lang, sent=not oversized)
+
+    rows = []
+    counts = {"added": 0, "modified": 0, "renamed": 0, "removed": 0}
+    for status, rel_path, old_path in sorted(changes, key=lambda c: walk_key(c[1])):
+        tokens_before = before.get(old_path or rel_path)
+        tokens_after = after.get(rel_path) if status != "removed" else None
+        if tokens_before is None and tokens_after is None:
+            continue
+        if status != "renamed":
+            if tokens_before is None:
+                status = "added"
+            elif tokens_after is None:
+                status = "removed"
+            else:
+                status = "modified"
+        counts[status] += 1
+        row = {"path": rel_path}
+        if status == "renamed":
+            row["from"] = old_path
+        row.update({
+            "status": status,
+            "tokens_before": tokens_before or 0,
+            "tokens_after": tokens_after or 0,
+            "delta": (tokens_after or 0) - (tokens_before or 0),
+        })
+        rows.append(row)
+
+    result = {
+        "root": str(root),
+        "files": files,
+        "directories": directories,
+        "total_tokens": total_tokens,
+        "total_files": len(files),
+        "oversized_tokens": oversized_tokens,
+        "oversized_files": oversized_files,
+        "skipped": skipped,
+        "language_distribution": {
+            "by_tokens": dict(sorted(lang_tokens.items(), key=lambda x: x[1], reverse=True)),
+            "by_files": dict(sorted(lang_files.items(), key=lambda x: x[1], reverse=True)),
+        },
+    }
+    if isinstance(encoding, list) and len(encoding) > 1:
+        result["total_tokens_by_encoding"] = {enc.name: encoding_tokens.get(enc.name, 0) for enc in encoding}
+        result["language_distribution"]["tokens_by_encoding"] = {
+            lang: lang_encoding_tokens[lang] for lang in result["language_distribution"]["by_tokens"]
+        }
+    if workspaces:
+        result["workspaces"] = workspaces.finish()
+    if "token_store" in scanned:
+        result["token_store"] = scanned["token_store"]
+    result["delta"] = {
+        "since": since,
+        "rescanned": len(rescan),
+        **counts,
+        "total_tokens_before": snapshot["total_tokens"],
+        "total_tokens_after": total_tokens,
+        "total_delta": total_tokens - snapshot["total_tokens"],
+        "files": rows,
+    }
+    return result
+
+
+# Rough cl100k_base bytes-per-token priors, used only for strata with too few samples
+BYTES_PER_TOKEN = {
+    "python": 3.8, "javascript": 3.6, "typescript": 3.6, "go": 3.4, "rust": 3.5,
+    "java": 4.0, "kotlin": 3.9, "csharp": 4.0, "c": 3.4, "cpp": 3.4, "ruby": 3.7,
+    "php": 3.6, "swift": 3.8, "shell": 3.4, "html": 3.2, "css": 3.0, "scss": 3.0,
+    "json": 2.9, "yaml": 3.4, "toml": 3.3, "xml": 3.0, "sql": 3.6,
+    "markdown": 4.2, "vue": 3.4, "svelte": 3.4,
+}
+DEFAULT_BYTES_PER_TOKEN = 3.6
+PRIOR_RELATIVE_SD = 0.25
+
+# Execution-mode boundaries from SKILL.md Phase 0.5
+MODE_THRESHOLDS = (80_000, 200_000, 400_000)
+
+
+def execution_mode(total_tokens: float) -> str:
+    """Map a token total to the SKILL.md Phase 0.5 execution mode."""
+    if total_tokens <= MODE_THRESHOLDS[0]:
+        return "direct"
+    if total_tokens <= MODE_THRESHOLDS[1]:
+        return "2 agents"
+    return "3 agents"
+
+
+def estimate_scan(
+    root: Path,
+    encoding: tiktoken.Encoding,
+    max_file_tokens: int = 50000,
+    cache: ScanCache | None = None,
+    jobs: int = 1,
+    source: str = "fs",
+    untracked: bool = False,
+    store: TokenStore | None = None,
+    sample_size: int = 400,
+    seed: int = 0,
+    workspaces: WorkspaceRollup | None = None,
+) -> dict:
+    """Estimate token counts from file sizes instead of tokenizing everything.
+
+    Files are stratified by language. Files already in the scan cache count
+    exactly; of the rest, a seeded random sample (allocated by byte share,
+    at least a few per stratum) is tokenized to calibrate a bytes→tokens
+    ratio per stratum, which is applied to the unsampled files. Totals come
+    with a 95% confidence interval from the ratio estimator's variance.
+
+    Returns the same shape as scan_directory, with per-file "estimated" flags
+    and an "estimate" block that flags mode thresholds inside the interval.
+    """
+    import math
+    import random
+
+    root = root.resolve()
+    ignore = IgnoreEngine(root)
+    directories = []
+    skipped = []
+    # Walk-ordered entries: ["file", rel_path, size, stratum, tokens|None, estimated] or ["skip", record]
+    entries: list[list] = []
+    unknown: dict[str, list[tuple]] = {}
+
+    events, list_pool = open_walk(root, ignore, jobs, source, untracked, with_blobs=store is not None)
+    try:
+        for event in events:
+            if event[0] == "dir":
+                directories.append(event[1])
+                if workspaces:
+                    workspaces.directory(event[1])
+                continue
+            if event[0] == "skip":
+                entries.append(["skip", event[1]])
+                continue
+            _, path, rel_path, st, blob_sha = event
+            lang = EXT_TO_LANG.get(path.suffix.lower())
+            stratum = lang or ("notebook" if path.suffix.lower() == ".ipynb" else "other")
+            cached = cache.lookup(rel_path, st) if cache else None
+            if cached:
+                if cached["verdict"] != "text":
+                    entries.append(["skip", {"path": rel_path, "reason": cached["verdict"]}])
+                    continue
+                entries.append(["file", rel_path, st.st_size, stratum, cached["tokens"], False])
+                continue
+            if not is_text_file(path):
+                entries.append(["skip", {"path": rel_path, "reason": "binary"}])
+                continue
+            entry = ["file", rel_path, st.st_size, stratum, None, False]
+            entries.append(entry)
+            unknown.setdefault(stratum, []).append((entry, path, st, blob_sha, lang))
+    finally:
+        if list_pool:
+            list_pool.shutdown(wait=True, cancel_futures=True)
+
+    # Allocate the sample across strata by byte share (oversized files are never sampled)
+    rng = random.Random(seed)
+    unknown_bytes = sum(item[0][2] for items in unknown.values() for item in items) or 1
+    sampled: list[tuple] = []
+    for stratum in sorted(unknown):
+        share = sum(item[0][2] for item in unknown[stratum]) / unknown_bytes
+        items = [item for item in unknown[stratum] if item[0][2] <= MAX_FILE_BYTES]
+        n = min(len(items), max(5, round(sample_size * share)))
+        sampled.extend(rng.sample(items, n))
+
+    pool = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="scan") if jobs > 1 else None
+    try:
+        if pool:
+            futures = [pool.submit(scan_file, path, encoding, store, blob_sha) for _, path, _, blob_sha, _ in sampled]
+        else:
+            futures = [_run_now(scan_file, path, encoding, store, blob_sha) for _, path, _, blob_sha, _ in sampled]
+        calibration: dict[str, list[tuple[int, int]]] = {}
+        for (entry, path, st, _, lang), fut in zip(sampled, futures):
+            try:
+                info = fut.result()
+            except Exception as e:
+                entry[:] = ["skip", {"path": entry[1], "reason": f"read_error: {str(e)}"}]
+                continue
+            info["lang"] = lang
+            if cache:
+                cache.store(entry[1], st, info)
+            if info["verdict"] != "text":
+                entry[:] = ["skip", {"path": entry[1], "reason": info["verdict"]}]
+                continue
+            tokens = entry[4] = info["tokens"]
+            calibration.setdefault(entry[3], []).append((entry[2], tokens))
+    finally:
+        if pool:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    # Per-stratum ratio estimator: tokens ≈ R * bytes
+    strata: dict[str, dict] = {}
+    variance = 0.0
+    for stratum, items in unknown.items():
+        pairs = calibration.get(stratum, [])
+        n = len(pairs)
+        rest = [item[0] for item in items if item[0][0] == "file" and item[0][4] is None]
+        if n:
+            ratio = sum(t for _, t in pairs) / (sum(b for b, _ in pairs) or 1)
+        else:
+            ratio = 1 / BYTES_PER_TOKEN.get(stratum, DEFAULT_BYTES_PER_TOKEN)
+        rest_bytes = 0
+        for entry in rest:
+            entry[4] = round(entry[2] * ratio)
+            entry[5] = True
+            rest_bytes += entry[2]
+        if n >= 2:
+            mean_bytes = sum(b for b, _ in pairs) / n
+            s2 = sum((t - ratio * b) ** 2 for b, t in pairs) / (n - 1)
+            fpc = max(0.0, 1 - n / len(items))
+            var = rest_bytes ** 2 * fpc * s2 / (n * mean_bytes ** 2) if mean_bytes else 0.0
+        else:
+            var = (rest_bytes * ratio * PRIOR_RELATIVE_SD) ** 2
+        variance += var
+        strata[stratum] = {
+            "files": len(items),
+            "sampled": n,
+            "bytes_per_token": round(1 / ratio, 3) if ratio else None,
+        }
+
+    files = []
+    lang_tokens: dict[str, int] = {}
+    lang_files: dict[str, int] = {}
+    total_tokens = 0
+    oversized_tokens = 0
+    oversized_files = 0
+    for entry in entries:
+        if entry[0] == "skip":
+            skipped.append(entry[1])
+            continue
+        _, rel_path, size_bytes, stratum, tokens, estimated = entry
+        total_tokens += tokens
+        if stratum not in ("notebook", "other"):
+            lang_tokens[stratum] = lang_tokens.get(stratum, 0) + tokens
+            lang_files[stratum] = lang_files.get(stratum, 0) + 1
+        oversized = size_bytes > MAX_FILE_BYTES or tokens > max_file_tokens
+        if workspaces:
+            workspaces.add(rel_path, tokens, stratum if stratum not in ("notebook", "other") else None,
+                           sent=not oversized)
+        if oversized:
+            oversized_tokens += tokens
+            oversized_files += 1
+            if size_bytes > MAX_FILE_BYTES:
+                record = {"path": rel_path, "reason": "too_large", "size_bytes": size_bytes, "tokens": tokens}
+            else:
+                record = {"path": rel_path, "reason": "too_many_tokens", "tokens": tokens}
+            if estimated:
+                record["estimated"] = True
+            skipped.append(record)
+            continue
+        record = {"path": rel_path, "tokens": tokens, "size_bytes": size_bytes}
+        if estimated:
+            record["estimated"] = True
+        files.append(record)
+
+    margin = 1.96 * math.sqrt(variance)
+    low = max(0, round(total_tokens - margin))
+    high = round(total_tokens + margin)
+    result = {
+        "root": str(root),
+        "files": files,
+        "directories": directories,
+        "total_tokens": total_tokens,
+        "total_files": len(files),
+        "oversized_tokens": oversized_tokens,
+        "oversized_files": oversized_files,
+        "skipped": skipped,
+        "language_distribution": {
+            "by_tokens": dict(sorted(lang_tokens.items(), key=lambda x: x[1], reverse=True)),
+            "by_files": dict(sorted(lang_files.items(), key=lambda x: x[1], reverse=True)),
+        },
+        "estimate": {
+            "confidence": 0.95,
+            "total_tokens_low": low,
+            "total_tokens_high": high,
+            "sampled_files": len(sampled),
+            "estimated_files": sum(1 for f in files if f.get("estimated")),
+            "mode": execution_mode(total_tokens),
+            "ambiguous_thresholds": [t for t in MODE_THRESHOLDS if low <= t <= high],
+            "strata": dict(sorted(strata.items())),
+        },
+    }
+    if workspaces:
+        result["workspaces"] = workspaces.finish()
+    if cache:
+        cache.save()
+        result["cache"] = cache.stats()
+    if store:
+        store.flush()
+        result["token_store"] = store.stats()
+    return result
+
+
+def parse_toml_like(text: str) -> dict:
+    """Minimal TOML reader used when tomllib is unavailable or rejects a file.
+
+    Understands [tables], [[array tables]], quoted and dotted keys, strings,
+    string arrays (also multi-line) and inline tables (kept as empty dicts);
+    any other value is kept as its raw text.
+    """
+    def split_key(key: str) -> list[str]:
+        return [p.strip("\"'") for p in re.findall(r'"[^"]*"|\'[^\']*\'|[^.\s]+', key)]
+
+    def bracket_depth(s: str) -> int:
+        s = re.sub(r'"[^"]*"|\'[^\']*\'|#.*', "", s)
+        return s.count("[") - s.count("]")
+
+    def descend(table: dict, parts: list[str]) -> dict:
+        for part in parts:
+            node = table.setdefault(part, {})
+            table = node[-1] if isinstance(node, list) else node
+        return table
+
+    result: dict = {}
+    current = result
+    lines = iter(text.splitlines())
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        header = re.match(r"^\[\[([^\]]+)\]\]|^\[([^\]]+)\]", line)
+        if header:
+            if header.group(1):
+                *parents, last = split_key(header.group(1))
+                tables = descend(result, parents).setdefault(last, [])
+                if isinstance(tables, list):
+                    tables.append({})
+                    current = tables[-1]
+            else:
+                current = descend(result, split_key(header.group(2)))
+            continue
+        kv = re.match(r'^("[^"]*"|\'[^\']*\'|[\w.-]+)\s*=\s*(.*)$', line)
+        if not kv:
+            continue
+        *parents, key = split_key(kv.group(1))
+        value = kv.group(2).strip()
+        if value.startswith("["):
+            # Multi-line arrays continue until the brackets balance
+            balance = bracket_depth(value)
+            while balance > 0:
+                more = next(lines, None)
+                if more is None:
+                    break
+                value += "\n" + more
+                balance += bracket_depth(more)
+            parsed = [s[1:-1] for s in re.findall(r'"[^"]*"|\'[^\']*\'', re.sub(r"#.*", "", value))]
+        elif value.startswith("{"):
+            parsed = {}
+        elif value[:1] in ("\"", "'"):
+            parsed = value[1:value.index(value[0], 1)] if value.count(value[0]) > 1 else value[1:]
+        else:
+            parsed = value.split("#")[0].strip()
+        descend(current, parents)[key] = parsed
+    return result
+
+
+def requirement_name(spec: str) -> str | None:
+    """Distribution name of a PEP 508 requirement string, lowercased."""
+    m = re.match(r"\s*([A-Za-z0-9][A-Za-z0-9_.-]*)", spec)
+    return m.group(1).lower() if m else None
+
+
+# Other distribution names that also signal a framework (exact names, normalized)
+DEPENDENCY_ALIASES = {
+    "langchain": ("langchain-core", "langchain-community"),
+    "llama-index": ("llama-index-core",),
+    "actix-web": ("actix",),
+}
+
+
+def normalize_dependency(name: str) -> str:
+    """Normalized distribution name (PEP 503: lowercase, runs of -_. as one -)."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def matches_dependency(signal: str, names: set[str]) -> bool:
+    """True if a dependency is the framework signal itself or one of its DEPENDENCY_ALIASES."""
+    normalized = {normalize_dependency(n) for n in names}
+    return any(name in normalized for name in (signal, *DEPENDENCY_ALIASES.get(signal, ())))
+
+
+class ProjectManifests:
+    """Lazily loaded, parse-once view of a project's manifest files.
+
+    Every detector reads through one instance, so each manifest is read and
+    parsed at most once per project however many detectors consult it, and
+    the root listing answers most existence checks without a stat. TOML is
+    parsed with tomllib (parse_toml_like on Python < 3.11 or invalid TOML).
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._entries: dict[str, bool] | None = None
+        self._links: set[str] = set()  # root names that are symlinks (or could not be stat'ed)
+        self._folded: set[str] = set()  # root names, casefolded
+        self._stats: dict[str, tuple[bool, bool]] = {}
+        self._text: dict[str, str | None] = {}
+        self._parsed: dict[str, object] = {}
+        self._dependencies: set[str] | None = None
+
+    def entries(self) -> dict[str, bool]:
+        """Names in the project root, mapped to whether each is a directory."""
+        if self._entries is None:
+            self._entries = {}
+            try:
+                with os.scandir(self.root) as it:
+                    for entry in it:
+                        try:
+                            self._entries[entry.name] = entry.is_dir()
+                            if entry.is_symlink():
+                                self._links.add(entry.name)
+                        except OSError:
+                            self._entries[entry.name] = False
+                            self._links.add(entry.name)
+            except OSError:
+                pass
+            self._folded = {name.casefold() for name in self._entries}
+        return self._entries
+
+    def _stat(self, rel: str) -> tuple[bool, bool]:
+        if "/" not in rel:
+            # The listing answers exact, non-symlink names and names that no entry
+            # matches even ignoring case; the rest (symlinks, and case variants on
+            # case-insensitive filesystems) are stat'ed, as Path.exists would.
+            entries = self.entries()
+            if rel in entries and rel not in self._links:
+                return True, entries[rel]
+            if rel not in entries and rel.casefold() not in self._folded:
+                return False, False
+        if rel not in self._stats:
+            p = self.root / rel
+            self._stats[rel] = (p.exists(), p.is_dir())
+        return self._stats[rel]
+
+    def exists(self, rel: str) -> bool:
+        return self._stat(rel)[0]
+
+    def is_dir(self, rel: str) -> bool:
+        return self._stat(rel)[1]
+
+    def glob(self, pattern: str) -> list[str]:
+        """Root-level names matching a shell pattern, sorted."""
+        return sorted(n for n in self.entries() if fnmatch.fnmatchcase(n, pattern))
+
+    def glob_dirs(self, pattern: str) -> list[str]:
+        """Directories (relative paths) matching a glob pattern, sorted."""
+        import glob as globmod
+        matches = []
+        for match in sorted(globmod.glob(str(self.root / pattern))):
+            match_path = Path(match)
+            if match_path.is_dir():
+                matches.append(match_path.relative_to(self.root).as_posix())
+        return matches
+
+    def read_bytes(self, rel: str) -> bytes | None:
+        try:
+            return (self.root / rel).read_bytes()
+        except OSError:
+            return None
+
+    def text(self, rel: str) -> str | None:
+        """Decoded file content (None if missing or unreadable)."""
+        if rel not in self._text:
+            data = self.read_bytes(rel) if self.exists(rel) else None
+            self._text[rel] = data.decode("utf-8", errors="ignore") if data is not None else None
+        return self._text[rel]
+
+    def json(self, rel: str) -> dict | None:
+        """Parsed JSON object (None if missing, invalid or not an object)."""
+        if rel not in self._parsed:
+            content = self.text(rel)
+            data = None
+            if content is not None:
+                try:
+                    data = json.loads(content)
+                except ValueError:
+                    pass
+            self._parsed[rel] = data if isinstance(data, dict) else None
+        return self._parsed[rel]
+
+    def toml(self, rel: str) -> dict | None:
+        """Parsed TOML document (None if missing)."""
+        if rel not in self._parsed:
+            content = self.text(rel)
+            data = None
+            if content is not None:
+                try:
+                    import tomllib
+                    data = tomllib.loads(content)
+                except (ImportError, ValueError):
+                    data = parse_toml_like(content)
+            self._parsed[rel] = data
+        return self._parsed[rel]
+
+    def go_module(self) -> dict | None:
+        """module path, go version and required module paths from go.mod."""
+        if "go.mod" not in self._parsed:
+            content = self.text("go.mod")
+            data = None
+            if content is not None:
+                mod_match = re.search(r"^module\s+(\S+)", content, re.MULTILINE)
+                go_match = re.search(r"^go\s+(\S+)", content, re.MULTILINE)
+                data = {
+                    "module": mod_match.group(1) if mod_match else None,
+                    "go": go_match.group(1) if go_match else None,
+                    "requires": re.findall(r"^\s+(\S+)\s+v[\d.]+", content, re.MULTILINE),
+                }
+            self._parsed["go.mod"] = data
+        return self._parsed["go.mod"]
+
+    def python_dependencies(self) -> list[str]:
+        """Dependency names from pyproject.toml (PEP 621, PEP 735 and Poetry)."""
+        data = self.toml("pyproject.toml") or {}
+        project = data.get("project") or {}
+        tool = data.get("tool") or {}
+        poetry = tool.get("poetry") or {}
+        specs = list(project.get("dependencies") or [])
+        for group in (project.get("optional-dependencies") or {}).values():
+            specs.extend(group or [])
+        for group in (data.get("dependency-groups") or {}).values():
+            specs.extend(group or [])
+        specs.extend((tool.get("uv") or {}).get("dev-dependencies") or [])
+        tables = [poetry.get("dependencies") or {}, poetry.get("dev-dependencies") or {}]
+        tables.extend((g or {}).get("dependencies") or {} for g in (poetry.get("group") or {}).values())
+        names = [requirement_name(s) for s in specs if isinstance(s, str)]
+        for table in tables:
+            names.extend(k.lower() for k in table if k.lower() != "python")
+        return [n for n in names if n]
+
+    def cargo_dependencies(self) -> list[str]:
+        """Dependency names from Cargo.toml, including target-specific tables."""
+        data = self.toml("Cargo.toml") or {}
+        sections = ("dependencies", "dev-dependencies", "build-dependencies")
+        tables = [data.get(s) or {} for s in sections]
+        for target in (data.get("target") or {}).values():
+            tables.extend((target or {}).get(s) or {} for s in sections)
+        tables.append((data.get("workspace") or {}).get("dependencies") or {})
+        return [k.lower() for table in tables if isinstance(table, dict) for k in table]
+
+    def dependencies(self) -> set[str]:
+        """Normalized dependency names from every manifest in the project root."""
+        if self._dependencies is not None:
+            return self._dependencies
+        deps: set[str] = set()
+
+        # package.json
+        pkg = self.json("package.json")
+        if pkg:
+            for section in ("dependencies", "devDependencies"):
+                deps.update(k.lower() for k in (pkg.get(section) or {}))
+
+        # pyproject.toml — PEP 621 arrays, dependency groups + poetry tables
+        deps.update(self.python_dependencies())
+
+        # Cargo.toml
+        deps.update(self.cargo_dependencies())
+
+        # go.mod — use last path segment as dep name
+        go_mod = self.go_module()
+        if go_mod:
+            deps.update(path.split("/")[-1].lower() for path in go_mod["requires"])
+
+        # pom.xml (Java Maven)
+        content = self.text("pom.xml")
+        if content:
+            for m in re.finditer(r"<artifactId>([^<]+)</artifactId>", content):
+                deps.add(m.group(1).lower())
+
+        # build.gradle / build.gradle.kts (Java Gradle)
+        for gradle_name in ("build.gradle", "build.gradle.kts"):
+            content = self.text(gradle_name)
+            if content:
+                for m in re.finditer(r"""['"]([\w.-]+:[\w.-]+):[\w.-]+['"]""", content):
+                    deps.add(m.group(1).split(":")[-1].lower())
+
+        # composer.json (PHP)
+        composer = self.json("composer.json")
+        if composer:
+            for section in ("require", "require-dev"):
+                for k in composer.get(section) or {}:
+                    # Skip php itself and extensions
+                    if k != "php" and not k.startswith("ext-"):
+                        deps.add(k.split("/")[-1].lower())
+
+        # *.csproj (C# .NET)
+        for csproj in self.glob("*.csproj"):
+            content = self.text(csproj) or ""
+            for m in re.finditer(r'<PackageReference\s+Include="([^"]+)"', content):
+                deps.add(m.group(1).lower())
+
+        self._dependencies = deps
+        return deps
+
+
+class ArchiveManifests(ProjectManifests):
+    """ProjectManifests answered from a loaded ArchiveSource instead of the disk."""
+
+    def __init__(self, archive: ArchiveSource):
+        super().__init__(archive.path)
+        self.archive = archive
+
+    def entries(self) -> dict[str, bool]:
+        if self._entries is None:
+            self._entries = {name: is_dir for name, is_dir in self.archive.names.items() if "/" not in name}
+        return self._entries
+
+    def _stat(self, rel: str) -> tuple[bool, bool]:
+        is_dir = self.archive.names.get(rel)
+        return is_dir is not None, bool(is_dir)
+
+    def glob_dirs(self, pattern: str) -> list[str]:
+        """Directories matching a glob pattern (no "**"; "*" skips dot names, as glob does)."""
+        parts = pattern.strip("/").split("/")
+        matches = []
+        for name, is_dir in self.archive.names.items():
+            names = name.split("/")
+            if is_dir and len(names) == len(parts) and all(
+                fnmatch.fnmatchcase(n, p) and (p.startswith(".") or not n.startswith("."))
+                for n, p in zip(names, parts)
+            ):
+                matches.append(name)
+        return sorted(matches)
+
+    def read_bytes(self, rel: str) -> bytes | None:
+        return self.archive.data.get(rel)
+
+
+def detect_tech_stack(root: Path, manifests: ProjectManifests | None = None) -> dict:
+    """Detect technology stack from project files."""
+    m = manifests or ProjectManifests(root)
+    frameworks: list[str] = []
+    package_manager = None
+    languages_detected: list[str] = []
+
+    # --- Node.js / JavaScript / TypeScript ---
+    if m.exists("package.json"):
+        languages_detected.append("javascript")
+        pkg = m.json("package.json")
+        if pkg:
+            all_deps = {}
+            all_deps.update(pkg.get("dependencies") or {})
+            all_deps.update(pkg.get("devDependencies") or {})
+
+            framework_signals = {
+                "next": "next.js", "nuxt": "nuxt", "remix": "remix",
+                "@angular/core": "angular", "react": "react", "vue": "vue",
+                "svelte": "svelte", "@sveltejs/kit": "sveltekit",
+                "express": "express", "fastify": "fastify", "koa": "koa",
+                "hono": "hono", "nestjs": "nestjs", "@nestjs/core": "nestjs",
+                "prisma": "prisma", "@prisma/client": "prisma",
+                "drizzle-orm": "drizzle", "typeorm": "typeorm",
+                "sequelize": "sequelize",
+                "electron": "electron", "tauri": "tauri",
+                "@vercel/ai": "vercel-ai-sdk", "ai": "vercel-ai-sdk",
+                "@langchain/core": "langchain",
+                "llamaindex": "llamaindex",
+                "@modelcontextprotocol/sdk": "mcp-sdk",
+            }
+            for dep, fw in framework_signals.items():
+                if dep in all_deps and fw not in frameworks:
+                    frameworks.append(fw)
+
+        # Detect package manager
+        if m.exists("bun.lockb") or m.exists("bun.lock"):
+            package_manager = "bun"
+        elif m.exists("pnpm-lock.yaml"):
+            package_manager = "pnpm"
+        elif m.exists("yarn.lock"):
+            package_manager = "yarn"
+        elif m.exists("package-lock.json"):
+            package_manager = "npm"
+
+    if m.exists("tsconfig.json"):
+        if "typescript" not in languages_detected:
+            languages_detected.append("typescript")
+
+    # --- Python ---
+    if m.exists("pyproject.toml") or m.exists("setup.py"):
+        languages_detected.append("python")
+        if m.exists("pyproject.toml"):
+            toml_data = m.toml("pyproject.toml") or {}
+            # Check build system
+            build_backend = (toml_data.get("build-system") or {}).get("build-backend") or ""
+            if "hatchling" in build_backend:
+                frameworks.append("hatch")
+            elif "setuptools" in build_backend:
+                frameworks.append("setuptools")
+            elif "poetry" in build_backend:
+                frameworks.append("poetry")
+
+            py_deps = set(m.python_dependencies())
+            py_fw_signals = {
+                "fastapi": "fastapi", "django": "django", "flask": "flask",
+                "starlette": "starlette", "litestar": "litestar",
+                "sqlalchemy": "sqlalchemy", "tortoise-orm": "tortoise-orm",
+                "langchain": "langchain", "llama-index": "llamaindex",
+                "openai": "openai-sdk", "anthropic": "anthropic-sdk",
+                "mcp": "mcp-sdk",
+            }
+            for dep, fw in py_fw_signals.items():
+                if matches_dependency(dep, py_deps) and fw not in frameworks:
+                    frameworks.append(fw)
+
+        package_manager = package_manager or "uv" if m.exists("uv.lock") else package_manager or "pip"
+
+    # --- Rust ---
+    if m.exists("Cargo.toml"):
+        languages_detected.append("rust")
+        rust_deps = set(m.cargo_dependencies())
+        rust_fw = {
+            "actix-web": "actix-web", "axum": "axum", "rocket": "rocket",
+            "warp": "warp", "tokio": "tokio", "tauri": "tauri",
+        }
+        for dep, fw in rust_fw.items():
+            if matches_dependency(dep, rust_deps) and fw not in frameworks:
+                frameworks.append(fw)
+
+    # --- Go ---
+    go_mod = m.go_module()
+    if go_mod:
+        languages_detected.append("go")
+        go_fw = {
+            "gin-gonic/gin": "gin", "labstack/echo": "echo",
+            "gofiber/fiber": "fiber", "gorilla/mux": "gorilla-mux",
+        }
+        for dep, fw in go_fw.items():
+            if any(dep in path for path in go_mod["requires"]) and fw not in frameworks:
+                frameworks.append(fw)
+
+    # --- Java ---
+    if m.exists("pom.xml"):
+        languages_detected.append("java")
+        package_manager = package_manager or "maven"
+        content = m.text("pom.xml") or ""
+        if "spring-boot" in content:
+            frameworks.append("spring-boot")
+        if "quarkus" in content:
+            frameworks.append("quarkus")
+    elif m.exists("build.gradle") or m.exists("build.gradle.kts"):
+        languages_detected.append("java")
+        package_manager = package_manager or "gradle"
+        content = m.text("build.gradle" if m.exists("build.gradle") else "build.gradle.kts") or ""
+        if "spring-boot" in content or "org.springframework.boot" in content:
+            frameworks.append("spring-boot")
+        if "quarkus" in content or "io.quarkus" in content:
+            frameworks.append("quarkus")
+
+    # --- C# / .NET ---
+    csproj_files = m.glob("*.csproj")
+    if m.glob("*.sln") or csproj_files:
+        languages_detected.append("csharp")
+        package_manager = package_manager or "dotnet"
+        for csproj in csproj_files:
+            content = m.text(csproj) or ""
+            if "Microsoft.AspNetCore" in content or "Microsoft.NET.Sdk.Web" in content:
+                if "aspnet-core" not in frameworks:
+                    frameworks.append("aspnet-core")
+            if "Microsoft.AspNetCore.Components" in content or "Blazor" in content:
+                if "blazor" not in frameworks:
+                    frameworks.append("blazor")
+
+    # --- PHP ---
+    if m.exists("composer.json"):
+        languages_detected.append("php")
+        package_manager = package_manager or "composer"
+        pkg = m.json("composer.json")
+        if pkg:
+            all_php_deps = {}
+            all_php_deps.update(pkg.get("require") or {})
+            all_php_deps.update(pkg.get("require-dev") or {})
+            php_fw = {
+                "laravel/framework": "laravel",
+                "symfony/framework-bundle": "symfony",
+                "symfony/symfony": "symfony",
+            }
+            for dep, fw in php_fw.items():
+                if dep in all_php_deps and fw not in frameworks:
+                    frameworks.append(fw)
+
+    return {
+        "languages_detected": languages_detected,
+        "frameworks": frameworks,
+        "package_manager": package_manager,
+    }
+
+
+def extract_package_metadata(root: Path, manifests: ProjectManifests | None = None) -> dict:
+    """Extract package metadata from manifest files."""
+    m = manifests or ProjectManifests(root)
+    meta: dict[str, str | int | None] = {
+        "name": None,
+        "version": None,
+        "license": None,
+        "description": None,
+        "dependencies_count": 0,
+    }
+
+    def string(value) -> str | None:
+        # Tables such as license = { text = "MIT" } carry the value in "text"
+        if isinstance(value, dict):
+            value = value.get("text")
+        return value if isinstance(value, str) else None
+
+    # Try package.json
+    pkg = m.json("package.json")
+    if pkg:
+        meta["name"] = pkg.get("name")
+        meta["version"] = pkg.get("version")
+        meta["license"] = pkg.get("license")
+        meta["description"] = pkg.get("description")
+        deps = len(pkg.get("dependencies") or {})
+        dev_deps = len(pkg.get("devDependencies") or {})
+        meta["dependencies_count"] = deps + dev_deps
+        return meta
+
+    # Try pyproject.toml
+    toml_data = m.toml("pyproject.toml")
+    if toml_data is not None:
+        project = toml_data.get("project") or {}
+        poetry = (toml_data.get("tool") or {}).get("poetry") or {}
+        for key in ("name", "version", "license", "description"):
+            meta[key] = string(project.get(key)) or string(poetry.get(key))
+        poetry_deps = [k for k in poetry.get("dependencies") or {} if k.lower() != "python"]
+        meta["dependencies_count"] = len(project.get("dependencies") or []) + len(poetry_deps)
+        return meta
+
+    # Try Cargo.toml
+    toml_data = m.toml("Cargo.toml")
+    if toml_data is not None:
+        package = toml_data.get("package") or {}
+        for key in ("name", "version", "license", "description"):
+            meta[key] = string(package.get(key))
+        meta["dependencies_count"] = sum(
+            len(toml_data.get(s) or {}) for s in ("dependencies", "dev-dependencies")
+        )
+        return meta
+
+    # Try go.mod
+    go_mod = m.go_module()
+    if go_mod:
+        meta["name"] = go_mod["module"]
+        meta["version"] = go_mod["go"]
+        meta["dependencies_count"] = len(go_mod["requires"])
+        return meta
+
+    # Fallback: use directory name
+    meta["name"] = root.name
+    return meta
+
+
+def extract_all_dependencies(root: Path, manifests: ProjectManifests | None = None) -> set[str]:
+    """Extract normalized dependency names from all manifest files."""
+    return (manifests or ProjectManifests(root)).dependencies()
+
+
+def detect_conditional_sections(
+    root: Path, dependency_names: set[str], manifests: ProjectManifests | None = None
+) -> list[str]:
+    """Detect which conditional sections to include based on dependencies and file presence."""
+    m = manifests or ProjectManifests(root)
+    sections: list[str] = []
+
+    # 4.1 Storage Layer
+    storage_deps = {
+        "prisma", "@prisma/client", "sequelize", "typeorm", "drizzle-orm", "drizzle-kit",
+        "knex", "pg", "postgres", "mysql2", "mariadb", "better-sqlite3",
+        "sqlalchemy", "alembic", "django", "tortoise-orm", "peewee",
+        "diesel", "sqlx", "sea-orm", "rusqlite",
+        "gorm", "mongoose", "mongodb", "redis", "ioredis", "aioredis",
+        "dynamodb", "firestore", "firebase-admin", "cassandra-driver", "couchbase",
+    }
+    storage_dirs = ["migrations", "prisma", "alembic", "db/migrate", "src/database", "drizzle"]
+    if dependency_names & storage_deps or any(m.exists(d) for d in storage_dirs):
+        sections.append("Storage")
+
+    # 4.2 Embedding Pipeline (requires both embedding model + vector store)
+    embedding_deps = {
+        "openai", "sentence-transformers", "cohere",
+        "tiktoken", "langchain", "@langchain/core",
+    }
+    vector_deps = {
+        "pinecone", "chromadb", "qdrant-client", "weaviate-client",
+        "pymilvus", "faiss-cpu", "faiss-gpu", "pgvector", "lancedb",
+    }
+    embedding_dirs = ["embeddings", "vectorstore", "vector_store"]
+    has_embedding = bool(dependency_names & embedding_deps)
+    has_vector = bool(dependency_names & vector_deps) or any(m.exists(d) for d in embedding_dirs)
+    if has_embedding and has_vector:
+        sections.append("Embedding")
+
+    # 4.3 Infrastructure Layer
+    infra_files = [
+        "Dockerfile", "docker-compose.yml", "docker-compose.yaml",
+        "compose.yml", "compose.yaml", "vercel.json", "netlify.toml",
+        "fly.toml", "render.yaml", "railway.json", "serverless.yml", "serverless.ts",
+        "cdk.json", "Pulumi.yaml",
+    ]
+    infra_dirs = ["k8s", "kubernetes", ".k8s", "terraform", "CDK", "pulumi"]
+    if any(m.exists(f) for f in infra_files) or any(m.is_dir(d) for d in infra_dirs):
+        sections.append("Infrastructure")
+    else:
+        # Check for *.tf files
+        if m.glob("*.tf"):
+            sections.append("Infrastructure")
+
+    # 4.4 Knowledge Graph
+    graph_deps = {
+        "neo4j", "neo4j-driver", "dgraph", "arangodb",
+        "rdflib", "sparqlwrapper", "gremlin", "tinkerpop",
+    }
+    graph_dirs = ["graph", "ontology"]
+    if dependency_names & graph_deps or any(m.is_dir(d) for d in graph_dirs):
+        sections.append("Knowledge Graph")
+
+    # 4.5 Scalability
+    scale_deps = {
+        "bullmq", "bull", "celery", "amqplib", "amqp",
+        "kafkajs", "confluent-kafka", "nats",
+        "rq",
+    }
+    scale_dirs = ["workers", "queues", "jobs", "tasks"]
+    if dependency_names & scale_deps or any(m.is_dir(d) for d in scale_dirs):
+        sections.append("Scalability")
+
+    # 4.6 Concurrency & Multi-Agent
+    concurrency_deps = {
+        "aiohttp", "httpx",
+        "crewai", "autogen", "langgraph",
+    }
+    concurrency_dirs = ["agents", "agent", "crew", "workflows", "orchestrator"]
+    if dependency_names & concurrency_deps or any(m.is_dir(d) for d in concurrency_dirs):
+        sections.append("Concurrency")
+
+    return sections
+
+
+def workspace_patterns(manifests: ProjectManifests) -> list[tuple[str, list[str]]]:
+    """Workspace package globs per package manager, in detection priority order."""
+    m = manifests
+    sources: list[tuple[str, list[str]]] = []
+
+    # Node.js workspaces (package.json): list of globs or object with packages key
+    pkg = m.json("package.json")
+    if pkg and "workspaces" in pkg:
+        ws = pkg["workspaces"]
+        patterns = ws if isinstance(ws, list) else ws.get("packages", [])
+        sources.append(("npm", [p for p in patterns if isinstance(p, str)]))
+
+    # pnpm-workspace.yaml
+    content = m.text("pnpm-workspace.yaml")
+    if content is not None:
+        patterns = []
+        for line in content.splitlines():
+            line = line.strip().lstrip("- ").strip("'\"")
+            if line and not line.startswith("#") and not line.startswith("packages"):
+                patterns.append(line)
+        sources.append(("pnpm", patterns))
+
+    # lerna.json
+    lerna = m.json("lerna.json")
+    if lerna:
+        sources.append(("lerna", lerna.get("packages", ["packages/*"])))
+
+    # Cargo workspace
+    cargo = m.toml("Cargo.toml")
+    if cargo:
+        members = (cargo.get("workspace") or {}).get("members") or []
+        if members:
+            sources.append(("cargo", members))
+
+    # Go workspace (go.work)
+    content = m.text("go.work")
+    if content is not None:
+        sources.append(("go", [
+            match.group(1).lstrip("./") for match in re.finditer(r"^\s+(\./?\S+)", content, re.MULTILINE)
+        ]))
+
+    return sources
+
+
+def workspace_entry(manifests: ProjectManifests, ws_path: str, package_manager: str) -> dict:
+    """Name/path/package_manager record for one workspace package."""
+    name = Path(ws_path).name
+    if package_manager in ("npm", "pnpm"):
+        ws_pkg = manifests.json(f"{ws_path}/package.json")
+        name = ws_pkg.get("name", name) if ws_pkg else name
+    return {"name": name, "path": ws_path, "package_manager": package_manager}
+
+
+def detect_workspaces(root: Path, manifests: ProjectManifests | None = None) -> list[dict]:
+    """Detect monorepo workspace packages by globbing the workspace patterns.
+
+    Scans pass a WorkspaceRollup instead, which finds the same packages
+    during the walk and adds per-package totals.
+    """
+    m = manifests or ProjectManifests(root)
+    workspaces: list[dict] = []
+    for package_manager, patterns in workspace_patterns(m):
+        for pattern in patterns:
+            for ws_path in m.glob_dirs(pattern):
+                if package_manager == "npm" and not m.exists(f"{ws_path}/package.json"):
+                    continue
+                workspaces.append(workspace_entry(m, ws_path, package_manager))
+        if workspaces:
+            break
+    return workspaces
+
+
+class WorkspaceRollup:
+    """Attribute scanned files to monorepo workspace packages during the walk.
+
+    Directories matching a workspace pattern become candidates as the walk
+    reaches them, and each file's tokens go to its deepest candidate. At the
+    end, the first package manager (in detect_workspaces priority) with any
+    valid package wins; npm packages must contain a package.json. Candidates
+    that did not qualify hand their totals to the nearest qualifying ancestor.
+    """
+
+    def __init__(self, manifests: ProjectManifests):
+        self.manifests = manifests
+        self.sources = []
+        for package_manager, patterns in workspace_patterns(manifests):
+            compiled = []
+            for pattern in patterns:
+                pattern = pattern.strip().strip("/")
+                while pattern.startswith("./"):
+                    pattern = pattern[2:]
+                if pattern and not pattern.startswith("!"):
+                    compiled.append((pattern, re.compile(translate_ignore_glob(pattern) + r"\Z")))
+            self.sources.append((package_manager, compiled))
+        self.candidates: dict[str, dict] = {}
+        self._owner_dir: str | None = None
+        self._owner: dict | None = None
+
+    def directory(self, rel_path: str) -> None:
+        """Register a walked directory as a candidate if any pattern matches it."""
+        for package_manager, compiled in self.sources:
+            for _, regex in compiled:
+                if regex.match(rel_path):
+                    candidate = self.candidates.setdefault(rel_path, {
+                        "managers": set(), "has_package_json": False,
+                        "files": 0, "tokens": 0, "lang_tokens": {}, "lang_files": {},
+                    })
+                    candidate["managers"].add(package_manager)
+                    break
+
+    def owner(self, parent: str) -> dict | None:
+        """Deepest candidate at or above directory `parent` (memoized per directory)."""
+        if parent != self._owner_dir:
+            self._owner_dir = parent
+            self._owner = None
+            while parent:
+                if parent in self.candidates:
+                    self._owner = self.candidates[parent]
+                    break
+                parent = parent.rpartition("/")[0]
+        return self._owner
+
+    def add(self, rel_path: str, tokens: int, lang: str | None, sent: bool = True) -> None:
+        """Count one measured text file (sent=False for oversized files)."""
+        if not self.candidates:
+            return
+        parent, _, name = rel_path.rpartition("/")
+        if name == "package.json" and parent in self.candidates:
+            self.candidates[parent]["has_package_json"] = True
+        candidate = self.owner(parent)
+        if candidate is None:
+            return
+        candidate["tokens"] += tokens
+        candidate["files"] += sent
+        if lang:
+            candidate["lang_tokens"][lang] = candidate["lang_tokens"].get(lang, 0) + tokens
+            candidate["lang_files"][lang] = candidate["lang_files"].get(lang, 0) + 1
+
+    def finish(self) -> list[dict]:
+        """Workspace records with files, tokens and language distribution."""
+        chosen, valid = None, set()
+        for package_manager, compiled in self.sources:
+            valid = {
+                path for path, c in self.candidates.items()
+                if package_manager in c["managers"] and (package_manager != "npm" or c["has_package_json"])
+            }
+            if valid:
+                chosen = package_manager, compiled
+                break
+        if not chosen:
+            return []
+
+        # Fold non-qualifying candidates into their nearest qualifying ancestor, deepest first
+        for path in sorted(self.candidates, key=lambda p: p.count("/"), reverse=True):
+            if path in valid:
+                continue
+            candidate = self.candidates[path]
+            parent = path.rpartition("/")[0]
+            while parent and parent not in self.candidates:
+                parent = parent.rpartition("/")[0]
+            if parent:
+                target = self.candidates[parent]
+                target["tokens"] += candidate["tokens"]
+                target["files"] += candidate["files"]
+                for key in ("lang_tokens", "lang_files"):
+                    for lang, count in candidate[key].items():
+                        target[key][lang] = target[key].get(lang, 0) + count
+
+        package_manager, compiled = chosen
+        workspaces = []
+        seen = set()
+        for _, regex in compiled:
+            for path in sorted(p for p in valid if regex.match(p)):
+                if path in seen:
+                    continue
+                seen.add(path)
+                c = self.candidates[path]
+                entry = workspace_entry(self.manifests, path, package_manager)
+                entry.update({
+                    "files": c["files"],
+                    "tokens": c["tokens"],
+                    "language_distribution": {
+                        "by_tokens": dict(sorted(c["lang_tokens"].items(), key=lambda x: x[1], reverse=True)),
+                        "by_files": dict(sorted(c["lang_files"].items(), key=lambda x: x[1], reverse=True)),
+                    },
+                })
+                workspaces.append(entry)
+        return workspaces
+
+
+def read_notebook(path: Path) -> str | None:
+    """Read a Jupyter notebook, returning only source cell content (no outputs)."""
+    try:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            return notebook_source(f.read())
+    except Exception:
+        return None
+
+
+def notebook_source(raw: str) -> str | None:
+    """Extract code and markdown cell sources from notebook JSON (None if unparseable)."""
+    try:
+        nb = json.loads(raw)
+        cells = nb.get("cells", [])
+        sources = []
+        for cell in cells:
+            cell_type = cell.get("cell_type", "")
+            if cell_type in ("code", "markdown"):
+                source = cell.get("source", [])
+                if isinstance(source, list):
+                    sources.append("".join(source))
+                elif isinstance(source, str):
+                    sources.append(source)
+        return "\n\n".join(sources) if sources else ""
+    except Exception:
+        return None
+
+
+ENTRY_POINT_CANDIDATES = (
+    "src/server.ts", "src/server.js", "src/app.ts", "src/app.js",
+    "server.ts", "server.js", "app.ts", "app.js",
+    "src/main.ts", "src/main.js", "main.ts", "main.js",
+    "src/index.ts", "src/index.js", "index.ts", "index.js",
+    "app/main.py", "main.py", "app.py", "manage.py",
+    "src/main.rs", "cmd/main.go", "main.go",
+)
+
+
+def detect_entry_points(root: Path, manifests: ProjectManifests | None = None) -> list[dict]:
+    """Detect project entry points (CLI, API, library)."""
+    m = manifests or ProjectManifests(root)
+    entries: list[dict] = []
+
+    # Check package.json bin/main/exports
+    pkg = m.json("package.json")
+    if pkg:
+        if "bin" in pkg:
+            bin_val = pkg["bin"]
+            if isinstance(bin_val, str):
+                entries.append({"type": "cli", "path": bin_val})
+            elif isinstance(bin_val, dict):
+                for name, path in bin_val.items():
+                    entries.append({"type": "cli", "path": path, "name": name})
+
+        if "main" in pkg:
+            entries.append({"type": "library", "path": pkg["main"]})
+        elif "exports" in pkg:
+            exp = pkg["exports"]
+            if isinstance(exp, str):
+                entries.append({"type": "library", "path": exp})
+            elif isinstance(exp, dict) and "." in exp:
+                dot_exp = exp["."]
+                if isinstance(dot_exp, str):
+                    entries.append({"type": "library", "path": dot_exp})
+
+    # Check common entry point files
+    for candidate in ENTRY_POINT_CANDIDATES:
+        if m.exists(candidate):
+            # Determine type by peeking at content
+            entry_type = "library"
+            content = (m.text(candidate) or "")[:2000]
+            if any(kw in content for kw in ["listen(", "createServer", "app.run", "uvicorn", "serve("]):
+                entry_type = "api"
+            elif any(kw in content for kw in ["argparse", "commander", "yargs", "clap", "cobra", "cli"]):
+                entry_type = "cli"
+
+            # Avoid duplicates
+            if not any(e["path"] == candidate for e in entries):
+                entries.append({"type": entry_type, "path": candidate})
+            break  # Only take the first match
+
+    return entries
+
+
+def detect_project_features(root: Path, manifests: ProjectManifests | None = None) -> dict:
+    """Detect project features like Docker, CI, tests."""
+    m = manifests or ProjectManifests(root)
+    has_dockerfile = m.exists("Dockerfile") or m.exists("dockerfile")
+    has_docker_compose = m.exists("docker-compose.yml") or m.exists("docker-compose.yaml") or m.exists("compose.yml")
+
+    # CI detection
+    ci = None
+    if m.is_dir(".github/workflows"):
+        ci = "github-actions"
+    elif m.exists(".gitlab-ci.yml"):
+        ci = "gitlab-ci"
+    elif m.is_dir(".circleci"):
+        ci = "circleci"
+    elif m.exists("Jenkinsfile"):
+        ci = "jenkins"
+    elif m.exists(".travis.yml"):
+        ci = "travis"
+    elif m.exists("bitbucket-pipelines.yml"):
+        ci = "bitbucket-pipelines"
+
+    # Test detection
+    has_tests = False
+    test_dirs = ["tests", "test", "__tests__", "spec", "specs", "e2e", "cypress", "playwright"]
+    for d in test_dirs:
+        if m.is_dir(d):
+            has_tests = True
+            break
+
+    if not has_tests:
+        # Check for test config files
+        test_configs = [
+            "jest.config.js", "jest.config.ts", "vitest.config.ts", "vitest.config.js",
+            "pytest.ini", "conftest.py", ".pytest.ini",
+            "karma.conf.js", "cypress.config.js", "cypress.config.ts",
+            "playwright.config.ts", "playwright.config.js",
+        ]
+        for tc in test_configs:
+            if m.exists(tc):
+                has_tests = True
+                break
+
+    # Check for CODEBASE_MAP.md
+    has_codebase_map = m.exists("docs/CODEBASE_MAP.md")
+
+    return {
+        "has_dockerfile": has_dockerfile,
+        "has_docker_compose": has_docker_compose,
+        "has_ci": ci,
+        "has_tests": has_tests,
+        "has_codebase_map": has_codebase_map,
+    }
+
+
+def detect_project_profile(
+    root: Path,
+    manifests: ProjectManifests | None = None,
+    workspaces: list[dict] | None = None,
+    profiler: ScanProfiler | None = None,
+) -> dict:
+    """Run every project-level detector (tech stack, metadata, entry points, ...).
+
+    All detectors share one ProjectManifests, so each manifest is parsed once.
+    Pass `workspaces` (from a WorkspaceRollup) to skip the glob-based detection.
+    With a ScanProfiler, each detector is timed as its own phase.
+    """
+    m = manifests or ProjectManifests(root)
+
+    def run(detector, *args):
+        with profile_phase(profiler, detector.__name__):
+            return detector(*args)
+
+    return {
+        "tech_stack": run(detect_tech_stack, root, m),
+        "package_metadata": run(extract_package_metadata, root, m),
+        "entry_points": run(detect_entry_points, root, m),
+        "project_features": run(detect_project_features, root, m),
+        "detected_sections": run(detect_conditional_sections, root, m.dependencies(), m),
+        "workspaces": workspaces if workspaces is not None else run(detect_workspaces, root, m),
+    }
+
+
+DEFAULT_AGENT_BUDGET = 150_000
+
+# Role heuristics for Phase 2 file assignment (matched against path components)
+ROLE_NAMES = {
+    "core": {
+        "src", "lib", "core", "models", "model", "types", "domain", "entities", "pkg",
+        "internal", "app", "engine", "kernel", "common", "utils",
+    },
+    "architecture": {
+        "routes", "router", "middleware", "middlewares", "config", "configs", "server",
+        "tests", "test", "__tests__", "spec", "specs", "e2e", "infra", "deploy",
+        "migrations", "db", "database", "shared", "build", "k8s", "terraform",
+    },
+    "integration": {
+        "api", "cli", "cmd", "bin", "sdk", "sdks", "client", "clients", "examples",
+        "example", "docs", "doc", "scripts", ".github", "plugins", "integrations",
+        "website", "demo", "demos",
+    },
+}
+AGENT_ROLES = {
+    1: [("A", ["core", "architecture", "integration"])],
+    2: [("AB", ["core", "architecture"]), ("C", ["integration"])],
+    3: [("A", ["core"]), ("B", ["architecture"]), ("C", ["integration"])],
+}
+
+
+def group_role(path: str, name: str | None = None) -> str:
+    """Role heuristic for a file group: core, architecture or integration."""
+    words = [p.lower() for p in path.split("/") if p]
+    if name:
+        words.extend(re.split(r"[^a-z0-9_.]+", name.lower()))
+    for word in words:
+        for role in ("integration", "architecture", "core"):
+            if word in ROLE_NAMES[role] or any(word.endswith("-" + w) for w in ROLE_NAMES[role]):
+                return role
+    return "core"
+
+
+def partition_groups(files: list[dict], workspaces: list[dict] | None, budget: int) -> list[dict]:
+    """Group files by workspace package or top-level directory, splitting groups over budget.
+
+    Root-level Markdown goes with core, other root files with architecture.
+    A group larger than the budget is split by its next path component.
+    """
+    packages = sorted((ws["path"] for ws in workspaces or []), key=len, reverse=True)
+    names = {ws["path"]: ws["name"] for ws in workspaces or []}
+    members: dict[str, list[tuple[str, int]]] = {}
+    for f in files:
+        path = f["path"]
+        key = next((p for p in packages if path.startswith(p + "/")), None)
+        if key is None:
+            head, sep, _ = path.partition("/")
+            key = head if sep else ("(root docs)" if path.lower().endswith(".md") else "(root)")
+        members.setdefault(key, []).append((path, f["tokens"]))
+
+    def make(key: str, items: list[tuple[str, int]], split: bool) -> dict:
+        if key == "(root docs)":
+            role = "core"
+        elif key == "(root)":
+            role = "architecture"
+        else:
+            role = group_role(key, names.get(key))
+        group = {
+            "path": key,
+            "role": role,
+            "tokens": sum(t for _, t in items),
+            "files": len(items),
+            "paths": [p for p, _ in items],
+        }
+        if key in names:
+            group["package"] = names[key]
+        if split:
+            group["split"] = True
+        return group
+
+    groups = []
+    pending = [(key, items, False) for key, items in members.items()]
+    while pending:
+        key, items, split = pending.pop()
+        if sum(t for _, t in items) <= budget or len(items) == 1 or key.startswith("("):
+            groups.append(make(key, items, split))
+            continue
+        # Split by the next path component; files directly inside stay together
+        parts: dict[str, list[tuple[str, int]]] = {}
+        for path, tokens in items:
+            head, sep, _ = path[len(key) + 1:].partition("/")
+            parts.setdefault(f"{key}/{head}" if sep else key, []).append((path, tokens))
+        if len(parts) == 1 and key in parts:
+            groups.append(make(key, items, split))
+            continue
+        for sub, sub_items in parts.items():
+            if sub == key:
+                groups.append(make(key, sub_items, True))
+            else:
+                pending.append((sub, sub_items, True))
+    return groups
+
+
+def plan_partition(
+    files: list[dict], workspaces: list[dict] | None, agents: int, budget: int = DEFAULT_AGENT_BUDGET
+) -> dict:
+    """Assign file groups to `agents` agents under a per-agent token budget.
+
+    Groups are placed largest first (LPT bin packing): each goes to the
+    least-loaded agent whose role matches the group's, unless that would
+    push the agent past the budget or well past an even share, in which
+    case it goes to the least-loaded agent with room. Groups that fit
+    nowhere overflow to the least-loaded agent.
+    """
+    groups = partition_groups(files, workspaces, budget)
+    total = sum(g["tokens"] for g in groups)
+    if agents in AGENT_ROLES:
+        layout = AGENT_ROLES[agents]
+    else:
+        roles = ["core", "architecture", "integration"]
+        layout = [(chr(ord("A") + i) if i < 26 else f"A{i}", [roles[i % 3]]) for i in range(agents)]
+    plan = [
+        {"agent": label, "roles": roles, "tokens": 0, "files": 0, "groups": [], "paths": []}
+        for label, roles in layout
+    ]
+    share = total / agents
+
+    for group in sorted(groups, key=lambda g: (-g["tokens"], g["path"])):
+        tokens = group["tokens"]
+        fits = [a for a in plan if a["tokens"] + tokens <= budget]
+        preferred = [
+            a for a in fits
+            if group["role"] in a["roles"] and a["tokens"] + tokens <= max(share * 1.1, tokens)
+        ]
+        candidates = preferred or fits or plan
+        agent = min(candidates, key=lambda a: a["tokens"])
+        agent["tokens"] += tokens
+        agent["files"] += group["files"]
+        agent["groups"].append({k: v for k, v in group.items() if k != "paths"})
+        agent["paths"].extend(group["paths"])
+
+    for agent in plan:
+        agent["paths"].sort()
+        agent["over_budget"] = agent["tokens"] > budget
+    loads = [a["tokens"] for a in plan]
+    return {
+        "agents": agents,
+        "budget": budget,
+        "total_tokens": total,
+        "max_agent_tokens": max(loads),
+        "min_agent_tokens": min(loads),
+        "imbalance": round(max(loads) / (total / agents), 3) if total else 1.0,
+        "over_budget": total > budget * agents or any(a["over_budget"] for a in plan),
+        "assignments": plan,
+    }
+
+
+# Build and dependency manifests, read before any source when packing context
+PACK_MANIFESTS = {
+    "package.json", "pyproject.toml", "setup.py", "setup.cfg", "requirements.txt", "pipfile",
+    "cargo.toml", "go.mod", "gemfile", "composer.json", "pom.xml", "build.gradle", "build.gradle.kts",
+    "deno.json", "tsconfig.json", "makefile", "dockerfile", "cmakelists.txt", "mix.exs",
+}
+PACK_TEST_DIRS = {"tests", "test", "__tests__", "spec", "specs", "e2e", "testdata", "fixtures"}
+# Languages that hold data or markup rather than logic
+PACK_DATA_LANGS = {"json", "yaml", "toml", "xml", "html", "css", "scss", "sass", "less"}
+PACK_MAX_CANDIDATES = 600
+PACK_MAX_UNITS = 2000
+
+
+def pack_score(path: str, tokens: int, entry_points: set[str], rank: float = 0.0) -> tuple[float, str]:
+    """Value of a file in a context pack, and its kind (the reading-order tier).
+
+    Kinds: readme, manifest, changelog, doc, entry_point, source, other, test.
+    A file's importance comes from its kind (entry points, the root README and
+    manifests far above the rest) plus centrality: shallow files, files under
+    core directories and, when known, files with a high `rank` (import-graph
+    PageRank relative to the highest). The value is importance times the
+    square root of its tokens: substance grows with length, but sublinearly,
+    so neither a few huge files nor many near-empty ones crowd out the rest.
+    """
+    import math
+
+    parts = path.split("/")
+    name = parts[-1].lower()
+    depth = len(parts) - 1
+    stem, ext = os.path.splitext(name)
+    lang = EXT_TO_LANG.get(ext)
+    if path in entry_points:
+        kind, importance = "entry_point", 12.0
+    elif stem == "readme":
+        kind, importance = "readme", 12.0 if depth == 0 else 4.0
+    elif name in PACK_MANIFESTS:
+        kind, importance = "manifest", 8.0 if depth == 0 else 3.0
+    elif stem in ("changelog", "history", "changes"):
+        kind, importance = "changelog", 2.0 if depth == 0 else 0.3
+    elif lang == "markdown" or ext in (".rst", ".txt"):
+        kind, importance = "doc", 2.0 if depth == 0 else 1.0
+    elif (
+        any(p.lower() in PACK_TEST_DIRS for p in parts[:-1])
+        or stem.startswith("test_") or stem.endswith(("_test", ".test", ".spec"))
+    ):
+        kind, importance = "test", 0.5
+    elif lang is None or lang in PACK_DATA_LANGS or name.startswith("."):
+        kind, importance = "other", 0.5
+    else:
+        kind, importance = "source", 2.0
+    importance += 2.0 / (1 + depth)
+    if depth and group_role("/".join(parts[:-1])) == "core":
+        importance += 1.0
+    importance += 4.0 * rank
+    return round(importance * math.sqrt(tokens), 3), kind
+
+
+PACK_ORDER = ("readme", "manifest", "changelog", "doc", "entry_point", "source", "other", "test")
+
+
+def plan_pack(
+    files: list[dict], entry_points: list[dict] | None, budget: int, ranks: dict[str, float] | None = None
+) -> dict:
+    """Choose the files worth reading first under a token budget (0/1 knapsack).
+
+    Each file is worth its pack_score and costs its tokens. The knapsack runs
+    over the PACK_MAX_CANDIDATES files with the best score per token, with
+    costs rounded up to budget / PACK_MAX_UNITS tokens, so it never exceeds
+    the budget; room left by the rounding is filled greedily. The chosen files
+    are listed in reading order: README, manifests, changelog and docs, entry
+    points, then sources and tests, each tier in walk order. `ranks` (PageRank
+    by path, from ImportGraph) lifts the files the rest of the code imports.
+    """
+    entries = {str(e.get("path", "")).removeprefix("./") for e in entry_points or []}
+    top_rank = max((ranks or {}).values(), default=0.0) or 1.0
+    items = []
+    for f in files:
+        if 0 < f["tokens"] <= budget:
+            rank = (ranks or {}).get(f["path"], 0.0) / top_rank
+            score, kind = pack_score(f["path"], f["tokens"], entries, rank)
+            items.append((f["path"], f["tokens"], score, kind))
+    items.sort(key=lambda x: (-x[2] / x[1], walk_key(x[0])))
+    candidates, rest = items[:PACK_MAX_CANDIDATES], items[PACK_MAX_CANDIDATES:]
+
+    unit = -(-budget // PACK_MAX_UNITS)
+    capacity = budget // unit
+    best = [0.0] * (capacity + 1)
+    taken = []
+    for _, tokens, score, _ in candidates:
+        weight = -(-tokens // unit)
+        take = bytearray(capacity + 1)
+        for c in range(capacity, weight - 1, -1):
+            value = best[c - weight] + score
+            if value > best[c]:
+                best[c] = value
+                take[c] = 1
+        taken.append(take)
+    chosen = []
+    c = capacity
+    for i in range(len(candidates) - 1, -1, -1):
+        if taken[i][c]:
+            chosen.append(candidates[i])
+            c -= -(-candidates[i][1] // unit)
+    used = sum(item[1] for item in chosen)
+    picked = {item[0] for item in chosen}
+    for item in candidates + rest:
+        if item[0] not in picked and used + item[1] <= budget:
+            chosen.append(item)
+            picked.add(item[0])
+            used += item[1]
+
+    chosen.sort(key=lambda x: (PACK_ORDER.index(x[3]), walk_key(x[0])))
+    return {
+        "budget": budget,
+        "tokens": used,
+        "files": len(chosen),
+        "score": round(sum(item[2] for item in chosen), 3),
+        "considered": len(items),
+        "paths": [
+            {"path": path, "tokens": tokens, "score": score, "kind": kind}
+            for path, tokens, score, kind in chosen
+        ],
+    }
+
+
+def write_pack(root: Path, pack: dict, out) -> None:
+    """Write the packed files' contents in reading order, each wrapped in a <file> tag."""
+    out.write(
+        f"<!-- context pack: {pack['files']} files, {pack['tokens']:,} of {pack['budget']:,} tokens -->\n"
+    )
+    for entry in pack["paths"]:
+        try:
+            content = (root / entry["path"]).read_text(encoding="utf-8", errors="replace")
+        except OSError as e:
+            print(f"WARNING: Failed to read {entry['path']}: {e}", file=sys.stderr)
+            continue
+        out.write(f'<file path="{entry["path"]}" tokens="{entry["tokens"]}">\n{content}')
+        out.write("</file>\n" if content.endswith("\n") else "\n</file>\n")
+
+
+def write_ndjson_record(out, kind: str, record) -> None:
+    """Write one NDJSON line: {"type": kind, ...record} (non-dict records go under "data")."""
+    if isinstance(record, dict):
+        line = {"type": kind, **record}
+    else:
+        line = {"type": kind, "data": record}
+    out.write(json.dumps(line, separators=(",", ":")) + "\n")
+
+
+def result_records(result: dict) -> Iterator[tuple[str, dict]]:
+    """Replay a collected scan result as iter_scan-style records."""
+    for path in result["directories"]:
+        yield "directory", {"path": path}
+    for record in result["files"]:
+        yield "file", record
+    for record in result["skipped"]:
+        yield "skip", record
+    yield "totals", {
+        key: value for key, value in result.items()
+        if key not in ("files", "directories", "skipped")
+    }
+
+
+def tee_files(records: Iterator[tuple[str, dict]], sink: list) -> Iterator[tuple[str, dict]]:
+    """Pass records through, keeping the path and tokens of each file record in sink."""
+    for kind, record in records:
+        if kind == "file":
+            sink.append({"path": record["path"], "tokens": record["tokens"]})
+        yield kind, record
+
+
+def write_ndjson(records: Iterator[tuple[str, dict]], out) -> dict:
+    """Stream iter_scan records as NDJSON as they are produced; return the totals record."""
+    totals: dict = {}
+    for kind, record in records:
+        if kind == "totals":
+            totals = record
+        else:
+            write_ndjson_record(out, kind, record)
+    out.flush()
+    return totals
+
+
+class DirectoryIndex:
+    """Directory tree rollup built from scan records as they stream past.
+
+    Each node holds its child directories and the (name, tokens) of the
+    files directly in it, never the records themselves; finish() then rolls
+    files, tokens, bytes and per-language counts up to every ancestor in one
+    bottom-up pass. Formatters and directory queries
+    (--depth, --top-dirs) read the nodes, costing O(directories) rather than
+    re-splitting every file path at every depth.
+
+    Only files handed to agents ("file" records) are counted, as in the
+    file list; oversized and skipped files are not.
+    """
+
+    def __init__(self):
+        self.nodes: dict[str, dict] = {"": self._new_node("")}
+        self.measured = True
+
+    @staticmethod
+    def _new_node(path: str) -> dict:
+        return {
+            "path": path, "files": 0, "tokens": 0, "bytes": 0,
+            "lang_tokens": {}, "lang_files": {}, "dirs": [], "entries": [],
+        }
+
+    def node(self, rel_dir: str) -> dict:
+        """The node for rel_dir, creating it and any missing ancestors."""
+        node = self.nodes.get(rel_dir)
+        if node is None:
+            parent = self.node(rel_dir.rpartition("/")[0])
+            node = self.nodes[rel_dir] = self._new_node(rel_dir)
+            parent["dirs"].append(rel_dir)
+        return node
+
+    def add(self, record: dict) -> None:
+        """Count one file record in its own directory (finish() rolls it up)."""
+        rel_dir, _, name = record["path"].rpartition("/")
+        node = self.node(rel_dir)
+        tokens = record.get("tokens")
+        node["entries"].append((name, tokens))
+        if tokens is None:
+            self.measured = False
+            tokens = 0
+        node["files"] += 1
+        node["tokens"] += tokens
+        node["bytes"] += record.get("size_bytes", 0)
+        lang = EXT_TO_LANG.get(os.path.splitext(name)[1].lower())
+        if lang:
+            node["lang_tokens"][lang] = node["lang_tokens"].get(lang, 0) + tokens
+            node["lang_files"][lang] = node["lang_files"].get(lang, 0) + 1
+
+    def track(self, records: Iterator[tuple[str, dict]]) -> Iterator[tuple[str, dict]]:
+        """Pass scan records through, indexing directories and files; finish() at the end."""
+        for kind, record in records:
+            if kind == "file":
+                self.add(record)
+            elif kind == "directory":
+                self.node(record["path"])
+            yield kind, record
+        self.finish()
+
+    def finish(self) -> None:
+        """Roll every node's counts up into its ancestors, deepest first."""
+        for path in sorted(self.nodes, key=lambda p: p.count("/"), reverse=True):
+            if not path:
+                continue
+            node = self.nodes[path]
+            parent = self.nodes[path.rpartition("/")[0]]
+            for key in ("files", "tokens", "bytes"):
+                parent[key] += node[key]
+            for key in ("lang_tokens", "lang_files"):
+                for lang, count in node[key].items():
+                    parent[key][lang] = parent[key].get(lang, 0) + count
+
+    @classmethod
+    def from_result(cls, result: dict) -> "DirectoryIndex":
+        """Index a collected scan result (for callers that did not track the scan)."""
+        index = cls()
+        for path in result["directories"]:
+            index.node(path)
+        for record in result["files"]:
+            index.add(record)
+        index.finish()
+        return index
+
+    def directories(self, depth: int | None = None) -> list[dict]:
+        """Nodes holding files, at most `depth` levels deep, in path order."""
+        return [
+            self.nodes[path] for path in sorted(self.nodes)
+            if path and self.nodes[path]["files"] and (depth is None or path.count("/") < depth)
+        ]
+
+    def top(self, k: int, depth: int | None = None) -> list[dict]:
+        """Directory records of the k largest directories (by tokens, or bytes when unmeasured)."""
+        measure = "tokens" if self.measured else "bytes"
+        nodes = sorted(self.directories(depth), key=lambda n: (-n[measure], n["path"]))[:k]
+        return [self.record(node) for node in nodes]
+
+    def record(self, node: dict) -> dict:
+        """A node as an output record with its language mix."""
+        return {
+            "path": node["path"],
+            "files": node["files"],
+            "tokens": node["tokens"] if self.measured else None,
+            "size_bytes": node["bytes"],
+            "language_distribution": {
+                "by_tokens": dict(sorted(node["lang_tokens"].items(), key=lambda x: x[1], reverse=True))
+                if self.measured else {},
+                "by_files": dict(sorted(node["lang_files"].items(), key=lambda x: x[1], reverse=True)),
+            },
+        }
+
+
+JS_RESOLVE_SUFFIXES = (".ts", ".tsx", ".d.ts", ".js", ".jsx", ".mjs", ".cjs", ".mts", ".cts", ".vue", ".svelte")
+PAGERANK_DAMPING = 0.85
+
+
+class ImportGraph:
+    """File-level import graph, resolved once the scan has listed every file.
+
+    track() takes the raw specifiers (see import_specs) off scan records as
+    they stream past; finish() resolves them against the scanned files:
+
+    - Python: relative modules from the importing file's package, absolute
+      ones from its own directory, the root, src/ and lib/ and every
+      directory holding a pyproject.toml or setup.py (and its src/);
+      `from m import n` links m/n.py when n is a submodule, else m.
+    - JS/TS: relative specifiers, trying the usual extensions and index
+      files (a "./x.js" import may be x.ts).
+    - Go: imports under the root go.mod's module path, linked to every
+      non-test .go file of the package directory.
+    - Rust: `mod x;` and crate::/self::/super:: paths, linked to the longest
+      prefix that is a module file; the crate root is the src/ next to the
+      nearest Cargo.toml.
+
+    Anything else (standard library, third-party packages) is external and
+    dropped. Centrality is in-degree plus PageRank over the resolved edges.
+    """
+
+    def __init__(self):
+        self.specs: dict[str, list[str]] = {}
+        self.paths: set[str] = set()
+        self.go_module: str | None = None
+        self.go_packages: dict[str, list[str]] = {}
+        self.python_roots: list[str] = [""]
+
+    def track(self, records: Iterator[tuple[str, dict]]) -> Iterator[tuple[str, dict]]:
+        """Pass scan records through, taking their "imports" off."""
+        for kind, record in records:
+            if kind == "file" or (kind == "skip" and record.get("tokens") is not None):
+                self.paths.add(record["path"])
+                if "imports" in record:
+                    self.specs[record["path"]] = record.pop("imports")
+            yield kind, record
+
+    def finish(self, go_module: str | None = None) -> dict:
+        """Resolve every specifier and rank the files: {"files", "edges", "centrality"}."""
+        self.go_module = go_module
+        for path in sorted(self.paths):
+            if path.endswith(".go") and not path.endswith("_test.go"):
+                self.go_packages.setdefault(path.rpartition("/")[0], []).append(path)
+        self.python_roots = [""] + sorted({
+            root
+            for path in self.paths
+            for root in self._python_roots(path)
+        })
+
+        out: dict[str, list[str]] = {}
+        for path, specs in self.specs.items():
+            targets: dict[str, None] = {}
+            for spec in specs:
+                for target in self.resolve(path, spec):
+                    if target != path:
+                        targets[target] = None
+            out[path] = list(targets)
+        edges = sorted((src, dst) for src, targets in out.items() for dst in targets)
+        nodes = sorted(set(out) | {dst for _, dst in edges})
+        in_degree = dict.fromkeys(nodes, 0)
+        for _, dst in edges:
+            in_degree[dst] += 1
+        rank = pagerank(nodes, out)
+        centrality = [
+            {
+                "path": path,
+                "in_degree": in_degree[path],
+                "out_degree": len(out.get(path, ())),
+                "pagerank": round(rank[path], 6),
+            }
+            for path in sorted(nodes, key=lambda p: (-rank[p], -in_degree[p], p))
+        ]
+        return {"files": len(nodes), "edges": [list(edge) for edge in edges], "centrality": centrality}
+
+    @staticmethod
+    def _python_roots(path: str) -> list[str]:
+        head, _, name = path.rpartition("/")
+        if name in ("pyproject.toml", "setup.py"):
+            return [head, f"{head}/src"] if head else ["src"]
+        top, sep, _ = path.partition("/")
+        return [top] if sep and top in ("src", "lib") else []
+
+    def resolve(self, path: str, spec: str) -> list[str]:
+        """Repo files a specifier of the file at path refers to ([] when external)."""
+        lang = EXT_TO_LANG.get(os.path.splitext(path)[1].lower())
+        if lang == "python":
+            found = self._resolve_python(path, spec)
+        elif lang in ("javascript", "typescript"):
+            found = self._resolve_js(path, spec)
+        elif lang == "go":
+            return self._resolve_go(spec)
+        elif lang == "rust":
+            found = self._resolve_rust(path, spec)
+        else:
+            found = None
+        return [found] if found else []
+
+    def _module_file(self, base: str, parts: list[str]) -> str | None:
+        stem = "/".join([base, *parts] if base else parts)
+        for candidate in (stem + ".py", stem + "/__init__.py", stem + ".pyi"):
+            if candidate in self.paths:
+                return candidate
+        return None
+
+    def _resolve_python(self, path: str, spec: str) -> str | None:
+        module, _, name = spec.partition(":")
+        level = len(module) - len(module.lstrip("."))
+        parts = [p for p in module.lstrip(".").split(".") if p]
+        if level:
+            base = path.rpartition("/")[0]
+            for _ in range(level - 1):
+                base = base.rpartition("/")[0]
+            bases = [base]
+        else:
+            bases = [path.rpartition("/")[0], *self.python_roots]
+        for base in bases:
+            if name:
+                found = self._module_file(base, parts + [name])
+                if found:
+                    return found
+            if parts:
+                found = self._module_file(base, parts)
+                if found:
+                    return found
+        return None
+
+    def _resolve_js(self, path: str, spec: str) -> str | None:
+        import posixpath
+
+        target = posixpath.normpath(posixpath.join(path.rpartition("/")[0], spec.split("?")[0]))
+        if target.startswith(".."):
+            return None
+        stems = [target]
+        stem, ext = posixpath.splitext(target)
+        if ext in (".js", ".jsx", ".mjs", ".cjs"):
+            stems.append(stem)
+        for stem in stems:
+            candidates = [stem, *(stem + s for s in JS_RESOLVE_SUFFIXES)]
+            candidates.extend(f"{stem}/index{s}" for s in JS_RESOLVE_SUFFIXES)
+            for candidate in candidates:
+                if candidate in self.paths:
+                    return candidate
+        return None
+
+    def _resolve_go(self, spec: str) -> list[str]:
+        module = self.go_module
+        if not module or not (spec == module or spec.startswith(module + "/")):
+            return []
+        return self.go_packages.get(spec[len(module) + 1:], [])
+
+    def _rust_module_file(self, base: str) -> str | None:
+        prefix = base + "/" if base else ""
+        for candidate in (base + ".rs", prefix + "mod.rs", prefix + "lib.rs", prefix + "main.rs"):
+            if candidate in self.paths:
+                return candidate
+        return None
+
+    def _resolve_rust(self, path: str, spec: str) -> str | None:
+        head, _, name = path.rpartition("/")
+        # Directory of the file's own submodules
+        mod_dir = head if name in ("lib.rs", "main.rs", "mod.rs") else path[:-3]
+        if spec.startswith("mod:"):
+            return self._rust_module_file(f"{mod_dir}/{spec[4:]}" if mod_dir else spec[4:])
+        parts = [p for p in spec.split("::") if p and p != "*"]
+        if parts[0] == "crate":
+            base = self._rust_crate_src(path)
+            parts = parts[1:]
+        else:
+            base = mod_dir
+            while parts and parts[0] in ("self", "super"):
+                if parts.pop(0) == "super":
+                    base = base.rpartition("/")[0]
+        for k in range(len(parts), 0, -1):
+            found = self._rust_module_file("/".join([base, *parts[:k]] if base else parts[:k]))
+            if found and found != path:
+                return found
+        return self._rust_module_file(base)
+
+    def _rust_crate_src(self, path: str) -> str:
+        parts = path.split("/")[:-1]
+        for i in range(len(parts), -1, -1):
+            prefix = "/".join(parts[:i])
+            if (prefix + "/Cargo.toml" if prefix else "Cargo.toml") in self.paths:
+                return prefix + "/src" if prefix else "src"
+        return "/".join(parts[:parts.index("src") + 1]) if "src" in parts else "/".join(parts)
+
+
+def pagerank(nodes: list[str], out: dict[str, list[str]], iterations: int = 100) -> dict[str, float]:
+    """PageRank of a directed graph by power iteration (dangling nodes spread their rank evenly)."""
+    n = len(nodes)
+    if not n:
+        return {}
+    rank = dict.fromkeys(nodes, 1.0 / n)
+    for _ in range(iterations):
+        dangling = sum(rank[u] for u in nodes if not out.get(u))
+        base = (1 - PAGERANK_DAMPING) / n + PAGERANK_DAMPING * dangling / n
+        new = dict.fromkeys(nodes, base)
+        for u, targets in out.items():
+            if targets:
+                share = PAGERANK_DAMPING * rank[u] / len(targets)
+                for v in targets:
+                    new[v] += share
+        delta = sum(abs(new[u] - rank[u]) for u in nodes)
+        rank = new
+        if delta < 1e-9:
+            break
+    return rank
+
+
+def format_tree(
+    scan_result: dict, show_tokens: bool = True, index: DirectoryIndex | None = None, depth: int | None = None
+) -> str:
+    """Format scan results as a tree structure (directories below `depth` are collapsed)."""
+    lines = []
+    root_name = Path(scan_result["root"]).name
+    lines.append(f"{root_name}/")
+    if scan_result["total_tokens"] is None:
+        show_tokens = False
+        lines.append(f"Total: {scan_result['total_files']} files")
+    else:
+        lines.append(f"Total: {scan_result['total_files']} files, {scan_result['total_tokens']:,} tokens")
+    lines.append("")
+
+    index = index or DirectoryIndex.from_result(scan_result)
+
+    def print_tree(node: dict, prefix: str = "", level: int = 1):
+        dirs = [index.nodes[d] for d in node["dirs"] if index.nodes[d]["files"]]
+        items = [(d["path"].rpartition("/")[2], d) for d in sorted(dirs, key=lambda d: d["path"].lower())]
+        items += sorted(node["entries"], key=lambda x: x[0].lower())
+
+        for i, (name, value) in enumerate(items):
+            is_last_item = i == len(items) - 1
+            connector = "\u2514\u2500\u2500 " if is_last_item else "\u251c\u2500\u2500 "
+
+            if isinstance(value, dict):
+                if depth is not None and level >= depth:
+                    size = f"{value['tokens']:,} tokens" if show_tokens else f"{value['bytes']:,} bytes"
+                    lines.append(f"{prefix}{connector}{name}/ ({value['files']} files, {size})")
+                    continue
+                lines.append(f"{prefix}{connector}{name}/")
+                extension = "    " if is_last_item else "\u2502   "
+                print_tree(value, prefix + extension, level + 1)
+            else:
+                if show_tokens:
+                    lines.append(f"{prefix}{connector}{name} ({value or 0:,} tokens)")
+                else:
+                    lines.append(f"{prefix}{connector}{name}")
+
+    print_tree(index.nodes[""])
+    return "\n".join(lines)
+
+
+def format_summary(result: dict, index: DirectoryIndex | None = None, depth: int = 3) -> str:
+    """Format scan results as a concise summary for LLM consumption."""
+    lines = []
+    root_name = Path(result["root"]).name
+    meta = result.get("package_metadata", {})
+    tech = result.get("tech_stack", {})
+    features = result.get("project_features", {})
+
+    # Header
+    lines.append(f"# {meta.get('name') or root_name}")
+    estimate = result.get("estimate")
+    if estimate:
+        lines.append(
+            f"Total: {result['total_files']} files, ~{result['total_tokens']:,} tokens "
+            f"(estimated; 95% CI {estimate['total_tokens_low']:,}\u2013{estimate['total_tokens_high']:,})"
+        )
+    elif result["total_tokens"] is None:
+        lines.append(f"Total: {result['total_files']} files (token counts skipped)")
+    else:
+        lines.append(f"Total: {result['total_files']} files, {result['total_tokens']:,} tokens")
+    by_encoding = result.get("total_tokens_by_encoding")
+    if by_encoding:
+        lines.append("Tokens by encoding: " + ", ".join(f"{name} {n:,}" for name, n in by_encoding.items()))
+    if result.get("oversized_tokens"):
+        lines.append(
+            f"Includes {result['oversized_tokens']:,} tokens in {result['oversized_files']} oversized "
+            f"files (measured, not sent to agents)"
+        )
+    lines.append("")
+
+    if estimate:
+        lines.append("## Token Estimate")
+        lines.append(f"- Mode: {estimate['mode']}")
+        lines.append(
+            f"- Tokenized: {estimate['sampled_files']} sampled files; "
+            f"{estimate['estimated_files']} files estimated from size"
+        )
+        for threshold in estimate["ambiguous_thresholds"]:
+            lines.append(f"- WARNING: {threshold:,}-token threshold lies inside the interval; run without --estimate")
+        lines.append("")
+
+    delta = result.get("delta")
+    if delta:
+        lines.append(f"## Changes since {delta['since']}")
+        lines.append(
+            f"- {delta['added']} added, {delta['modified']} modified, {delta['renamed']} renamed, "
+            f"{delta['removed']} removed ({delta['rescanned']} files rescanned)"
+        )
+        lines.append(
+            f"- Tokens: {delta['total_tokens_before']:,} \u2192 {delta['total_tokens_after']:,} "
+            f"({delta['total_delta']:+,})"
+        )
+        for f in sorted(delta["files"], key=lambda x: abs(x["delta"]), reverse=True)[:20]:
+            renamed = f" (from {f['from']})" if "from" in f else ""
+            lines.append(f"  {f['delta']:>+8,}  {f['path']} [{f['status']}]{renamed}")
+        lines.append("")
+
+    # Package metadata
+    lines.append("## Metadata")
+    if meta.get("version"):
+        lines.append(f"- Version: {meta['version']}")
+    if meta.get("license"):
+        lines.append(f"- License: {meta['license']}")
+    if meta.get("description"):
+        lines.append(f"- Description: {meta['description']}")
+    lines.append(f"- Dependencies: {meta.get('dependencies_count', 0)}")
+    lines.append("")
+
+    # Tech stack
+    lines.append("## Tech Stack")
+    if tech.get("languages_detected"):
+        lines.append(f"- Languages: {', '.join(tech['languages_detected'])}")
+    if tech.get("frameworks"):
+        lines.append(f"- Frameworks: {', '.join(tech['frameworks'])}")
+    if tech.get("package_manager"):
+        lines.append(f"- Package Manager: {tech['package_manager']}")
+    lines.append("")
+
+    # Language distribution (top 5)
+    by = "by_tokens" if result["total_tokens"] is not None else "by_files"
+    lang_dist = result.get("language_distribution", {}).get(by, {})
+    lang_encodings = result.get("language_distribution", {}).get("tokens_by_encoding", {})
+    if lang_dist:
+        lines.append("## Language Distribution")
+        total = sum(lang_dist.values()) or 1
+        for i, (lang, count) in enumerate(lang_dist.items()):
+            if i >= 5:
+                break
+            pct = count * 100 / total
+            if lang in lang_encodings:
+                counts = ", ".join(f"{name} {n:,}" for name, n in lang_encodings[lang].items())
+                lines.append(f"- {lang}: {pct:.1f}% ({counts} tokens)")
+            else:
+                lines.append(f"- {lang}: {pct:.1f}% ({count:,} {by[3:]})")
+        lines.append("")
+
+    # Entry points
+    entries = result.get("entry_points", [])
+    if entries:
+        lines.append("## Entry Points")
+        for e in entries:
+            name = e.get("name", "")
+            label = f" ({name})" if name else ""
+            lines.append(f"- [{e['type']}] {e['path']}{label}")
+        lines.append("")
+
+    # Project features
+    lines.append("## Features")
+    if features.get("has_ci"):
+        lines.append(f"- CI: {features['has_ci']}")
+    lines.append(f"- Tests: {'Yes' if features.get('has_tests') else 'No'}")
+    lines.append(f"- Docker: {'Yes' if features.get('has_dockerfile') else 'No'}")
+    if features.get("has_docker_compose"):
+        lines.append("- Docker Compose: Yes")
+    if features.get("has_codebase_map"):
+        lines.append("- Codebase Map: Yes")
+    lines.append("")
+
+    # Detected conditional sections
+    detected = result.get("detected_sections", [])
+    if detected:
+        lines.append("## Detected Sections")
+        for s in detected:
+            lines.append(f"- {s}")
+        lines.append("")
+
+    # Workspaces
+    workspaces = result.get("workspaces", [])
+    if workspaces:
+        lines.append("## Workspaces")
+        for ws in workspaces:
+            if ws.get("tokens") is not None:
+                size = f" \u2014 {ws['files']} files, {ws['tokens']:,} tokens"
+            else:
+                size = f" \u2014 {ws['files']} files" if "files" in ws else ""
+            lines.append(f"- {ws['name']} ({ws['path']}) [{ws['package_manager']}]{size}")
+        lines.append("")
+
+    # Agent partition
+    partition = result.get("partition")
+    if partition:
+        lines.append(f"## Agent Partition ({partition['agents']} agents, budget {partition['budget']:,} tokens)")
+        for a in partition["assignments"]:
+            groups = ", ".join(g["path"] for g in a["groups"]) or "-"
+            flag = " (over budget)" if a["over_budget"] else ""
+            lines.append(
+                f"- {a['agent']} [{', '.join(a['roles'])}]: {a['tokens']:,} tokens, "
+                f"{a['files']} files{flag} \u2014 {groups}"
+            )
+        if partition["over_budget"]:
+            lines.append("- WARNING: total exceeds agents \u00d7 budget; add agents or raise --budget")
+        lines.append("")
+
+    # Context pack (--pack), in reading order
+    pack = result.get("pack")
+    if pack:
+        lines.append(
+            f"## Context Pack ({pack['files']} files, {pack['tokens']:,} of {pack['budget']:,} tokens)"
+        )
+        for p in pack["paths"]:
+            lines.append(f"  {p['tokens']:>8}  {p['path']} ({p['kind']})")
+        lines.append("")
+
+    # Top 20 largest files (by size when token counts were skipped)
+    measure, unit = ("tokens", "tokens") if result["total_tokens"] is not None else ("size_bytes", "bytes")
+    files_sorted = sorted(result["files"], key=lambda x: x[measure], reverse=True)
+    lines.append(f"## Top 20 Files (by {unit})")
+    if by_encoding:
+        # One column per encoding, the first (primary) one ordering the list
+        widths = [max(8, len(name)) for name in by_encoding]
+        lines.append("  " + "  ".join(f"{name:>{w}}" for name, w in zip(by_encoding, widths)) + "  path")
+        for f in files_sorted[:20]:
+            counts = f["tokens_by_encoding"].values()
+            lines.append("  " + "  ".join(f"{n:>{w}}" for n, w in zip(counts, widths)) + f"  {f['path']}")
+    else:
+        for f in files_sorted[:20]:
+            lines.append(f"  {f[measure]:>8}  {f['path']}")
+    lines.append("")
+
+    # Largest symbols (--symbols)
+    symbols = [(s, f["path"]) for f in result["files"] + result["skipped"] for s in f.get("symbols", ())]
+    if symbols:
+        symbols.sort(key=lambda x: x[0]["tokens"], reverse=True)
+        lines.append(f"## Top {min(20, len(symbols))} Symbols (by tokens)")
+        for s, path in symbols[:20]:
+            start, end = s["lines"]
+            lines.append(f"  {s['tokens']:>8}  {path}:{s['name']} ({s['kind']}, L{start}-{end})")
+        lines.append("")
+
+    # Import graph (--imports): the most central files
+    graph = result.get("import_graph")
+    if graph:
+        lines.append(f"## Import Graph ({graph['files']} files, {len(graph['edges'])} edges)")
+        if graph["centrality"]:
+            lines.append(f"  {'in':>4}  {'pagerank':>8}  path")
+        for c in graph["centrality"][:15]:
+            lines.append(f"  {c['in_degree']:>4}  {c['pagerank']:>8.4f}  {c['path']}")
+        lines.append("")
+
+    # Top directories (--top-dirs)
+    top_dirs = result.get("top_directories")
+    if top_dirs:
+        lines.append(f"## Top {len(top_dirs)} Directories (by {unit})")
+        for d in top_dirs:
+            by = "by_tokens" if d["tokens"] is not None else "by_files"
+            total = sum(d["language_distribution"][by].values()) or 1
+            mix = ", ".join(
+                f"{lang} {count * 100 / total:.0f}%"
+                for lang, count in list(d["language_distribution"][by].items())[:3]
+            )
+            size = f"{d['tokens']:,} tokens" if d["tokens"] is not None else f"{d['size_bytes']:,} bytes"
+            lines.append(f"- {d['path']}/ \u2014 {size}, {d['files']} files" + (f" ({mix})" if mix else ""))
+        lines.append("")
+
+    # Directory structure (only directories, not individual files at root)
+    lines.append(f"## Directory Structure (depth {depth})")
+    index = index or DirectoryIndex.from_result(result)
+    node_measure = "tokens" if measure == "tokens" else "bytes"
+    for node in index.directories(depth):
+        indent = "  " * node["path"].count("/")
+        lines.append(f"{indent}{node['path']}/ ({node[node_measure]:,} {unit})")
+    lines.append("")
+
+    return "\n".join(lines)
+
+
+class LiveScanCache(ScanCache):
+    """ScanCache for long-lived scans: save() rolls over in memory, flush() writes to disk."""
+
+    def save(self) -> None:
+        self.entries, self.seen = self.seen, {}
+
+    def flush(self) -> None:
+        self.seen = self.entries
+        ScanCache.save(self)
+        self.seen = {}
+
+
+class InotifyWatcher:
+    """Directory watches through inotify(7), called via ctypes (Linux only)."""
+
+    kind = "inotify"
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    MASK = (
+        IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+        | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+    )
+    EVENT_HEADER = 16  # struct inotify_event: int wd; uint32 mask, cookie, len
+
+    def __init__(self):
+        import ctypes
+
+        self._ctypes = ctypes
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1: {os.strerror(errno)}")
+        self.paths: dict[int, str] = {}
+        self.watches: dict[str, int] = {}
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def add(self, abs_dir: str) -> None:
+        """Watch a directory (no-op if already watched); raises OSError, e.g. ENOSPC."""
+        if abs_dir in self.watches:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(abs_dir), self.MASK)
+        if wd < 0:
+            errno = self._ctypes.get_errno()
+            if errno in (2, 20):  # ENOENT / ENOTDIR: gone before we got to it
+                return
+            raise OSError(errno, f"inotify_add_watch {abs_dir}: {os.strerror(errno)}")
+        self.paths[wd] = abs_dir
+        self.watches[abs_dir] = wd
+
+    def read(self) -> list[tuple[str | None, str, int]]:
+        """Drain pending events as (directory, name, mask); directory None means overflow."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + self.EVENT_HEADER <= len(data):
+                wd, mask, _, length = (
+                    int.from_bytes(data[offset:offset + 4], sys.byteorder, signed=True),
+                    int.from_bytes(data[offset + 4:offset + 8], sys.byteorder),
+                    int.from_bytes(data[offset + 8:offset + 12], sys.byteorder),
+                    int.from_bytes(data[offset + 12:offset + 16], sys.byteorder),
+                )
+                raw = data[offset + self.EVENT_HEADER:offset + self.EVENT_HEADER + length]
+                offset += self.EVENT_HEADER + length
+                name = os.fsdecode(raw.rstrip(b"\0"))
+                if mask & self.IN_Q_OVERFLOW:
+                    events.append((None, "", mask))
+                    continue
+                path = self.paths.get(wd)
+                if mask & self.IN_MOVE_SELF and path is not None:
+                    # The watch follows the inode; drop it so the new path is watched on refresh
+                    self.libc.inotify_rm_watch(self.fd, wd)
+                    self.paths.pop(wd, None)
+                    self.watches.pop(path, None)
+                if mask & self.IN_IGNORED:
+                    self.paths.pop(wd, None)
+                    if path and self.watches.get(path) == wd:
+                        del self.watches[path]
+                    continue
+                if path is not None:
+                    events.append((path, name, mask))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollWatcher:
+    """Fallback watcher: reports every root as changed each `interval` seconds.
+
+    A rescan after a poll only stats files (unchanged ones hit the scan cache).
+    """
+
+    kind = "poll"
+
+    def __init__(self, interval: float = 2.0):
+        self.interval = interval
+        self.watches: dict[str, int] = {}
+
+    def fileno(self) -> None:
+        return None
+
+    def add(self, abs_dir: str) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class LiveScan:
+    """In-memory scan of one root, refreshed incrementally from watcher events.
+
+    Directory listings are kept between refreshes and dropped only for the
+    directories an event touched; file results come from a LiveScanCache. A
+    refresh therefore re-lists changed directories and re-tokenizes changed
+    files, and the collected result is reused until the next change.
+    """
+
+    def __init__(self, root: Path, encoding: tiktoken.Encoding | list[tiktoken.Encoding], max_file_tokens: int,
+                 jobs: int, cache: LiveScanCache, store: TokenStore | None = None):
+        self.root = root
+        self.encoding = encoding
+        self.max_file_tokens = max_file_tokens
+        self.jobs = jobs
+        self.cache = cache
+        self.store = store
+        self.listings: dict[str, list[os.DirEntry]] = {}
+        self.result: dict | None = None
+        self.index: DirectoryIndex | None = None
+        self.dirty = True
+        self.refreshes = 0
+        self.files_rescanned = 0
+        self.last_refresh_ms = 0.0
+
+    def invalidate(self, abs_dir: str | None = None, name: str = "", is_dir: bool = False) -> None:
+        """Forget the listing of abs_dir (and the subtree of a changed child directory); None means all."""
+        self.dirty = True
+        if abs_dir is None:
+            self.listings.clear()
+            return
+        self.listings.pop(abs_dir, None)
+        if is_dir and name:
+            child = os.path.join(abs_dir, name)
+            prefix = child + os.sep
+            for path in [p for p in self.listings if p == child or p.startswith(prefix)]:
+                del self.listings[path]
+
+    def refresh(self) -> dict:
+        """Bring the result up to date (no-op when nothing changed) and return it."""
+        if not self.dirty and self.result is not None:
+            return self.result
+        started = time.perf_counter()
+        misses = self.cache.misses
+        self.dirty = False
+        manifests = ProjectManifests(self.root)
+        index = DirectoryIndex()
+        result = collect_scan(index.track(iter_scan(
+            self.root, self.encoding, self.max_file_tokens, self.cache, self.jobs,
+            store=self.store, workspaces=WorkspaceRollup(manifests), listings=self.listings,
+        )))
+        result.update(detect_project_profile(self.root, manifests, result.pop("workspaces", None)))
+        result.pop("cache", None)
+        result.pop("token_store", None)
+        self.result = result
+        self.index = index
+        self.refreshes += 1
+        self.files_rescanned += self.cache.misses - misses
+        self.last_refresh_ms = (time.perf_counter() - started) * 1000
+        return result
+
+
+class RpcError(Exception):
+    """JSON-RPC error with a code (see ScanServer.handle)."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class ScanServer:
+    """Answers JSON-RPC 2.0 queries against live scans of one or more roots.
+
+    Methods: summary, tree (params: root, depth), json (root), top_dirs (root,
+    k, depth), partition (root, agents, budget), refresh (root), roots, stats
+    and shutdown. `root` defaults to the
+    first root; results are refreshed lazily when a watcher reported changes.
+    """
+
+    def __init__(self, scans: list[LiveScan], watcher, poll_interval: float = 2.0):
+        self.scans = {str(scan.root): scan for scan in scans}
+        self.order = [str(scan.root) for scan in scans]
+        self.watcher = watcher
+        self.poll_interval = poll_interval
+        self.running = True
+        self.started = time.time()
+        self.events = 0
+        self.last_event = 0.0
+        self.queries = 0
+        self.query_ms_total = 0.0
+        self.query_ms_max = 0.0
+        self.query_ms_last = 0.0
+
+    def scan_for(self, params: dict) -> LiveScan:
+        root = params.get("root")
+        if root is None:
+            return self.scans[self.order[0]]
+        scan = self.scans.get(str(Path(root).resolve()))
+        if scan is None:
+            raise RpcError(-32602, f"Unknown root: {root}")
+        return scan
+
+    def on_events(self, events: list[tuple[str | None, str, int]]) -> None:
+        """Route watcher events to the scans whose tree they fall in."""
+        for abs_dir, name, mask in events:
+            self.events += 1
+            is_dir = bool(mask & InotifyWatcher.IN_ISDIR)
+            for root, scan in self.scans.items():
+                if abs_dir is None:
+                    scan.invalidate()
+                elif abs_dir == root or abs_dir.startswith(root + os.sep):
+                    scan.invalidate(abs_dir, name, is_dir)
+        self.last_event = time.monotonic()
+
+    def on_poll(self) -> None:
+        self.events += 1
+        for scan in self.scans.values():
+            scan.invalidate()
+        self.last_event = time.monotonic()
+
+    def refresh(self, scan: LiveScan) -> dict:
+        """Refresh a scan and watch any directories it newly reached."""
+        changed = scan.dirty or scan.result is None
+        result = scan.refresh()
+        if changed and self.watcher.kind == "inotify":
+            try:
+                self.watcher.add(str(scan.root))
+                for rel_dir in result["directories"]:
+                    self.watcher.add(str(scan.root / rel_dir))
+            except OSError as e:
+                # Typically ENOSPC (fs.inotify.max_user_watches)
+                print(f"WARNING: {e}; polling every {self.poll_interval}s instead", file=sys.stderr)
+                self.watcher.close()
+                self.watcher = PollWatcher(self.poll_interval)
+        return result
+
+    def refresh_idle(self) -> None:
+        for scan in self.scans.values():
+            if scan.dirty:
+                self.refresh(scan)
+
+    def stats(self) -> dict:
+        return {
+            "watcher": self.watcher.kind,
+            "watches": len(self.watcher.watches),
+            "uptime_s": round(time.time() - self.started, 1),
+            "events_processed": self.events,
+            "queries": self.queries,
+            "query_ms": {
+                "last": round(self.query_ms_last, 3),
+                "max": round(self.query_ms_max, 3),
+                "mean": round(self.query_ms_total / self.queries, 3) if self.queries else 0.0,
+            },
+            "roots": {
+                root: {
+                    "refreshes": scan.refreshes,
+                    "files_rescanned": scan.files_rescanned,
+                    "last_refresh_ms": round(scan.last_refresh_ms, 3),
+                    "dirty": scan.dirty,
+                    "total_files": scan.result["total_files"] if scan.result else None,
+                    "total_tokens": scan.result["total_tokens"] if scan.result else None,
+                }
+                for root, scan in self.scans.items()
+            },
+        }
+
+    def dispatch(self, method: str, params: dict):
+        if method == "roots":
+            return self.order
+        if method == "stats":
+            return self.stats()
+        if method == "shutdown":
+            self.running = False
+            return True
+        scan = self.scan_for(params)
+        if method == "refresh":
+            scan.invalidate()
+        result = self.refresh(scan)
+        if method in ("json", "refresh"):
+            return result
+        depth = params.get("depth")
+        if depth is not None and (not isinstance(depth, int) or depth < 1):
+            raise RpcError(-32602, "depth must be a positive integer")
+        if method == "summary":
+            return {"text": format_summary(result, scan.index, depth or 3)}
+        if method == "tree":
+            return {"text": format_tree(result, show_tokens=True, index=scan.index, depth=depth)}
+        if method == "top_dirs":
+            k = params.get("k", 10)
+            if not isinstance(k, int) or k < 1:
+                raise RpcError(-32602, "k must be a positive integer")
+            return scan.index.top(k, depth)
+        if method == "partition":
+            agents = params.get("agents", 3)
+            budget = params.get("budget", DEFAULT_AGENT_BUDGET)
+            if not isinstance(agents, int) or not isinstance(budget, int) or agents < 1 or budget < 1:
+                raise RpcError(-32602, "agents and budget must be positive integers")
+            return plan_partition(result["files"], result["workspaces"], agents, budget)
+        raise RpcError(-32601, f"Method not found: {method}")
+
+    def handle(self, request) -> dict | None:
+        """Answer one decoded JSON-RPC request (None for notifications)."""
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            return {"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "Invalid Request"}}
+        params = request.get("params") or {}
+        started = time.perf_counter()
+        try:
+            if not isinstance(params, dict):
+                raise RpcError(-32602, "params must be an object")
+            response = {"result": self.dispatch(request["method"], params)}
+        except RpcError as e:
+            response = {"error": {"code": e.code, "message": str(e)}}
+        except Exception as e:
+            response = {"error": {"code": -32603, "message": f"{type(e).__name__}: {e}"}}
+        elapsed = (time.perf_counter() - started) * 1000
+        self.queries += 1
+        self.query_ms_total += elapsed
+        self.query_ms_last = elapsed
+        self.query_ms_max = max(self.query_ms_max, elapsed)
+        if "id" not in request:
+            return None
+        return {"jsonrpc": "2.0", "id": request["id"], **response}
+
+    def handle_line(self, line: bytes) -> bytes | None:
+        try:
+            request = json.loads(line)
+        except ValueError:
+            response = {"jsonrpc": "2.0", "id": None, "error": {"code": -32700, "message": "Parse error"}}
+        else:
+            response = self.handle(request)
+        if response is None:
+            return None
+        return (json.dumps(response, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def run_server(server: ScanServer, socket_path: Path | None = None, debounce: float = 0.2) -> None:
+    """Event loop: watcher events, then newline-delimited JSON-RPC on stdin or a Unix socket.
+
+    Changes are picked up lazily by queries, or after `debounce` seconds of
+    quiet so the next query finds the result already refreshed.
+    """
+    import selectors
+    import socket
+
+    sel = selectors.DefaultSelector()
+
+    buffers: dict = {}
+    listener = None
+    if socket_path is not None:
+        if socket_path.exists():
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(str(socket_path))
+            except OSError:
+                socket_path.unlink()
+            else:
+                probe.close()
+                raise OSError(f"socket {socket_path} is in use by another server")
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(str(socket_path))
+        listener.listen(16)
+        listener.setblocking(False)
+        sel.register(listener, selectors.EVENT_READ, "accept")
+    else:
+        os.set_blocking(sys.stdin.fileno(), False)
+        sel.register(sys.stdin.fileno(), selectors.EVENT_READ, "stdin")
+        buffers["stdin"] = b""
+
+    watcher = None
+    next_poll = 0.0
+    try:
+        while server.running:
+            if watcher is not server.watcher:
+                # First pass, or inotify ran out of watches and the server fell back to polling
+                if watcher is not None and watcher.fileno() is not None:
+                    sel.unregister(watcher.fileno())
+                watcher = server.watcher
+                if watcher.fileno() is not None:
+                    sel.register(watcher.fileno(), selectors.EVENT_READ, "watch")
+                next_poll = time.monotonic() + getattr(watcher, "interval", 0)
+            now = time.monotonic()
+            timeout = None
+            if watcher.kind == "poll":
+                timeout = max(0.0, next_poll - now)
+            if any(scan.dirty for scan in server.scans.values()):
+                wait = max(0.0, server.last_event + debounce - now)
+                timeout = wait if timeout is None else min(timeout, wait)
+
+            for key, _ in sel.select(timeout):
+                tag = key.data
+                if tag == "watch":
+                    server.on_events(watcher.read())
+                elif tag == "accept":
+                    conn, _ = listener.accept()
+                    conn.setblocking(False)
+                    buffers[conn] = b""
+                    sel.register(conn, selectors.EVENT_READ, conn)
+                else:
+                    try:
+                        chunk = os.read(sys.stdin.fileno(), 65536) if tag == "stdin" else tag.recv(65536)
+                    except (BlockingIOError, InterruptedError):
+                        continue
+                    except OSError:
+                        chunk = b""
+                    if not chunk:
+                        sel.unregister(key.fileobj)
+                        buffers.pop(tag, None)
+                        if tag == "stdin":
+                            server.running = False
+                        else:
+                            tag.close()
+                        continue
+                    buffers[tag] += chunk
+                    *lines, buffers[tag] = buffers[tag].split(b"\n")
+                    for line in lines:
+                        if not line.strip():
+                            continue
+                        reply = server.handle_line(line)
+                        if reply is None:
+                            continue
+                        if tag == "stdin":
+                            sys.stdout.buffer.write(reply)
+                            sys.stdout.buffer.flush()
+                        else:
+                            tag.setblocking(True)
+                            try:
+                                tag.sendall(reply)
+                            except OSError:
+                                pass
+                            tag.setblocking(False)
+
+            now = time.monotonic()
+            if watcher.kind == "poll" and now >= next_poll:
+                server.on_poll()
+                next_poll = now + watcher.interval
+            if now - server.last_event >= debounce:
+                server.refresh_idle()
+    finally:
+        for tag in list(buffers):
+            if tag != "stdin":
+                tag.close()
+        if listener is not None:
+            listener.close()
+            try:
+                socket_path.unlink()
+            except OSError:
+                pass
+        sel.close()
+
+
+def serve_main(argv: list[str]) -> None:
+    """`scan-project.py serve ROOT...`: keep scans hot and answer JSON-RPC queries."""
+    import signal
+
+    parser = argparse.ArgumentParser(
+        prog="scan-project.py serve",
+        description="Keep in-memory scans of one or more roots up to date and answer "
+                    "newline-delimited JSON-RPC 2.0 queries (summary, json, tree, top_dirs, partition, stats)",
+    )
+    parser.add_argument("roots", nargs="*", default=["."], help="Roots to serve (default: current directory)")
+    parser.add_argument(
+        "--socket", type=Path, default=None,
+        help="Listen on this Unix socket instead of stdin/stdout",
+    )
+    parser.add_argument(
+        "--watch", choices=["auto", "inotify", "poll"], default="auto",
+        help="Change detection: inotify, polling, or inotify with polling fallback (default: auto)",
+    )
+    parser.add_argument(
+        "--poll-interval", type=float, default=2.0,
+        help="Seconds between rescans with --watch poll (default: 2.0)",
+    )
+    parser.add_argument(
+        "--debounce", type=float, default=0.2,
+        help="Quiet seconds after a change before refreshing in the background (default: 0.2)",
+    )
+    parser.add_argument("--max-tokens", type=int, default=50000, help="See the scan command (default: 50000)")
+    parser.add_argument(
+        "--encoding", default=None, help="Tiktoken encoding, or several comma-separated (default: cl100k_base)"
+    )
+    parser.add_argument(
+        "--encoding-file", type=Path, action="append", default=None, help="Local .tiktoken BPE file (offline)"
+    )
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="Worker threads (default: available CPUs)")
+    parser.add_argument("--cache-dir", type=Path, default=None, help="Scan cache directory")
+    parser.add_argument("--token-store", type=Path, default=None, help="Token count store path")
+    args = parser.parse_args(argv)
+
+    roots = []
+    for root in args.roots:
+        path = Path(root).resolve()
+        if not path.is_dir():
+            print(f"ERROR: Path is not a directory: {path}", file=sys.stderr)
+            sys.exit(1)
+        roots.append(path)
+
+    encodings = [LazyEncoding(name, file) for name, file in resolve_encoding_args(args.encoding, args.encoding_file)]
+    encoding_names = ",".join(enc.name for enc in encodings)
+    jobs = args.jobs or available_cpu_count()
+    store = open_token_store(args.cache_dir, args.token_store)
+
+    watcher = None
+    if args.watch in ("auto", "inotify"):
+        try:
+            watcher = InotifyWatcher()
+        except (OSError, AttributeError) as e:
+            if args.watch == "inotify":
+                print(f"ERROR: inotify unavailable: {e}", file=sys.stderr)
+                sys.exit(1)
+            print(f"WARNING: inotify unavailable ({e}); polling every {args.poll_interval}s", file=sys.stderr)
+    if watcher is None:
+        watcher = PollWatcher(args.poll_interval)
+
+    scans = [
+        LiveScan(root, encodings, args.max_tokens, jobs, LiveScanCache(root, encoding_names, args.cache_dir), store)
+        for root in roots
+    ]
+    server = ScanServer(scans, watcher, args.poll_interval)
+    for scan in scans:
+        server.refresh(scan)
+    print(
+        f"Serving {len(scans)} root(s) with {server.watcher.kind} watcher"
+        + (f" on {args.socket}" if args.socket else " on stdio"),
+        file=sys.stderr,
+    )
+
+    def stop(signum, frame):
+        server.running = False
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        run_server(server, args.socket, args.debounce)
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        for scan in scans:
+            scan.cache.flush()
+        if store:
+            store.close()
+        server.watcher.close()
+
+
+def repo_size_hint(root: Path, encoding_name: str, cache_dir: Path | None = None) -> int:
+    """Cheap relative size of a root for batch scheduling: the size of its scan
+    cache file from the last run, else of its git index (both grow with the
+    number of files), else 0."""
+    for path in (ScanCache.path_for(root, encoding_name, cache_dir), root / ".git" / "index"):
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            continue
+    return 0
+
+
+def read_roots_file(path: str) -> list[str]:
+    """Roots listed one per line in a file ("-" for stdin); blank lines and # comments are skipped."""
+    try:
+        if path == "-":
+            text = sys.stdin.read()
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+    except OSError as e:
+        print(f"ERROR: Failed to read roots from {path}: {e}", file=sys.stderr)
+        sys.exit(1)
+    return [line.strip() for line in text.splitlines() if line.strip() and not line.lstrip().startswith("#")]
+
+
+def batch_main(argv: list[str]) -> None:
+    """`scan-project.py batch ROOT...`: profile many roots in one process.
+
+    One encoder, token store and worker pool are shared by every root. Roots
+    are started largest first (see repo_size_hint), a few at a time so the
+    pool stays busy while others walk, and one NDJSON "repo" record is written
+    as each finishes; a root that fails gets an error record and the batch
+    goes on. A final "batch" record sums up. Exits 1 if any root failed.
+    """
+    from concurrent.futures import as_completed
+
+    parser = argparse.ArgumentParser(
+        prog="scan-project.py batch",
+        description="Profile many roots in one process with a shared encoder and worker pool, "
+                    "writing one NDJSON record per root as it finishes",
+    )
+    parser.add_argument("roots", nargs="*", help="Roots to profile")
+    parser.add_argument(
+        "--roots-from", default=None, metavar="FILE",
+        help="Read roots from FILE, one per line ('-' for stdin)",
+    )
+    parser.add_argument(
+        "--format", choices=["json", "summary"], default="json",
+        help="Per-root payload: the --format json result, or the summary text (default: json)",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=4, metavar="N",
+        help="Roots scanned at the same time over the shared pool (default: 4)",
+    )
+    parser.add_argument("--max-tokens", type=int, default=50000, help="See the scan command (default: 50000)")
+    parser.add_argument(
+        "--encoding", default=None, help="Tiktoken encoding, or several comma-separated (default: cl100k_base)"
+    )
+    parser.add_argument(
+        "--encoding-file", type=Path, action="append", default=None, help="Local .tiktoken BPE file (offline)"
+    )
+    parser.add_argument("--no-tokens", action="store_true", help="Structure only (see the scan command)")
+    parser.add_argument("--source", choices=["fs", "git"], default="fs", help="See the scan command (default: fs)")
+    parser.add_argument("--untracked", action="store_true", help="With --source git, include untracked files")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="Worker threads (default: available CPUs)")
+    parser.add_argument(
+        "--cache", action=argparse.BooleanOptionalAction, default=True, help="Use the scan cache (default: on)"
+    )
+    parser.add_argument("--cache-dir", type=Path, default=None, help="Scan cache directory")
+    parser.add_argument("--token-store", type=Path, default=None, help="Token count store path")
+    args = parser.parse_args(argv)
+
+    roots = list(args.roots)
+    if args.roots_from:
+        roots.extend(read_roots_file(args.roots_from))
+    if not roots:
+        print("ERROR: No roots given (pass ROOT... or --roots-from FILE)", file=sys.stderr)
+        sys.exit(1)
+    if args.concurrency < 1:
+        print("ERROR: --concurrency must be positive", file=sys.stderr)
+        sys.exit(1)
+
+    encodings = [LazyEncoding(name, file) for name, file in resolve_encoding_args(args.encoding, args.encoding_file)]
+    encoding_names = ",".join(enc.name for enc in encodings)
+    encoding = (encodings if len(encodings) > 1 else encodings[0]) if not args.no_tokens else None
+    use_cache = args.cache and not args.no_tokens
+    jobs = args.jobs or available_cpu_count()
+    store = open_token_store(args.cache_dir, args.token_store) if use_cache else None
+
+    paths = list(dict.fromkeys(Path(root).resolve() for root in roots))
+    hints = {path: repo_size_hint(path, encoding_names, args.cache_dir) for path in paths}
+    paths.sort(key=lambda p: hints[p], reverse=True)
+    pool = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="scan") if jobs > 1 else None
+
+    def profile(root: Path) -> dict:
+        if not root.is_dir():
+            raise NotADirectoryError(f"Path is not a directory: {root}")
+        started = time.perf_counter()
+        cache = ScanCache(root, encoding_names, args.cache_dir) if use_cache else None
+        manifests = ProjectManifests(root)
+        records = iter_scan(
+            root, encoding, args.max_tokens, cache, jobs, source=args.source, untracked=args.untracked,
+            store=store, workspaces=WorkspaceRollup(manifests), pool=pool,
+        )
+        index = DirectoryIndex() if args.format == "summary" else None
+        result = collect_scan(index.track(records) if index else records)
+        result.pop("token_store", None)  # shared by the batch, reported at the end
+        result.update(detect_project_profile(root, manifests, result.pop("workspaces", None)))
+        record = {"root": str(root), "status": "ok", "seconds": round(time.perf_counter() - started, 3)}
+        if args.format == "summary":
+            record["summary"] = format_summary(result, index)
+        else:
+            record["result"] = result
+        return record
+
+    started = time.perf_counter()
+    failed = 0
+    drivers = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="repo")
+    try:
+        futures = {drivers.submit(profile, path): path for path in paths}
+        for fut in as_completed(futures):
+            try:
+                record = fut.result()
+            except Exception as e:
+                failed += 1
+                record = {"root": str(futures[fut]), "status": "error", "error": f"{type(e).__name__}: {e}"}
+            write_ndjson_record(sys.stdout, "repo", record)
+            sys.stdout.flush()
+    finally:
+        drivers.shutdown(wait=True, cancel_futures=True)
+        if pool:
+            pool.shutdown(wait=True, cancel_futures=True)
+    summary = {
+        "repos": len(paths),
+        "ok": len(paths) - failed,
+        "failed": failed,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    if store:
+        store.close()
+        summary["token_store"] = store.stats()
+    write_ndjson_record(sys.stdout, "batch", summary)
+    sys.stdout.flush()
+    if failed:
+        sys.exit(1)
+
+
+# pat_str, special tokens and published SHA-256 of the standard encodings' BPE
+# files, for building them from a local .tiktoken file (see load_encoding)
+R50K_PAT_STR = r"""'(?:[sdmt]|ll|ve|re)| ?\p{L}++| ?\p{N}++| ?[^\s\p{L}\p{N}]++|\s++$|\s+(?!\S)|\s"""
+ENCODING_SPECS = {
+    "r50k_base": {
+        "pat_str": R50K_PAT_STR,
+        "special_tokens": {"<|endoftext|>": 50256},
+        "sha256": "306cd27f03c1a714eca7108e03d66b7dc042abe8c258b44c199a7ed9838dd930",
+    },
+    "p50k_base": {
+        "pat_str": R50K_PAT_STR,
+        "special_tokens": {"<|endoftext|>": 50256},
+        "sha256": "94b5ca7dff4d00767bc256fdd1b27e5b17361d7b8a5f968547f9f23eb70d2069",
+    },
+    "cl100k_base": {
+        "pat_str": (
+            r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}++|\p{N}{1,3}+| ?[^\s\p{L}\p{N}]++[\r\n]*+"""
+            r"""|\s++$|\s*[\r\n]|\s+(?!\S)|\s"""
+        ),
+        "special_tokens": {
+            "<|endoftext|>": 100257, "<|fim_prefix|>": 100258, "<|fim_middle|>": 100259,
+            "<|fim_suffix|>": 100260, "<|endofprompt|>": 100276,
+        },
+        "sha256": "223921b76ee99bde995b7ff738513eef100fb51d18c93597a113bcffe865b2a7",
+    },
+    "o200k_base": {
+        "pat_str": "|".join([
+            r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]*[\p{Ll}\p{Lm}\p{Lo}\p{M}]+(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+            r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]+[\p{Ll}\p{Lm}\p{Lo}\p{M}]*(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+            r"""\p{N}{1,3}""",
+            r""" ?[^\s\p{L}\p{N}]+[\r\n/]*""",
+            r"""\s*[\r\n]+""",
+            r"""\s+(?!\S)""",
+            r"""\s+""",
+        ]),
+        "special_tokens": {"<|endoftext|>": 199999, "<|endofprompt|>": 200018},
+        "sha256": "446a9538cb6c348e3516120d7c08b09f57c36495e2acfffe59a5bf8b0cfb1a2d",
+    },
+}
+
+
+def import_tiktoken():
+    """Import tiktoken, or exit with install instructions."""
+    try:
+        import tiktoken
+    except ImportError:
+        print("ERROR: tiktoken not installed.", file=sys.stderr)
+        print("Run with: uv run scan-project.py", file=sys.stderr)
+        sys.exit(1)
+    return tiktoken
+
+
+def load_encoding(name: str, path: Path | None = None) -> tiktoken.Encoding:
+    """Load a tiktoken encoding or exit with an error.
+
+    With path, the encoding is built from that local .tiktoken BPE file
+    (one "base64-token rank" pair per line) and never touches the network;
+    name must then be one of ENCODING_SPECS. A file that is not the published
+    one gives an encoding named as file_encoding_name() says.
+    """
+    tiktoken = import_tiktoken()
+    if path is None:
+        try:
+            return tiktoken.get_encoding(name)
+        except Exception as e:
+            print(f"ERROR: Failed to load encoding '{name}': {e}", file=sys.stderr)
+            print(f"Offline? Pass a local BPE file with --encoding-file {name}.tiktoken", file=sys.stderr)
+            sys.exit(1)
+
+    import base64
+
+    spec = ENCODING_SPECS.get(name)
+    if spec is None:
+        print(
+            f"ERROR: --encoding-file supports {', '.join(ENCODING_SPECS)}, not '{name}'",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    try:
+        data = path.read_bytes()
+        ranks = {}
+        for line in data.splitlines():
+            if line:
+                token, rank = line.split()
+                ranks[base64.b64decode(token)] = int(rank)
+        key = file_encoding_name(name, data)
+        encoding = tiktoken.Encoding(
+            name=key, pat_str=spec["pat_str"], mergeable_ranks=ranks, special_tokens=spec["special_tokens"]
+        )
+    except (OSError, ValueError) as e:
+        print(f"ERROR: Failed to load encoding '{name}' from {path}: {e}", file=sys.stderr)
+        sys.exit(1)
+    if key != name:
+        print(
+            f"WARNING: {path} is not the published {name} BPE file; counts may differ "
+            f"and are cached as {key}",
+            file=sys.stderr,
+        )
+    return encoding
+
+
+def file_encoding_name(name: str, data: bytes) -> str:
+    """Name of an encoding built from BPE file contents: the standard name for the
+    published file, else name@<sha256 prefix>, so that the scan cache and token
+    store never mix counts of a modified file with the real encoding's."""
+    digest = hashlib.sha256(data).hexdigest()
+    spec = ENCODING_SPECS.get(name)
+    return name if spec is None or digest == spec["sha256"] else f"{name}@{digest[:16]}"
+
+
+def encoding_file_name(path: Path) -> str | None:
+    """Encoding name implied by a BPE file name like cl100k_base.tiktoken, if it is a known one."""
+    name = path.name.split(".")[0]
+    return name if name in ENCODING_SPECS else None
+
+
+def resolve_encoding_args(names: str | None, paths: list[Path] | None) -> list[tuple[str, Path | None]]:
+    """Effective (name, BPE file) pairs for --encoding NAME[,NAME...] / --encoding-file FILE...
+
+    Without names, the encodings are the ones the files are named after (or
+    cl100k_base). A single file goes with a single encoding whatever its name;
+    otherwise each file must be named after one of the encodings. Exits if a
+    file is missing or matches no encoding.
+    """
+    paths = paths or []
+    for path in paths:
+        if not path.is_file():
+            print(f"ERROR: Encoding file not found: {path}", file=sys.stderr)
+            sys.exit(1)
+    if names is not None:
+        wanted = list(dict.fromkeys(name.strip() for name in names.split(",") if name.strip()))
+        if not wanted:
+            print("ERROR: --encoding needs at least one encoding name", file=sys.stderr)
+            sys.exit(1)
+    else:
+        wanted = list(dict.fromkeys(filter(None, map(encoding_file_name, paths)))) or ["cl100k_base"]
+    if len(wanted) == 1 and len(paths) == 1:
+        return [(wanted[0], paths[0])]
+    files = {}
+    for path in paths:
+        name = encoding_file_name(path)
+        if name not in wanted:
+            print(f"ERROR: {path} is not named after one of the encodings ({', '.join(wanted)})", file=sys.stderr)
+            sys.exit(1)
+        files[name] = path
+    return [(name, files.get(name)) for name in wanted]
+
+
+class LazyEncoding:
+    """Stand-in for a tiktoken Encoding that loads it on the first encode.
+
+    Cache and token-store lookups only need the name, so warm rescans and
+    runs that never tokenize skip importing tiktoken and reading BPE ranks.
+    With a BPE file, the name is the one load_encoding() will give it (the
+    file is hashed up front, but not parsed).
+    A load failure exits (SystemExit also ends the scan from a worker thread).
+    """
+
+    def __init__(self, name: str, path: Path | None = None):
+        import threading
+
+        self.base_name = name
+        self.name = name
+        if path is not None:
+            try:
+                self.name = file_encoding_name(name, path.read_bytes())
+            except OSError:
+                pass  # load() reports it
+        self.path = path
+        self._encoding: tiktoken.Encoding | None = None
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def load(self) -> tiktoken.Encoding:
+        with self._lock:
+            if self._encoding is None:
+                if self._failed:
+                    raise SystemExit(1)
+                self._failed = True
+                self._encoding = load_encoding(self.base_name, self.path)
+                self._failed = False
+        return self._encoding
+
+    def encode_ordinary(self, text: str) -> list[int]:
+        return (self._encoding or self.load()).encode_ordinary(text)
+
+
+def open_token_store(cache_dir: Path | None, token_store: Path | None) -> TokenStore | None:
+    """Open the token store (default: <cache dir>/tokens.sqlite3), warning and returning None on failure."""
+    try:
+        return TokenStore(token_store or (cache_dir or default_cache_dir()) / "tokens.sqlite3")
+    except Exception as e:
+        print(f"WARNING: Token store unavailable: {e}", file=sys.stderr)
+        return None
+
+
+def main():
+    if sys.argv[1:2] == ["serve"]:
+        serve_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["batch"]:
+        batch_main(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(
+        description="Scan a project for profiling: file tree, token counts, tech stack, metadata",
+        epilog="Run 'scan-project.py serve --help' for the long-running query server, "
+               "'scan-project.py batch --help' to profile many roots in one process.",
+    )
+    parser.add_argument(
+        "path", nargs="?", default=".",
+        help="Directory to scan (default: current directory), or a .zip / .tar[.gz|.bz2|.xz] archive "
+             "to scan in place without extracting it",
+    )
+    parser.add_argument(
+        "--format", choices=["summary", "json", "ndjson", "tree", "compact", "pack"],
+        default="summary",
+        help="Output format (default: summary; pack writes the contents of the --pack files)",
+    )
+    parser.add_argument(
+        "--max-tokens", type=int, default=50000,
+        help="Skip files with more than this many tokens (default: 50000)",
+    )
+    parser.add_argument(
+        "--encoding", default=None,
+        help="Tiktoken encoding to use (default: cl100k_base, or the one named by --encoding-file); "
+             "several comma-separated encodings (cl100k_base,o200k_base) are all counted in one read, "
+             "the first one driving totals and thresholds",
+    )
+    parser.add_argument(
+        "--encoding-file", type=Path, action="append", default=None, metavar="FILE",
+        help="Build the encoding from a local .tiktoken BPE file instead of tiktoken's download cache "
+             "(offline; e.g. cl100k_base.tiktoken; repeat for several encodings)",
+    )
+    parser.add_argument(
+        "--no-tokens", action="store_true",
+        help="Structure only: list files and directories without reading or tokenizing them",
+    )
+    parser.add_argument(
+        "--estimate", action="store_true",
+        help="Estimate tokens from file sizes, tokenizing only a calibration sample "
+             "(reports a 95%% confidence interval)",
+    )
+    parser.add_argument(
+        "--sample-size", type=int, default=400,
+        help="Files to tokenize for --estimate calibration (default: 400)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="Random seed for the --estimate sample (default: 0)",
+    )
+    parser.add_argument(
+        "--since", default=None, metavar="REV",
+        help="Rescan only files changed since git revision REV and apply them to --snapshot",
+    )
+    parser.add_argument(
+        "--snapshot", type=Path, default=None, metavar="FILE",
+        help="Previous --format json output to update with --since",
+    )
+    parser.add_argument(
+        "--depth", type=int, default=None, metavar="N",
+        help="Directory levels shown by the summary (default: 3) and tree (default: all), "
+             "and considered by --top-dirs (default: all)",
+    )
+    parser.add_argument(
+        "--top-dirs", type=int, default=None, metavar="K",
+        help="Report the K largest directories with their language mix",
+    )
+    parser.add_argument(
+        "--symbols", action="store_true",
+        help="Index top-level functions, classes and types of Python, JS/TS, Go and Rust files "
+             "with their line ranges and token counts",
+    )
+    parser.add_argument(
+        "--imports", action="store_true",
+        help="Build the import graph of Python, JS/TS, Go and Rust files (edges, in-degree and PageRank)",
+    )
+    parser.add_argument(
+        "--partition", type=int, default=None, metavar="N",
+        help="Plan a file assignment for N agents (bin-packs packages / directories)",
+    )
+    parser.add_argument(
+        "--budget", type=int, default=DEFAULT_AGENT_BUDGET, metavar="TOKENS",
+        help=f"Per-agent token budget for --partition (default: {DEFAULT_AGENT_BUDGET})",
+    )
+    parser.add_argument(
+        "--pack", type=int, default=None, metavar="BUDGET",
+        help="Choose the most important files that fit in BUDGET tokens (entry points, manifests, "
+             "README, shallow and core files first), listed in reading order",
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="Print wall/CPU time per phase, throughput, the slowest files and counters to stderr",
+    )
+    parser.add_argument(
+        "--profile-top", type=int, default=10, metavar="N",
+        help="Slowest files listed by --profile (default: 10)",
+    )
+    parser.add_argument(
+        "--trace", type=Path, default=None, metavar="FILE",
+        help="Write a Chrome trace-event JSON file of the scan (chrome://tracing, Perfetto)",
+    )
+    parser.add_argument(
+        "--source", choices=["fs", "git"], default="fs",
+        help="Enumerate files by walking the filesystem or from the git index (default: fs)",
+    )
+    parser.add_argument(
+        "--untracked", action="store_true",
+        help="With --source git, also include untracked files that are not ignored",
+    )
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=None,
+        help="Worker threads for reading and tokenizing (default: available CPUs)",
+    )
+    parser.add_argument(
+        "--processes", action="store_true",
+        help="Read and tokenize in --jobs worker processes instead of threads, so decoding and "
+             "symbol/import extraction also run in parallel (full directory scans; each worker "
+             "costs an interpreter start-up)",
+    )
+    parser.add_argument(
+        "--cache", action=argparse.BooleanOptionalAction, default=True,
+        help="Reuse token counts of unchanged files from the on-disk scan cache (default: on)",
+    )
+    parser.add_argument(
+        "--cache-dir", type=Path, default=None,
+        help="Scan cache directory (default: $XDG_CACHE_HOME/project-profiler)",
+    )
+    parser.add_argument(
+        "--token-store", type=Path, default=None,
+        help="Content-addressed token count store shared across repos and runs "
+             "(default: <cache dir>/tokens.sqlite3; disabled by --no-cache)",
+    )
+
+    args = parser.parse_args()
+    path = Path(args.path).resolve()
+
+    if not path.exists():
+        print(f"ERROR: Path does not exist: {path}", file=sys.stderr)
+        sys.exit(1)
+
+    archive = ArchiveSource(path) if is_archive(path) else None
+    if not path.is_dir() and archive is None:
+        print(f"ERROR: Path is not a directory or a tar/zip archive: {path}", file=sys.stderr)
+        sys.exit(1)
+    if archive and (args.estimate or args.since or args.source != "fs"):
+        print("ERROR: --estimate, --since and --source git need a directory, not an archive", file=sys.stderr)
+        sys.exit(1)
+
+    if args.partition is not None and (args.partition < 1 or args.budget < 1):
+        print("ERROR: --partition and --budget must be positive", file=sys.stderr)
+        sys.exit(1)
+
+    if args.pack is not None and args.pack < 1:
+        print("ERROR: --pack must be positive", file=sys.stderr)
+        sys.exit(1)
+    if args.pack and (args.no_tokens or args.estimate):
+        print("ERROR: --pack needs measured token counts (not --no-tokens or --estimate)", file=sys.stderr)
+        sys.exit(1)
+    if args.format == "pack" and not (args.pack and archive is None):
+        print("ERROR: --format pack needs --pack and a directory", file=sys.stderr)
+        sys.exit(1)
+
+    if (args.depth is not None and args.depth < 1) or (args.top_dirs is not None and args.top_dirs < 1):
+        print("ERROR: --depth and --top-dirs must be positive", file=sys.stderr)
+        sys.exit(1)
+
+    if args.no_tokens and (args.estimate or args.since or args.partition):
+        print("ERROR: --no-tokens cannot be combined with --estimate, --since or --partition", file=sys.stderr)
+        sys.exit(1)
+    if args.symbols and (args.no_tokens or args.estimate or args.since):
+        print("ERROR: --symbols cannot be combined with --no-tokens, --estimate or --since", file=sys.stderr)
+        sys.exit(1)
+    if args.imports and (args.no_tokens or args.estimate or args.since):
+        print("ERROR: --imports cannot be combined with --no-tokens, --estimate or --since", file=sys.stderr)
+        sys.exit(1)
+    encoding_args = resolve_encoding_args(args.encoding, args.encoding_file)
+    encodings = [LazyEncoding(name, file) for name, file in encoding_args]
+    encoding_names = [enc.name for enc in encodings]
+    if len(encoding_args) > 1 and args.estimate:
+        print("ERROR: --estimate takes a single --encoding", file=sys.stderr)
+        sys.exit(1)
+
+    snapshot = None
+    if args.since or args.snapshot:
+        if not (args.since and args.snapshot):
+            print("ERROR: --since and --snapshot must be used together", file=sys.stderr)
+            sys.exit(1)
+        if args.estimate:
+            print("ERROR: --since cannot be combined with --estimate", file=sys.stderr)
+            sys.exit(1)
+        try:
+            with open(args.snapshot, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"ERROR: Failed to read snapshot {args.snapshot}: {e}", file=sys.stderr)
+            sys.exit(1)
+        if (
+            not isinstance(snapshot, dict)
+            or "estimate" in snapshot
+            or not all(k in snapshot for k in ("files", "directories", "skipped", "total_tokens"))
+        ):
+            print(f"ERROR: {args.snapshot} is not a --format json scan result", file=sys.stderr)
+            sys.exit(1)
+        if snapshot.get("root") != str(path):
+            print(f"WARNING: Snapshot was taken of {snapshot.get('root')}, not {path}", file=sys.stderr)
+        if list(snapshot.get("total_tokens_by_encoding") or encoding_names[:1]) != encoding_names:
+            print(
+                f"ERROR: {args.snapshot} was not scanned with --encoding {','.join(encoding_names)}",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+
+    profiler = ScanProfiler(args.profile_top, trace=args.trace is not None) if args.profile or args.trace else None
+
+    # Core scan (a delta scan rescans too few files to keep the scan cache complete).
+    # The encoding is loaded on the first cache miss, if any.
+    with profile_phase(profiler, "setup"):
+        encoding = (encodings if len(encodings) > 1 else encodings[0]) if not args.no_tokens else None
+        use_cache = args.cache and not args.no_tokens
+        cache = None
+        if use_cache and not (snapshot or archive):
+            # Symbol indexes and import specifiers are cached apart from plain token counts
+            cache_key = ",".join(encoding_names)
+            cache_key += (":symbols" if args.symbols else "") + (":imports" if args.imports else "")
+            cache = ScanCache(path, cache_key, args.cache_dir)
+        jobs = args.jobs or available_cpu_count()
+        store = open_token_store(args.cache_dir, args.token_store) if use_cache else None
+        if not archive:
+            manifests = ProjectManifests(path)
+            workspaces = WorkspaceRollup(manifests)
+    try:
+        with profile_phase(profiler, "scan"):
+            if archive:
+                with profile_phase(profiler, "archive"):
+                    archive.load(encoding, store, jobs, args.symbols, args.imports)
+                manifests = ArchiveManifests(archive)
+                workspaces = WorkspaceRollup(manifests)
+            if args.estimate:
+                result = estimate_scan(
+                    path, encoding, args.max_tokens, cache, jobs,
+                    source=args.source, untracked=args.untracked, store=store,
+                    sample_size=args.sample_size, seed=args.seed, workspaces=workspaces,
+                )
+                records = result_records(result)
+            elif snapshot:
+                result = delta_scan(
+                    path, encoding, snapshot, args.since, args.max_tokens, jobs,
+                    source=args.source, untracked=args.untracked, store=store, workspaces=workspaces,
+                    profiler=profiler,
+                )
+                records = result_records(result)
+            else:
+                records = iter_scan(
+                    path, encoding, args.max_tokens, cache, jobs,
+                    source=args.source, untracked=args.untracked, store=store, workspaces=workspaces,
+                    profiler=profiler, archive=archive, symbols=args.symbols,
+                    imports=args.imports, processes=args.processes,
+                )
+            graph = ImportGraph() if args.imports else None
+            if graph:
+                records = graph.track(records)
+            # Only the summary, tree and --top-dirs read the directory index
+            index = DirectoryIndex() if args.format in ("summary", "tree") or args.top_dirs else None
+            if index:
+                records = index.track(records)
+            if profiler:
+                records = profiler.count_records(records)
+            if args.format == "ndjson":
+                partition_files: list[dict] = []
+                if args.partition or args.pack:
+                    records = tee_files(records, partition_files)
+                totals = write_ndjson(records, sys.stdout)
+            elif not (args.estimate or snapshot):
+                result = collect_scan(records)
+            else:
+                deque(records, maxlen=0)  # replay the result into the index (and the record counters)
+    except (OSError, RuntimeError) as e:
+        if snapshot and isinstance(e, RuntimeError):
+            print(f"ERROR: Failed to diff against {args.since}: {e}", file=sys.stderr)
+            sys.exit(1)
+        if archive:
+            print(f"ERROR: Failed to read archive {path}: {e}", file=sys.stderr)
+            sys.exit(1)
+        if args.source != "git":
+            raise
+        print(f"ERROR: Failed to list files from git: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.format == "ndjson":
+        result = totals
+    if cache:
+        stats = result["cache"]
+        print(
+            f"Scan cache: {stats['hits']:,}/{stats['hits'] + stats['misses']:,} hits "
+            f"({stats['hit_rate']:.1%})",
+            file=sys.stderr,
+        )
+    if store:
+        store.close()
+        stats = result["token_store"]
+        print(
+            f"Token store: {stats['store_hits']:,} store hits, {stats['run_hits']:,} duplicates, "
+            f"{stats['tokenized']:,} tokenized",
+            file=sys.stderr,
+        )
+    if profiler:
+        for section, keys in (("cache", ("hits", "misses")), ("token_store", ("store_hits", "run_hits", "tokenized"))):
+            for key in keys:
+                if section in result:
+                    profiler.count(f"{section}.{key}", result[section][key])
+
+    # Additional profiling data (workspaces come from the walk, with per-package totals)
+    with profile_phase(profiler, "detectors"):
+        profile = detect_project_profile(
+            path.with_name(archive.name) if archive else path, manifests, result.pop("workspaces", None), profiler
+        )
+    import_graph = None
+    if graph:
+        with profile_phase(profiler, "imports"):
+            import_graph = graph.finish((manifests.go_module() or {}).get("module"))
+    ranks = {c["path"]: c["pagerank"] for c in import_graph["centrality"]} if import_graph else None
+
+    with profile_phase(profiler, "output"):
+        if args.format == "ndjson":
+            for kind, record in profile.items():
+                write_ndjson_record(sys.stdout, kind, record)
+            if args.partition:
+                write_ndjson_record(sys.stdout, "partition", plan_partition(
+                    partition_files, profile["workspaces"], args.partition, args.budget
+                ))
+            if args.pack:
+                write_ndjson_record(
+                    sys.stdout, "pack", plan_pack(partition_files, profile["entry_points"], args.pack, ranks)
+                )
+            if import_graph:
+                write_ndjson_record(sys.stdout, "import_graph", import_graph)
+            if args.top_dirs:
+                write_ndjson_record(sys.stdout, "top_directories", index.top(args.top_dirs, args.depth))
+            if "delta" in totals:
+                write_ndjson_record(sys.stdout, "delta", totals["delta"])
+            write_ndjson_record(sys.stdout, "language_distribution", totals["language_distribution"])
+            write_ndjson_record(sys.stdout, "totals", {
+                key: value for key, value in totals.items() if key not in ("language_distribution", "delta")
+            })
+        else:
+            result.update(profile)
+            if args.partition:
+                result["partition"] = plan_partition(
+                    result["files"], result["workspaces"], args.partition, args.budget
+                )
+            if args.pack:
+                result["pack"] = plan_pack(result["files"], result["entry_points"], args.pack, ranks)
+            if import_graph:
+                result["import_graph"] = import_graph
+            if args.top_dirs:
+                result["top_directories"] = index.top(args.top_dirs, args.depth)
+
+            if args.format == "summary":
+                print(format_summary(result, index, args.depth or 3))
+            elif args.format == "json":
+                print(json.dumps(result, indent=2))
+            elif args.format == "pack":
+                write_pack(path, result["pack"], sys.stdout)
+            elif args.format == "tree":
+                print(format_tree(result, show_tokens=True, index=index, depth=args.depth))
+            elif args.format == "compact":
+                measure = "tokens" if result["total_tokens"] is not None else "size_bytes"
+                files_sorted = sorted(result["files"], key=lambda x: x[measure], reverse=True)
+                print(f"# {result['root']}")
+                if result["total_tokens"] is None:
+                    print(f"# Total: {result['total_files']} files (sizes in bytes; token counts skipped)")
+                else:
+                    print(f"# Total: {result['total_files']} files, {result['total_tokens']:,} tokens")
+                print(f"# Tech: {', '.join(result['tech_stack']['frameworks']) or 'N/A'}")
+                print()
+                for f in files_sorted:
+                    print(f"{f[measure]:>8} {f['path']}")
+        sys.stdout.flush()
+
+    if profiler:
+        if args.profile:
+            print(profiler.report(), file=sys.stderr)
+        if args.trace:
+            try:
+                profiler.write_trace(args.trace)
+            except OSError as e:
+                print(f"WARNING: Failed to write trace {args.trace}: {e}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1177 @@
+"""Tests for scripts/scan_project.py.
+
+End-to-end tests run scripts/scan-project.py as a subprocess, as the skill
+runs it, with the cache directory under tmp_path and a test encoding in which
+every byte is one token, so no test touches the network or the user's cache.
+Unit tests import scan_project directly.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tarfile
+import zipfile
+from pathlib import Path
+
+import pytest
+
+tiktoken = pytest.importorskip("tiktoken")
+
+SCRIPTS = Path(__file__).resolve().parent.parent / "scripts"
+SCANNER = SCRIPTS / "scan-project.py"
+
+sys.path.insert(0, str(SCRIPTS))
+
+import scan_project as sp  # noqa: E402
+
+# A tiktoken_ext plugin module registering the test encodings: in test_bytes every
+# byte is one token, test_pairs also merges a few common byte pairs
+ENCODING_PLUGIN = '''
+BYTES = {bytes([i]): i for i in range(256)}
+PAIRS = [b"  ", b"in", b"pr", b"nt", b"el", b"pe", b"er", b"()", b"t(", b"re"]
+
+
+def test_bytes():
+    return {"name": "test_bytes", "pat_str": r"\\S+|\\s+", "mergeable_ranks": dict(BYTES), "special_tokens": {}}
+
+
+def test_pairs():
+    ranks = {**BYTES, **{pair: 256 + n for n, pair in enumerate(PAIRS)}}
+    return {"name": "test_pairs", "pat_str": r"\\S+|\\s+", "mergeable_ranks": ranks, "special_tokens": {}}
+
+
+ENCODING_CONSTRUCTORS = {"test_bytes": test_bytes, "test_pairs": test_pairs}
+'''
+
+# Run-specific keys that differ between otherwise identical scans
+RUN_KEYS = ("root", "cache", "token_store", "delta")
+
+
+def build_encoding(name: str) -> tiktoken.Encoding:
+    """A test encoding, built in-process."""
+    namespace: dict = {}
+    exec(ENCODING_PLUGIN, namespace)
+    return tiktoken.Encoding(**namespace[name]())
+
+
+@pytest.fixture(scope="session")
+def plugin_path(tmp_path_factory) -> Path:
+    """A directory that puts the test encoding on tiktoken's plugin path."""
+    root = tmp_path_factory.mktemp("plugin")
+    (root / "tiktoken_ext").mkdir()
+    (root / "tiktoken_ext" / "test_bytes.py").write_text(ENCODING_PLUGIN)
+    return root
+
+
+@pytest.fixture
+def run_scanner(tmp_path: Path, plugin_path: Path):
+    """Run the scanner with argv; returns the completed process."""
+    pythonpath = os.pathsep.join(p for p in (str(plugin_path), os.environ.get("PYTHONPATH")) if p)
+    env = {**os.environ, "PYTHONPATH": pythonpath, "XDG_CACHE_HOME": str(tmp_path / "cache")}
+
+    def run(*argv: str, check: bool = True) -> subprocess.CompletedProcess:
+        proc = subprocess.run(
+            [sys.executable, str(SCANNER), *argv], capture_output=True, text=True, env=env, check=False,
+        )
+        if check:
+            assert proc.returncode == 0, proc.stderr
+        return proc
+
+    return run
+
+
+@pytest.fixture
+def scan(run_scanner):
+    """Scan root with the test encoding; returns the parsed --format json result."""
+
+    def run(root: Path, *args: str) -> dict:
+        proc = run_scanner(str(root), "--encoding", "test_bytes", "--format", "json", *args)
+        return json.loads(proc.stdout)
+
+    return run
+
+
+def git(repo: Path, *args: str) -> str:
+    proc = subprocess.run(
+        ["git", "-C", str(repo), "-c", "user.name=test", "-c", "user.email=test@example.com",
+         "-c", "core.excludesFile=/dev/null", *args],
+        capture_output=True, text=True, check=True,
+    )
+    return proc.stdout
+
+
+def write_tree(root: Path, files: dict[str, str]) -> None:
+    for rel_path, content in files.items():
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+
+REPO_FILES = {
+    "README.md": "# Demo\n",
+    "src/main.py": "print('hi')\n",
+    "src/pkg/__init__.py": "from .util import helper\n",
+    "src/pkg/util.py": "def helper():\n    return 1\n",
+}
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    """A committed git repository with a package under src/."""
+    root = tmp_path / "repo"
+    write_tree(root, REPO_FILES)
+    git(root, "init", "-q")
+    git(root, "add", "-A")
+    git(root, "commit", "-qm", "initial")
+    return root
+
+
+def tokens_by_path(result: dict) -> dict[str, int]:
+    return {f["path"]: f["tokens"] for f in result["files"]}
+
+
+def without_run_keys(result: dict) -> dict:
+    return {k: v for k, v in result.items() if k not in RUN_KEYS}
+
+
+def test_scan_counts_every_byte(repo: Path, scan):
+    result = scan(repo)
+    assert tokens_by_path(result) == {path: len(content) for path, content in REPO_FILES.items()}
+    assert result["total_tokens"] == sum(map(len, REPO_FILES.values()))
+
+
+# Scan cache
+
+
+def test_scan_cache_round_trip_and_invalidation(tmp_path: Path):
+    root = tmp_path / "repo"
+    write_tree(root, {"a.py": "a = 1\n", "b.py": "b = 2\n"})
+    cache_dir = tmp_path / "cache"
+    info = {"verdict": "text", "tokens": 6, "lines": 1}
+
+    cache = sp.ScanCache(root, "enc", cache_dir)
+    for name in ("a.py", "b.py"):
+        assert cache.lookup(name, (root / name).stat()) is None
+        cache.store(name, (root / name).stat(), info)
+    cache.save()
+
+    cache = sp.ScanCache(root, "enc", cache_dir)
+    assert cache.lookup("a.py", (root / "a.py").stat()) == info
+    # A changed size/mtime invalidates the entry; b.py is not looked up, so it is dropped on save
+    (root / "a.py").write_text("a = 10\n")
+    assert cache.lookup("a.py", (root / "a.py").stat()) is None
+    cache.save()
+
+    cache = sp.ScanCache(root, "enc", cache_dir)
+    assert cache.lookup("b.py", (root / "b.py").stat()) is None
+    assert sp.ScanCache(root, "other", cache_dir).entries == {}
+
+    # Entries written by another cache version are not trusted
+    cache.store("b.py", (root / "b.py").stat(), info)
+    cache.save()
+    data = json.loads(cache.path.read_text())
+    cache.path.write_text(json.dumps({**data, "version": data["version"] + 1}))
+    assert sp.ScanCache(root, "enc", cache_dir).entries == {}
+
+
+def test_warm_rescan_hits_cache(repo: Path, scan):
+    cold = scan(repo)
+    assert cold["cache"]["hits"] == 0
+
+    warm = scan(repo)
+    assert warm["cache"]["hits"] == warm["total_files"]
+    assert without_run_keys(warm) == without_run_keys(cold)
+
+    (repo / "src" / "main.py").write_text("print('changed')\n")
+    edited = scan(repo)
+    assert edited["cache"]["misses"] == 1
+    assert tokens_by_path(edited) == tokens_by_path(scan(repo, "--no-cache"))
+    assert tokens_by_path(edited)["src/main.py"] == len("print('changed')\n")
+
+
+# Worker pool
+
+
+def test_parallel_scan_matches_serial(tmp_path: Path, scan):
+    root = tmp_path / "tree"
+    write_tree(root, {f"pkg{i % 4}/mod{i}.py": f"VALUE_{i} = {'x' * i!r}\n" for i in range(40)})
+    serial = scan(root, "--no-cache", "-j", "1")
+    parallel = scan(root, "--no-cache", "-j", "4")
+    assert serial["total_files"] == 40
+    assert without_run_keys(parallel) == without_run_keys(serial)
+    assert [f["path"] for f in parallel["files"]] == [f["path"] for f in serial["files"]]
+
+
+def test_process_pool_scan_matches_serial(tmp_path: Path, scan):
+    files = {f"pkg{i % 4}/mod{i}.py": f"def f{i}():\n    return {'x' * i!r}\n" for i in range(100)}
+    files["pkg0/blob.bin"] = "\0" * 64
+    write_tree(tmp_path / "tree", files)
+    args = ("--encoding", "test_bytes,test_pairs", "--symbols", "--imports")
+
+    serial = scan(tmp_path / "tree", "--no-cache", "-j", "1", *args)
+    processes = scan(tmp_path / "tree", "-j", "3", "--processes", "--profile", *args)
+    assert without_run_keys(processes) == without_run_keys(serial)
+    assert processes["token_store"]["tokenized"] == 2 * 100
+
+    # The workers' counts were saved by the parent's store
+    write_tree(tmp_path / "copy", files)
+    again = scan(tmp_path / "copy", "-j", "3", "--processes", *args)
+    assert again["token_store"]["tokenized"] == 0
+    assert tokens_by_path(again) == tokens_by_path(serial)
+
+
+# Ignore engine
+
+IGNORE_TREE = {
+    ".gitignore": "*.log\n!keep.log\n/out/\nlogs/\ndocs/**/draft.md\n[Tt]emp*\na?c.txt\n\\#notes\n",
+    "keep.log": "kept\n",
+    "debug.log": "ignored\n",
+    "out/a.txt": "anchored dir\n",
+    "src/out/b.txt": "not anchored\n",
+    "src/logs/c.txt": "dir pattern\n",
+    "docs/draft.md": "top-level draft\n",
+    "docs/guide/v1/draft.md": "nested draft\n",
+    "docs/guide/index.md": "# Guide\n",
+    "Temp1.txt": "class\n",
+    "temp2.txt": "class\n",
+    "abc.txt": "single char\n",
+    "abbc.txt": "two chars\n",
+    "#notes": "escaped hash\n",
+    "src/.gitignore": "*.tmp\n!important.tmp\n/local.py\n",
+    "src/scratch.tmp": "ignored\n",
+    "src/important.tmp": "re-included\n",
+    "src/local.py": "anchored to src\n",
+    "src/pkg/local.py": "not anchored\n",
+    "src/pkg/main.py": "print('hi')\n",
+    "secret.txt": "excluded\n",
+}
+
+
+@pytest.fixture
+def ignore_repo(tmp_path: Path) -> Path:
+    """A git repository exercising nested .gitignore files and .git/info/exclude."""
+    root = tmp_path / "ignored"
+    write_tree(root, IGNORE_TREE)
+    git(root, "init", "-q")
+    (root / ".git" / "info" / "exclude").write_text("secret.txt\n")
+    return root
+
+
+def git_visible_files(root: Path) -> set[str]:
+    return set(git(root, "ls-files", "-co", "--exclude-standard", "-z").split("\0")) - {""}
+
+
+def test_ignore_engine_matches_git(ignore_repo: Path, scan):
+    expected = git_visible_files(ignore_repo)
+    assert "debug.log" not in expected and "src/important.tmp" in expected
+    assert set(tokens_by_path(scan(ignore_repo))) == expected
+
+
+# Walker
+
+
+def walk(root: Path, **kwargs) -> list[tuple[str, str]]:
+    items = sp.iter_walk(root, sp.IgnoreEngine(root), **kwargs)
+    return [(item[0], item[2] if item[0] == "file" else item[1]) for item in items]
+
+
+def test_walk_order_and_symlinks(tmp_path: Path):
+    root = tmp_path / "tree"
+    write_tree(root, {"b.py": "", "A.py": "", "zeta/z.py": "", "Alpha/a.py": "", "Alpha/inner/i.py": ""})
+    (root / "link").symlink_to(root / "zeta", target_is_directory=True)
+
+    assert walk(root) == [
+        ("dir", "Alpha"), ("dir", "Alpha/inner"), ("file", "Alpha/inner/i.py"), ("file", "Alpha/a.py"),
+        ("dir", "zeta"), ("file", "zeta/z.py"),
+        ("file", "A.py"), ("file", "b.py"),
+    ]
+    with sp.ThreadPoolExecutor(max_workers=2) as pool:
+        assert walk(root, list_pool=pool, prefetch=4) == walk(root)
+
+
+def test_walk_matches_git(ignore_repo: Path):
+    walked = {path for kind, path in walk(ignore_repo) if kind == "file"}
+    assert walked == git_visible_files(ignore_repo)
+
+
+# Git index source
+
+
+def test_git_source_matches_walk(repo: Path, scan):
+    (repo / "notes.md").write_text("# Untracked\n")
+    (repo / "src" / "main.py").write_text("print('edited')\n")
+
+    from_git = scan(repo, "--source", "git")
+    assert "notes.md" not in tokens_by_path(from_git)
+    assert tokens_by_path(from_git)["src/main.py"] == len("print('edited')\n")
+
+    with_untracked = scan(repo, "--source", "git", "--untracked")
+    assert without_run_keys(with_untracked) == without_run_keys(scan(repo))
+    assert [f["path"] for f in with_untracked["files"]] == [f["path"] for f in scan(repo)["files"]]
+
+
+def test_git_source_outside_a_repository_fails(tmp_path: Path, run_scanner):
+    proc = run_scanner(str(tmp_path), "--encoding", "test_bytes", "--source", "git", check=False)
+    assert proc.returncode == 1
+    assert proc.stderr.startswith("ERROR:")
+
+
+def test_git_source_from_subdirectory_sees_dirty_files(repo: Path, scan):
+    # Warm the token store with the committed blob, then modify the file
+    scan(repo / "src", "--source", "git")
+    edited = "print('hello, world')\n" * 20
+    (repo / "src" / "main.py").write_text(edited)
+
+    result = scan(repo / "src", "--source", "git")
+    assert tokens_by_path(result) == tokens_by_path(scan(repo / "src", "--no-cache"))
+    assert tokens_by_path(result)["main.py"] == len(edited)
+
+
+# Token store
+
+
+def test_token_store_round_trip(tmp_path: Path):
+    path = tmp_path / "tokens.sqlite3"
+    calls = []
+
+    def count() -> int:
+        calls.append(1)
+        return 42
+
+    store = sp.TokenStore(path)
+    assert store.get_or_count("blob:abc", "enc", count, lines=3) == 42
+    assert store.get_or_count("blob:abc", "enc", count, lines=3) == 42
+    assert len(calls) == 1
+    store.close()
+
+    store = sp.TokenStore(path)
+    assert store.lookup("blob:abc", "enc") == (42, 3)
+    assert store.lookup("blob:abc", "other") is None
+    assert store.lookup("blob:def", "enc") is None
+    assert store.stats()["store_hits"] == 1
+    store.close()
+
+    # A store written with another schema is dropped, not misread
+    with sqlite3.connect(str(path)) as conn:
+        conn.execute(f"PRAGMA user_version = {sp.TokenStore.SCHEMA_VERSION + 1}")
+    conn.close()
+    store = sp.TokenStore(path)
+    assert store.lookup("blob:abc", "enc") is None
+    store.close()
+
+
+def test_token_store_is_shared_across_roots(tmp_path: Path, repo: Path, scan):
+    cold = scan(repo)
+    assert cold["token_store"]["tokenized"] == cold["total_files"]
+
+    # A copy of the repository has a cold scan cache but every blob is in the store
+    copy = tmp_path / "copy"
+    write_tree(copy, REPO_FILES)
+    (copy / "src" / "new.py").write_text("print('new')\n")
+    (copy / "src" / "dup.py").write_text("print('new')\n")
+    result = scan(copy)
+    assert result["cache"]["hits"] == 0
+    assert result["token_store"]["tokenized"] == 1
+    assert tokens_by_path(result) == tokens_by_path(scan(copy, "--no-cache"))
+
+
+# NDJSON output
+
+NDJSON_TRAILER = [
+    "tech_stack", "package_metadata", "entry_points", "project_features", "detected_sections",
+    "workspaces", "language_distribution", "totals",
+]
+
+
+def scan_ndjson(run_scanner, root: Path, *args: str) -> list[dict]:
+    proc = run_scanner(str(root), "--encoding", "test_bytes", "--format", "ndjson", *args)
+    return [json.loads(line) for line in proc.stdout.splitlines()]
+
+
+def test_ndjson_streams_the_json_result(repo: Path, scan, run_scanner):
+    records = scan_ndjson(run_scanner, repo, "--no-cache")
+    result = scan(repo, "--no-cache")
+
+    stream = [r for r in records if r["type"] in ("file", "directory")]
+    assert [r["path"] for r in stream if r["type"] == "file"] == [f["path"] for f in result["files"]]
+    assert [r for r in stream if r["type"] == "file"] == [{"type": "file", **f} for f in result["files"]]
+    assert [r["path"] for r in stream if r["type"] == "directory"] == ["src", "src/pkg"]
+    # Every record before the trailer is a scan event; the trailer comes once, in order
+    assert [r["type"] for r in records[len(stream):]] == NDJSON_TRAILER
+
+    trailer = {r.pop("type"): r for r in records[len(stream):]}
+    assert trailer["totals"]["total_tokens"] == result["total_tokens"]
+    assert trailer["totals"]["total_files"] == result["total_files"]
+    assert trailer["language_distribution"] == result["language_distribution"]
+    assert trailer["tech_stack"] == result["tech_stack"]
+    assert trailer["entry_points"]["data"] == result["entry_points"]
+
+
+# Estimate mode
+
+
+@pytest.fixture
+def many_files(tmp_path: Path) -> Path:
+    root = tmp_path / "many"
+    write_tree(root, {f"src/mod{i}.py": f"# module {i}\n" + "x = 1\n" * (i % 17 + 1) for i in range(60)})
+    write_tree(root, {f"docs/page{i}.md": f"# Page {i}\n" + "Some text.\n" * (i % 5 + 1) for i in range(20)})
+    return root
+
+
+def test_estimate_brackets_the_exact_total(many_files: Path, scan):
+    exact = scan(many_files, "--no-cache")
+    estimate = scan(many_files, "--no-cache", "--estimate", "--sample-size", "20", "--seed", "3")
+    block = estimate["estimate"]
+    assert block["estimated_files"] > 0
+    assert block["sampled_files"] + block["estimated_files"] == exact["total_files"]
+    assert block["total_tokens_low"] <= exact["total_tokens"] <= block["total_tokens_high"]
+    assert sum(1 for f in estimate["files"] if f.get("estimated")) == block["estimated_files"]
+    assert estimate == scan(many_files, "--no-cache", "--estimate", "--sample-size", "20", "--seed", "3")
+
+
+def test_estimate_with_a_full_sample_is_exact(many_files: Path, scan):
+    exact = scan(many_files, "--no-cache")
+    estimate = scan(many_files, "--no-cache", "--estimate", "--sample-size", "1000")
+    assert estimate["estimate"]["estimated_files"] == 0
+    assert estimate["total_tokens"] == exact["total_tokens"]
+    assert tokens_by_path(estimate) == tokens_by_path(exact)
+
+
+# Single-read pipeline
+
+
+def test_text_and_binary_verdicts(tmp_path: Path, scan):
+    root = tmp_path / "mixed"
+    write_tree(root, {"notes": "plain text\nwithout an extension\n"})
+    # A multi-byte character straddling the 8 KB sniff window is still text
+    (root / "straddle").write_bytes(b"a" * (sp.SNIFF_BYTES - 1) + "\u00e9".encode("utf-8") + b"\n")
+    (root / "nul.bin").write_bytes(b"abc\0def")
+    (root / "latin1").write_bytes(b"caf\xe9\n")
+    # Memory-mapped from MMAP_THRESHOLD up
+    (root / "big.txt").write_bytes(b"line\n" * (sp.MMAP_THRESHOLD // 5 + 1))
+
+    result = scan(root, "--no-cache", "--max-tokens", "1000000")
+    files = {f["path"]: f for f in result["files"]}
+    assert files["notes"]["tokens"] == len("plain text\nwithout an extension\n")
+    assert files["notes"]["lines"] == 2
+    assert files["straddle"]["tokens"] == sp.SNIFF_BYTES + 2
+    assert files["big.txt"]["lines"] == sp.MMAP_THRESHOLD // 5 + 1
+    assert files["big.txt"]["tokens"] == (root / "big.txt").stat().st_size
+    assert {s["path"]: s["reason"] for s in result["skipped"]} == {"nul.bin": "binary", "latin1": "binary"}
+
+
+# Oversized files
+
+
+def test_oversized_files_are_measured_in_chunks(tmp_path: Path, scan):
+    root = tmp_path / "big"
+    # Lines of multi-byte characters, so chunk cuts land between and inside characters
+    line = "0123456789 éè中文\n"
+    huge = line * (2 * sp.MAX_FILE_BYTES // len(line.encode("utf-8")) + 7)
+    write_tree(root, {"huge.txt": huge, "small.py": "x = 1\n" * 100})
+    size = len(huge.encode("utf-8"))
+
+    result = scan(root, "--no-cache", "--max-tokens", "300")
+    assert result["files"] == []
+    assert {s["path"]: (s["reason"], s["tokens"]) for s in result["skipped"]} == {
+        "huge.txt": ("too_large", size), "small.py": ("too_many_tokens", 600),
+    }
+    assert result["oversized_files"] == 2
+    assert result["oversized_tokens"] == result["total_tokens"] == size + 600
+
+
+def test_chunked_counts_are_stored_apart_from_exact_counts(tmp_path: Path, scan):
+    huge = "0123456789\n" * (sp.MAX_FILE_BYTES // 11 + 1)
+    data = huge.encode()
+    blob_sha = hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+    write_tree(tmp_path / "big", {"huge.txt": huge})
+
+    first = scan(tmp_path / "big")
+    assert first["token_store"]["tokenized"] == 1
+    with sqlite3.connect(str(tmp_path / "cache" / "project-profiler" / "tokens.sqlite3")) as conn:
+        assert conn.execute("SELECT digest, tokens FROM tokens").fetchall() == [("chunked:" + blob_sha, len(data))]
+
+    # In git mode the blob id is known up front, so a cold scan cache finds the stored counts.
+    copy = tmp_path / "copy"
+    write_tree(copy, {"huge.txt": huge})
+    git(copy, "init", "-q")
+    git(copy, "add", "-A")
+    again = scan(copy, "--source", "git")
+    assert again["cache"]["hits"] == 0
+    assert again["token_store"]["tokenized"] == 0
+    assert again["total_tokens"] == first["total_tokens"] == len(data)
+
+
+# Project manifests
+
+MANIFESTS = {
+    "pyproject.toml": (
+        '[build-system]\nbuild-backend = "hatchling.build"\n'
+        '[project]\nname = "demo"\nversion = "0.1.0"\n'
+        'dependencies = ["FastAPI>=0.100", "httpx[http2]; python_version > \'3.8\'"]\n'
+        '[project.optional-dependencies]\ndev = ["pytest"]\n'
+        '[dependency-groups]\nlint = ["ruff"]\n'
+        '[tool.poetry.dependencies]\npython = "^3.11"\nrich = "*"\n'
+    ),
+    "Cargo.toml": (
+        '[package]\nname = "demo"\n[dependencies]\naxum = "0.7"\n'
+        "[target.'cfg(unix)'.dependencies]\nnix = \"0.27\"\n[build-dependencies]\ncc = \"1\"\n"
+    ),
+    "package.json": '{"name": "demo", "dependencies": {"react": "18"}, "devDependencies": {"vite": "5"}}',
+}
+
+
+def test_manifest_dependencies_and_tech_stack(tmp_path: Path):
+    root = tmp_path / "proj"
+    write_tree(root, MANIFESTS)
+    manifests = sp.ProjectManifests(root)
+
+    deps = sp.extract_all_dependencies(root, manifests)
+    assert {"fastapi", "httpx", "pytest", "ruff", "rich", "axum", "nix", "cc", "react", "vite"} <= deps
+    assert "python" not in deps
+
+    stack = sp.detect_tech_stack(root, manifests)
+    assert {"react", "hatch", "fastapi", "axum"} <= set(stack["frameworks"])
+    assert stack["languages_detected"] == ["javascript", "python", "rust"]
+    assert sp.extract_package_metadata(root, manifests)["name"] == "demo"
+
+
+def test_dependency_matching_is_exact(tmp_path: Path):
+    assert sp.normalize_dependency("LangChain_Core") == "langchain-core"
+    assert sp.matches_dependency("langchain", {"LangChain_Core"})
+    assert sp.matches_dependency("openai", {"OpenAI"})
+    assert not sp.matches_dependency("openai", {"openai-whisper"})
+    assert not sp.matches_dependency("mcp", {"mcp-server-git"})
+
+    root = tmp_path / "proj"
+    write_tree(root, {"pyproject.toml": (
+        '[project]\nname = "demo"\ndependencies = ["openai-whisper==20231117", "mcp-server-git", "LangChain_Core"]\n'
+    )})
+    frameworks = sp.detect_tech_stack(root)["frameworks"]
+    assert "langchain" in frameworks
+    assert not {"openai-sdk", "mcp-sdk"} & set(frameworks)
+
+
+def test_manifest_exists_matches_path_exists(tmp_path: Path):
+    root = tmp_path / "proj"
+    write_tree(root, {"README.md": "# Demo\n", "src/main.py": ""})
+    (root / "dangling").symlink_to(root / "missing")
+    (root / "linked.md").symlink_to(root / "README.md")
+    manifests = sp.ProjectManifests(root)
+    for rel in ("README.md", "readme.md", "README.MD", "dangling", "linked.md", "missing", "src", "src/main.py"):
+        assert manifests.exists(rel) == (root / rel).exists(), rel
+    assert manifests.is_dir("src") and not manifests.is_dir("linked.md")
+
+
+# Workspace rollup
+
+WORKSPACE_TREE = {
+    "package.json": '{"name": "root", "workspaces": ["packages/*"]}',
+    "packages/a/package.json": '{"name": "@demo/a"}',
+    "packages/a/src/index.ts": "export const a = 1;\n",
+    "packages/b/package.json": '{"name": "@demo/b"}',
+    "packages/b/x.py": "print(1)\n",
+    "packages/b/lib/util.py": "def util():\n    pass\n",
+    "tools/t.sh": "echo tool\n",
+}
+
+
+def test_workspace_rollup(tmp_path: Path, scan, run_scanner):
+    root = tmp_path / "mono"
+    write_tree(root, WORKSPACE_TREE)
+    result = scan(root, "--no-cache")
+    tokens = tokens_by_path(result)
+
+    rollup = {w["path"]: w for w in result["workspaces"]}
+    assert [w["name"] for w in result["workspaces"]] == ["@demo/a", "@demo/b"]
+    for path, workspace in rollup.items():
+        inside = [t for p, t in tokens.items() if p.startswith(path + "/")]
+        assert workspace["files"] == len(inside)
+        assert workspace["tokens"] == sum(inside)
+        assert sum(workspace["language_distribution"]["by_tokens"].values()) == workspace["tokens"]
+    assert rollup["packages/b"]["language_distribution"]["by_files"] == {"json": 1, "python": 2}
+
+    records = scan_ndjson(run_scanner, root, "--no-cache")
+    assert next(r for r in records if r["type"] == "workspaces")["data"] == result["workspaces"]
+    estimated = scan(root, "--no-cache", "--estimate", "--sample-size", "100")
+    assert estimated["workspaces"] == result["workspaces"]
+
+
+# Partition planner
+
+
+@pytest.fixture
+def layered(tmp_path: Path) -> Path:
+    root = tmp_path / "layered"
+    files = {"README.md": "# Layered\n" * 20}
+    for top, count in (("api", 12), ("core", 20), ("web", 8), ("cli", 4)):
+        for i in range(count):
+            files[f"{top}/sub{i % 3}/m{i}.py"] = f"# {top} {i}\n" + "value = 1\n" * 10
+    write_tree(root, files)
+    return root
+
+
+def check_partition(result: dict, agents: int) -> dict:
+    partition = result["partition"]
+    assigned = [p for a in partition["assignments"] for p in a["paths"]]
+    assert sorted(assigned) == sorted(tokens_by_path(result))
+    assert len(partition["assignments"]) == agents
+    tokens = tokens_by_path(result)
+    for agent in partition["assignments"]:
+        assert agent["tokens"] == sum(tokens[p] for p in agent["paths"])
+        assert agent["over_budget"] == (agent["tokens"] > partition["budget"])
+    return partition
+
+
+def test_partition_is_balanced_within_budget(layered: Path, scan):
+    result = scan(layered, "--no-cache", "--partition", "3", "--budget", "100000")
+    partition = check_partition(result, 3)
+    assert not partition["over_budget"]
+    assert partition["total_tokens"] == result["total_tokens"]
+    assert partition["imbalance"] <= 1.5
+
+
+def test_partition_splits_groups_over_budget(layered: Path, scan):
+    tokens = tokens_by_path(scan(layered, "--no-cache"))
+    core = sum(t for p, t in tokens.items() if p.startswith("core/"))
+    budget = core - 100
+    assert sum(tokens.values()) < 3 * budget
+    result = scan(layered, "--no-cache", "--partition", "3", "--budget", str(budget))
+    partition = check_partition(result, 3)
+    assert not partition["over_budget"]
+    # core/ alone is over the budget, so it is split by subdirectory
+    groups = [g for a in partition["assignments"] for g in a["groups"]]
+    assert sorted(g["path"] for g in groups if g.get("split")) == ["core/sub0", "core/sub1", "core/sub2"]
+    assert all(g["tokens"] <= budget for g in groups)
+
+
+# Serve mode
+
+
+def test_serve_answers_queries_and_picks_up_changes(repo: Path, scan, plugin_path: Path, tmp_path: Path):
+    env = {**os.environ, "PYTHONPATH": str(plugin_path), "XDG_CACHE_HOME": str(tmp_path / "cache")}
+    proc = subprocess.Popen(
+        [sys.executable, str(SCANNER), "serve", str(repo), "--encoding", "test_bytes", "--watch", "poll",
+         "--poll-interval", "60"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, env=env,
+    )
+    calls = iter(range(1, 100))
+
+    def call(method: str, **params):
+        request = {"jsonrpc": "2.0", "id": next(calls), "method": method, "params": params}
+        proc.stdin.write(json.dumps(request) + "\n")
+        proc.stdin.flush()
+        response = json.loads(proc.stdout.readline())
+        assert response["id"] == request["id"] and "error" not in response, response
+        return response["result"]
+
+    try:
+        assert tokens_by_path(call("json")) == tokens_by_path(scan(repo, "--no-cache"))
+        edited = "print('served')\n"
+        (repo / "src" / "main.py").write_text(edited)
+        refreshed = call("refresh")
+        assert tokens_by_path(refreshed)["src/main.py"] == len(edited)
+        assert f"main.py ({len(edited)} tokens)" in call("tree")["text"]
+        stats = call("stats")
+        assert stats["queries"] >= 3
+        assert stats["roots"][str(repo.resolve())]["files_rescanned"] >= 1
+        call("shutdown")
+        assert proc.wait(timeout=30) == 0
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+
+
+# Delta scan
+
+
+def test_is_path_ignored_matches_git(ignore_repo: Path):
+    ignore = sp.IgnoreEngine(ignore_repo)
+    visible = git_visible_files(ignore_repo)
+    for rel_path in IGNORE_TREE:
+        assert ignore.is_path_ignored(rel_path) == (rel_path not in visible), rel_path
+
+
+def test_delta_scan_matches_full_rescan(repo: Path, scan, tmp_path: Path):
+    snapshot = tmp_path / "snapshot.json"
+    snapshot.write_text(json.dumps(scan(repo)))
+
+    (repo / "src" / "main.py").write_text("import pkg\nprint(pkg.helper())\n")
+    (repo / "src" / "pkg" / "extra.py").write_text("VALUE = 2\n")
+    git(repo, "mv", "src/pkg/util.py", "src/pkg/helpers.py")
+    (repo / "src" / "pkg" / "__init__.py").write_text("from .helpers import helper\n")
+    git(repo, "rm", "-q", "README.md")
+    git(repo, "add", "-A")
+    git(repo, "commit", "-qm", "change")
+    (repo / "notes.md").write_text("# Untracked\n")
+
+    delta = scan(repo, "--since", "HEAD~1", "--snapshot", str(snapshot))
+    full = scan(repo, "--no-cache")
+    assert without_run_keys(delta) == without_run_keys(full)
+    # Only the changed files were read; the unchanged ones came from the snapshot
+    assert delta["delta"]["rescanned"] == 5
+    assert {f["path"] for f in delta["delta"]["files"]} >= {
+        "src/main.py", "src/pkg/extra.py", "src/pkg/helpers.py", "README.md", "notes.md",
+    }
+
+
+def test_merge_walk_order_matches_a_full_sort():
+    paths = ["a/b/c.py", "a/B.py", "a/z/x.py", "README.md", "docs/index.md", "Zeta/a.py", "a/b.py"]
+    ordered = sorted(paths, key=sp.walk_key)
+    for split in range(len(paths)):
+        items = sorted(paths[:split], key=sp.walk_key)
+        assert sp.merge_walk_order(items, paths[split:], sp.walk_key) == ordered
+
+
+def test_delta_scan_checks_only_changed_directories(repo: Path, scan, tmp_path: Path, monkeypatch):
+    write_tree(repo, {"docs/guide/intro.md": "# Intro\n", "lib/big.py": "x = 1\n" * 200})
+    git(repo, "add", "-A")
+    git(repo, "commit", "-qm", "more")
+    snapshot = scan(repo, "--max-tokens", "1000")
+
+    git(repo, "rm", "-rq", "src/pkg")
+    write_tree(repo, {"src/new/deep/mod.py": "VALUE = 3\n", "lib/big.py": "x = 2\n" * 300})
+    git(repo, "add", "-A")
+    git(repo, "commit", "-qm", "change")
+
+    checked = []
+    is_dir = Path.is_dir
+    monkeypatch.setattr(Path, "is_dir", lambda self: checked.append(self) or is_dir(self))
+    delta = sp.delta_scan(repo, build_encoding("test_bytes"), snapshot, "HEAD~1", 1000, source="git")
+    monkeypatch.undo()
+
+    full = scan(repo, "--no-cache", "--max-tokens", "1000")
+    for key in ("files", "skipped", "directories", "total_tokens", "oversized_tokens", "language_distribution"):
+        assert delta[key] == full[key], key
+    assert "src/pkg" not in delta["directories"]
+    assert {"src/new", "src/new/deep"} <= set(delta["directories"])
+    # Directories above no changed path (docs, docs/guide) were never stat'ed
+    assert {p.relative_to(repo.resolve()).as_posix() for p in checked} == {"src", "src/pkg", "src/new", "src/new/deep", "lib"}
+
+
+# Profiling
+
+
+def test_profile_and_trace_leave_the_result_unchanged(repo: Path, scan, run_scanner, tmp_path: Path):
+    trace = tmp_path / "trace.json"
+    proc = run_scanner(str(repo), "--encoding", "test_bytes", "--format", "json", "--no-cache",
+                       "--profile", "--trace", str(trace))
+    assert without_run_keys(json.loads(proc.stdout)) == without_run_keys(scan(repo, "--no-cache"))
+    assert "## Profile" in proc.stderr
+    assert "syscalls.scandir" in proc.stderr
+
+    events = json.loads(trace.read_text())["traceEvents"]
+    phases = {e["name"] for e in events if e.get("cat") == "phase"}
+    assert {"setup", "scan", "detectors", "output"} <= phases
+    assert {e["name"] for e in events if e.get("cat") == "file"} == set(REPO_FILES)
+    assert all(e["dur"] >= 0 for e in events if e["ph"] == "X")
+
+
+# Benchmark harness
+
+BENCH_PARAMS = {
+    "files": 150, "depth": 2, "fanout": 3, "languages": "python=3,markdown=1,json=1",
+    "size_median": 400, "size_sigma": 0.8, "ignore_rules": 8, "ignored_ratio": 0.1,
+    "binary_ratio": 0.05, "workspaces": 0, "seed": 7,
+}
+
+
+@pytest.fixture(scope="module")
+def bench():
+    spec = importlib.util.spec_from_file_location("bench_scan", SCRIPTS / "bench-scan.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def tree_contents(root: Path) -> dict[str, bytes]:
+    return {p.relative_to(root).as_posix(): p.read_bytes() for p in root.rglob("*") if p.is_file()}
+
+
+def test_bench_generator_is_deterministic_and_scannable(bench, tmp_path: Path, scan):
+    info = bench.generate_repo(tmp_path / "one", BENCH_PARAMS)
+    bench.generate_repo(tmp_path / "two", BENCH_PARAMS)
+    assert tree_contents(tmp_path / "one") == tree_contents(tmp_path / "two")
+
+    result = scan(tmp_path / "one", "--no-cache")
+    generated = [f for f in result["files"] if f["path"] not in (".gitignore", ".bench-repo.json")]
+    binary = [s for s in result["skipped"] if s["reason"] == "binary"]
+    # Ignored output is pruned; every other generated file is scanned or skipped as binary
+    assert len(generated) + len(binary) == info["files"]
+    assert not any(f["path"].endswith(".log") or "build" in f["path"].split("/") for f in generated)
+
+
+def test_bench_compare_flags_regressions(bench):
+    baseline = {"scan": {"seconds": 1.0, "peak_rss_mb": 100.0}, "tiny": {"seconds": 0.001}}
+    results = {"scan": {"seconds": 1.5, "peak_rss_mb": 101.0}, "tiny": {"seconds": 0.002}}
+    regressions = bench.compare(results, baseline, 0.2)
+    assert len(regressions) == 1 and regressions[0].startswith("scan seconds")
+
+
+# Lazy encoding, --no-tokens and --encoding-file
+
+
+def test_no_tokens_lists_structure_only(repo: Path, scan):
+    result = scan(repo, "--no-tokens")
+    assert result["files"] == [
+        {"path": f["path"], "size_bytes": f["size_bytes"]} for f in scan(repo, "--no-cache")["files"]
+    ]
+    assert result["total_tokens"] is None
+    assert result["total_files"] == len(REPO_FILES)
+    assert result["language_distribution"]["by_files"] == {"python": 3, "markdown": 1}
+
+
+def test_cached_rescan_never_loads_the_encoding(repo: Path, scan, tmp_path: Path):
+    cold = scan(repo)
+    # Without the plugin on the path the encoding cannot load, so a hit must not need it
+    env_path = os.environ.get("PYTHONPATH", "")
+    proc = subprocess.run(
+        [sys.executable, str(SCANNER), str(repo), "--encoding", "test_bytes", "--format", "json"],
+        capture_output=True, text=True, check=False,
+        env={**os.environ, "PYTHONPATH": env_path, "XDG_CACHE_HOME": str(tmp_path / "cache")},
+    )
+    assert proc.returncode == 0, proc.stderr
+    warm = json.loads(proc.stdout)
+    assert warm["cache"]["hits"] == len(REPO_FILES)
+    assert without_run_keys(warm) == without_run_keys(cold)
+
+
+@pytest.fixture
+def bpe_file(tmp_path: Path) -> Path:
+    """A cl100k_base.tiktoken file with the 256 single bytes as its only tokens."""
+    path = tmp_path / "cl100k_base.tiktoken"
+    path.write_text("".join(f"{base64.b64encode(bytes([i])).decode()} {i}\n" for i in range(256)))
+    return path
+
+
+def test_encoding_file_builds_the_encoding_offline(repo: Path, scan, run_scanner, bpe_file: Path):
+    proc = run_scanner(str(repo), "--encoding-file", str(bpe_file), "--format", "json", "--no-cache")
+    assert "is not the published cl100k_base BPE file" in proc.stderr
+    assert tokens_by_path(json.loads(proc.stdout)) == tokens_by_path(scan(repo, "--no-cache"))
+
+
+def test_modified_encoding_file_is_keyed_by_its_hash(repo: Path, run_scanner, bpe_file: Path, tmp_path: Path):
+    data = bpe_file.read_bytes()
+    name = sp.file_encoding_name("cl100k_base", data)
+    assert name == f"cl100k_base@{hashlib.sha256(data).hexdigest()[:16]}"
+    assert sp.file_encoding_name("test_bytes", data) == "test_bytes"
+
+    cold = json.loads(run_scanner(str(repo), "--encoding-file", str(bpe_file), "--format", "json").stdout)
+    warm = json.loads(run_scanner(str(repo), "--encoding-file", str(bpe_file), "--format", "json").stdout)
+    assert warm["cache"]["hits"] == len(REPO_FILES)
+    assert warm["total_tokens"] == cold["total_tokens"]
+    with sqlite3.connect(str(tmp_path / "cache" / "project-profiler" / "tokens.sqlite3")) as conn:
+        assert {row[0] for row in conn.execute("SELECT encoding FROM tokens")} == {name}
+
+
+# Several encodings
+
+
+def test_tokens_per_encoding(repo: Path, scan):
+    encodings = [build_encoding("test_bytes"), build_encoding("test_pairs")]
+    result = scan(repo, "--encoding", "test_bytes,test_pairs")
+
+    for record in result["files"]:
+        content = REPO_FILES[record["path"]]
+        expected = {enc.name: len(enc.encode_ordinary(content)) for enc in encodings}
+        assert record["tokens_by_encoding"] == expected
+        assert record["tokens"] == expected["test_bytes"]
+    pairs_total = sum(len(encodings[1].encode_ordinary(c)) for c in REPO_FILES.values())
+    assert pairs_total < result["total_tokens"]
+    assert result["total_tokens_by_encoding"] == {"test_bytes": result["total_tokens"], "test_pairs": pairs_total}
+
+    # Token-store entries are per encoding, so a single-encoding run reuses them
+    single = scan(repo, "--encoding", "test_pairs")
+    assert single["token_store"]["tokenized"] == 0
+    assert single["total_tokens"] == pairs_total
+
+
+# Directory rollup
+
+
+def subtree_totals(result: dict) -> dict[str, tuple[int, int]]:
+    """(files, tokens) of every directory, summed from the file records."""
+    totals: dict[str, tuple[int, int]] = {}
+    for record in result["files"]:
+        parts = record["path"].split("/")[:-1]
+        for depth in range(1, len(parts) + 1):
+            files, tokens = totals.get("/".join(parts[:depth]), (0, 0))
+            totals["/".join(parts[:depth])] = (files + 1, tokens + record["tokens"])
+    return totals
+
+
+def test_top_directories_roll_up_their_subtrees(layered: Path, scan, run_scanner):
+    result = scan(layered, "--no-cache", "--top-dirs", "4")
+    totals = subtree_totals(result)
+    largest = sorted(totals.items(), key=lambda item: -item[1][1])[:4]
+    assert [(d["path"], (d["files"], d["tokens"])) for d in result["top_directories"]] == largest
+    for d in result["top_directories"]:
+        assert sum(d["language_distribution"]["by_tokens"].values()) == d["tokens"]
+
+    records = scan_ndjson(run_scanner, layered, "--no-cache", "--top-dirs", "4")
+    assert next(r for r in records if r["type"] == "top_directories")["data"] == result["top_directories"]
+
+
+def test_summary_directory_depth(layered: Path, scan, run_scanner):
+    summary = run_scanner(str(layered), "--encoding", "test_bytes", "--no-cache", "--depth", "1").stdout
+    structure = summary.split("## Directory Structure (depth 1)\n", 1)[1]
+    totals = subtree_totals(scan(layered))
+    for top in ("api", "cli", "core", "web"):
+        assert f"{top}/ ({totals[top][1]:,} tokens)" in structure
+    assert "sub0/" not in structure
+
+
+def test_directory_index_keeps_names_not_records():
+    index = sp.DirectoryIndex()
+    records = [
+        ("directory", {"path": "src"}),
+        ("file", {"path": "src/a.py", "tokens": 5, "size_bytes": 9, "symbols": []}),
+        ("file", {"path": "README.md", "tokens": 2, "size_bytes": 2}),
+    ]
+    assert list(index.track(iter(records))) == records
+    assert index.nodes["src"]["entries"] == [("a.py", 5)]
+    assert (index.nodes[""]["files"], index.nodes[""]["tokens"], index.nodes[""]["bytes"]) == (2, 7, 11)
+
+
+@pytest.mark.parametrize("args, builds", [
+    (["--format", "ndjson"], False),
+    (["--format", "json"], False),
+    (["--format", "ndjson", "--top-dirs", "2"], True),
+    (["--format", "tree"], True),
+    (["--format", "summary"], True),
+])
+def test_directory_index_is_built_only_when_read(layered: Path, monkeypatch, capsys, args: list[str], builds: bool):
+    built = []
+
+    class RecordingIndex(sp.DirectoryIndex):
+        def __init__(self):
+            super().__init__()
+            built.append(self)
+
+    monkeypatch.setattr(sp, "DirectoryIndex", RecordingIndex)
+    monkeypatch.setattr(sys, "argv", ["scan-project.py", str(layered), "--no-tokens", "--no-cache", *args])
+    sp.main()
+    assert capsys.readouterr().out
+    assert bool(built) == builds
+
+
+# Batch mode
+
+
+def test_batch_continues_past_a_failing_root(repo: Path, layered: Path, scan, run_scanner, tmp_path: Path):
+    not_a_dir = tmp_path / "file.txt"
+    not_a_dir.write_text("not a directory\n")
+    roots_file = tmp_path / "roots.txt"
+    roots_file.write_text(f"# roots\n{layered}\n")
+
+    proc = run_scanner("batch", str(repo), str(not_a_dir), "--roots-from", str(roots_file),
+                       "--encoding", "test_bytes", "--concurrency", "2", check=False)
+    assert proc.returncode == 1
+    records = [json.loads(line) for line in proc.stdout.splitlines()]
+    repos = {r["root"]: r for r in records if r["type"] == "repo"}
+    assert records[-1]["type"] == "batch"
+    assert (records[-1]["repos"], records[-1]["ok"], records[-1]["failed"]) == (3, 2, 1)
+
+    assert repos[str(not_a_dir)]["status"] == "error"
+    assert "not a directory" in repos[str(not_a_dir)]["error"]
+    for root in (repo, layered):
+        assert repos[str(root)]["status"] == "ok"
+        assert without_run_keys(repos[str(root)]["result"]) == without_run_keys(scan(root, "--no-cache"))
+
+
+# Archives
+
+
+def make_archive(src: Path, archive: Path, prefix: str) -> Path:
+    members = sorted(p for p in src.rglob("*") if p.is_file())
+    if archive.suffix == ".zip":
+        with zipfile.ZipFile(archive, "w") as zf:
+            for path in members:
+                zf.write(path, f"{prefix}/{path.relative_to(src).as_posix()}")
+    else:
+        with tarfile.open(archive, "w:gz") as tf:
+            for path in members:
+                tf.add(path, f"{prefix}/{path.relative_to(src).as_posix()}")
+    return archive
+
+
+@pytest.mark.parametrize("suffix", [".tar.gz", ".zip"])
+def test_archive_matches_directory(repo: Path, scan, tmp_path: Path, suffix: str):
+    write_tree(repo, {
+        ".gitignore": "build-out/\n*.tmp\n",
+        "build-out/generated.py": "x = 1\n" * 50,
+        "src/scratch.tmp": "scratch\n",
+        "pyproject.toml": '[project]\nname = "demo"\nversion = "1.0"\n',
+    })
+    shutil.rmtree(repo / ".git")
+    archive = make_archive(repo, tmp_path / f"release{suffix}", "release-1.0")
+
+    from_dir = scan(repo)
+    from_archive = scan(archive)
+    assert "build-out/generated.py" not in tokens_by_path(from_dir)
+    assert without_run_keys(from_archive) == without_run_keys(from_dir)
+    # Members ignored by .gitignore are never tokenized; the rest were counted by the directory scan
+    assert from_archive["token_store"]["tokenized"] == 0
+
+
+# Symbols
+
+SYMBOL_TREE = {
+    "src/greet.py": (
+        "import sys\n\n\n"
+        "class Greeter:\n"
+        '    """Say hi."""\n\n'
+        "    def hi(self):\n"
+        '        return "hi"\n\n\n'
+        "def main():\n"
+        "    print(Greeter().hi())\n\n\n"
+        "async def run():\n"
+        "    return 1\n"
+    ),
+    "src/widget.ts": (
+        "export interface Props {\n  name: string;\n}\n\n"
+        "export class Widget {\n  render() {\n    return 1;\n  }\n}\n\n"
+        "export async function load(url: string) {\n  return fetch(url);\n}\n\n"
+        "const helper = (x) => x + 1;\n"
+    ),
+    "cmd/main.go": (
+        "package main\n\ntype Server struct {\n\tport int\n}\n\n"
+        "func (s *Server) Run() error {\n\treturn nil\n}\n\nfunc main() {\n}\n"
+    ),
+    "src/lib.rs": (
+        "pub struct Config {\n    name: String,\n}\n\n"
+        "impl Config {\n    pub fn new() -> Self {\n        Config { name: String::new() }\n    }\n}\n\n"
+        "pub fn run() {}\n"
+    ),
+}
+
+
+def test_symbols_cover_their_line_spans(tmp_path: Path, scan, run_scanner):
+    root = tmp_path / "symbols"
+    write_tree(root, SYMBOL_TREE)
+    result = scan(root, "--symbols", "--no-cache")
+    symbols = {f["path"]: f["symbols"] for f in result["files"]}
+
+    assert [(s["name"], s["kind"], s["lines"]) for s in symbols["src/greet.py"]] == [
+        ("Greeter", "class", [4, 8]), ("main", "function", [11, 12]), ("run", "function", [15, 16]),
+    ]
+    assert [(s["name"], s["kind"]) for s in symbols["src/widget.ts"]] == [
+        ("Props", "type"), ("Widget", "class"), ("load", "function"), ("helper", "function"),
+    ]
+    assert [(s["name"], s["kind"]) for s in symbols["cmd/main.go"]] == [
+        ("Server", "type"), ("Run", "function"), ("main", "function"),
+    ]
+    assert [(s["name"], s["kind"]) for s in symbols["src/lib.rs"]] == [
+        ("Config", "class"), ("Config", "impl"), ("run", "function"),
+    ]
+    # test_bytes has one token per byte, so a symbol's tokens are the bytes of its lines.
+    for path, found in symbols.items():
+        lines = SYMBOL_TREE[path].splitlines(keepends=True)
+        for s in found:
+            start, end = s["lines"]
+            assert s["tokens"] == len("".join(lines[start - 1:end]).encode()), (path, s["name"])
+
+    assert "symbols" not in scan(root, "--no-cache")["files"][0]
+    summary = run_scanner(str(root), "--encoding", "test_bytes", "--symbols", "--no-cache").stdout
+    assert "Symbols (by tokens)" in summary
+    assert "src/greet.py:Greeter (class, L4-8)" in summary
+
+
+# Context packs
+
+PACK_TREE = {
+    "README.md": "# Demo\n\nA small library.\n",
+    "package.json": '{"name": "demo", "main": "./lib/index.js"}\n',
+    "CHANGELOG.md": "## 1.0\n- first\n",
+    "lib/index.js": "module.exports = require('./core');\n",
+    "lib/core.js": "exports.run = () => 1;\n" * 4,
+    "lib/vendor.js": "var x = 1;\n" * 400,
+    "test/core.test.js": "test('run', () => {});\n",
+}
+
+
+def test_pack_fits_the_budget_in_reading_order(tmp_path: Path, scan, run_scanner):
+    root = tmp_path / "pack"
+    write_tree(root, PACK_TREE)
+    budget = 250
+    result = scan(root, "--pack", str(budget), "--no-cache")
+    pack = result["pack"]
+    tokens = tokens_by_path(result)
+
+    paths = [p["path"] for p in pack["paths"]]
+    assert pack["budget"] == budget
+    assert pack["tokens"] == sum(tokens[p] for p in paths) <= budget
+    assert pack["files"] == len(paths)
+    assert "lib/vendor.js" not in paths
+    assert paths[:2] == ["README.md", "package.json"]
+    kinds = {p["path"]: p["kind"] for p in pack["paths"]}
+    assert kinds["lib/index.js"] == "entry_point"
+    assert kinds["test/core.test.js"] == "test"
+    assert paths.index("lib/index.js") < paths.index("lib/core.js") < paths.index("test/core.test.js")
+
+    tight = scan(root, "--pack", "80", "--no-cache")["pack"]
+    assert 0 < tight["tokens"] <= 80
+    assert tight["paths"][0]["path"] == "README.md"
+
+    # A budget that holds everything packs everything.
+    everything = scan(root, "--pack", str(sum(tokens.values())), "--no-cache")["pack"]
+    assert sorted(p["path"] for p in everything["paths"]) == sorted(tokens)
+
+    text = run_scanner(str(root), "--encoding", "test_bytes", "--pack", str(budget),
+                       "--format", "pack", "--no-cache").stdout
+    assert text.startswith(f"<!-- context pack: {len(paths)} files, {pack['tokens']} of {budget} tokens -->\n")
+    for path in paths:
+        assert f'<file path="{path}" tokens="{tokens[path]}">\n{PACK_TREE[path]}</file>\n' in text
+
+    assert run_scanner(str(root), "--pack", "100", "--no-tokens", check=False).returncode == 1
+
+
+# Import graph
+
+IMPORT_TREE = {
+    "src/main.py": "import os\nfrom pkg import util\nimport pkg\n",
+    "src/pkg/__init__.py": "from . import util\nfrom .util import helper\n",
+    "src/pkg/util.py": "def helper(): pass\n",
+    "web/index.ts": "import { a } from './lib';\nconst b = require('./b.js');\nimport React from 'react';\n",
+    "web/lib.ts": "export const a = 1;\n",
+    "web/b.js": "module.exports = 2;\n",
+    "go.mod": "module example.com/demo\n\ngo 1.21\n",
+    "cmd/app/main.go": 'package main\n\nimport (\n\t"fmt"\n\t"example.com/demo/internal/db"\n)\n',
+    "internal/db/db.go": "package db\n",
+    "rs/src/main.rs": "mod config;\nuse crate::config::Config;\n",
+    "rs/src/config.rs": "pub struct Config;\n",
+}
+
+
+def test_imports_resolve_to_repo_files(tmp_path: Path, scan, run_scanner):
+    root = tmp_path / "imports"
+    write_tree(root, IMPORT_TREE)
+    graph = scan(root, "--imports")["import_graph"]
+
+    assert sorted(map(tuple, graph["edges"])) == [
+        ("cmd/app/main.go", "internal/db/db.go"),
+        ("rs/src/main.rs", "rs/src/config.rs"),
+        ("src/main.py", "src/pkg/__init__.py"),
+        ("src/main.py", "src/pkg/util.py"),
+        ("src/pkg/__init__.py", "src/pkg/util.py"),
+        ("web/index.ts", "web/b.js"),
+        ("web/index.ts", "web/lib.ts"),
+    ]
+    centrality = {c["path"]: c for c in graph["centrality"]}
+    assert graph["centrality"][0]["path"] == "src/pkg/util.py"
+    assert (centrality["src/pkg/util.py"]["in_degree"], centrality["src/main.py"]["out_degree"]) == (2, 2)
+    assert sum(c["pagerank"] for c in graph["centrality"]) == pytest.approx(1, abs=1e-3)
+
+    # The specifiers live in the scan cache, so a warm run rebuilds the same graph.
+    assert scan(root, "--imports")["import_graph"] == graph
+    assert "import_graph" not in scan(root)
+    summary = run_scanner(str(root), "--encoding", "test_bytes", "--imports").stdout
+    assert "Import Graph" in summary